@@ -0,0 +1,94 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Times the split assignment of `miami/create_test_sets.py` on synthetic corpora of up to millions of
+# utterances, and checks it against the original list-scan implementation on the smaller ones
+import os
+import sys
+import time
+import random
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "miami"))
+from create_test_sets import assign_splits
+
+
+def make_corpus(num_utterances: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    durations = np.round(rng.gamma(2.0, 1.2, num_utterances), 3)
+    offsets = np.round(np.cumsum(durations + 0.2), 3)
+    code_switched = rng.random(num_utterances) < 0.15
+    empty = rng.random(num_utterances) < 0.2
+    yaml_data = [
+        {
+            "wav": f"clips/file{idx // 2000}_p{idx % 2000}.wav",
+            "offset": float(offsets[idx]),
+            "duration": float(durations[idx]),
+            "code_switched": bool(code_switched[idx]),
+        }
+        for idx in range(num_utterances)
+    ]
+    transcript = [f"utterance {idx}" for idx in range(num_utterances)]
+    translation = ["" if empty[idx] else f"translation {idx}" for idx in range(num_utterances)]
+    return yaml_data, transcript, translation
+
+
+def legacy_assign_splits(yaml_data: list, transcript: list, translation: list) -> pd.DataFrame:
+    """The mapping as built before the split assignment was vectorized"""
+    data_type, files, offsets, durations, local_file_lines = [], [], [], [], []
+    mono_map = {}
+    for idx in range(len(yaml_data)):
+        local_file_lines.append(yaml_data[idx]["wav"].split("/")[1].split("_")[-1].split(".")[0].replace("p", ""))
+        files.append(yaml_data[idx]["wav"].split("/")[1].split("_")[0])
+        offsets.append(yaml_data[idx]["offset"])
+        durations.append(yaml_data[idx]["duration"])
+        if translation[idx] not in ["", "\n"] and transcript[idx] != translation[idx]:
+            if yaml_data[idx]["duration"] < 0.3:
+                data_type.append("n/a")
+            elif yaml_data[idx]["code_switched"]:
+                data_type.append("cs")
+            else:
+                data_type.append("mono")
+                mono_map[len(mono_map)] = idx
+        else:
+            data_type.append("n/a")
+
+    split_mono_idx = random.sample(list(range(len(mono_map))), len(mono_map) // 2)
+    global_map_from_mono = sorted([mono_map[cur_idx] for cur_idx in split_mono_idx])
+    data_type = [dtype if idx not in global_map_from_mono else "mono_train" for idx, dtype in enumerate(data_type)]
+    mapping_val = pd.DataFrame({"global_idx": list(range(len(data_type))), "split": data_type, "file": files,
+                                "file_line_num": local_file_lines, "offset": offsets, "duration": durations})
+    mapping_val["cs_type"] = mapping_val.split.apply(lambda x: x if x == "n/a" else ("cs" if "cs" in x else "mono"))
+    mapping_val["split"] = mapping_val.split.apply(lambda x: x if x == "n/a" else ("train" if "train" in x else "test"))
+    return mapping_val
+
+
+def bench(sizes: list, check_up_to: int):
+    for num_utterances in sizes:
+        corpus = make_corpus(num_utterances)
+        random.seed(1)
+        start = time.perf_counter()
+        *_, mapping_val = assign_splits(*corpus)
+        elapsed = time.perf_counter() - start
+        print(f"{num_utterances:>9} utterances: {elapsed:8.3f}s ({num_utterances / elapsed:,.0f} utterances/s)")
+
+        if num_utterances <= check_up_to:
+            random.seed(1)
+            start = time.perf_counter()
+            expected = legacy_assign_splits(*corpus)
+            legacy_elapsed = time.perf_counter() - start
+            same = expected.to_csv(index=None) == mapping_val.to_csv(index=None)
+            print(f"{'':>9} legacy:     {legacy_elapsed:8.3f}s, identical mapping: {same}")
+            assert same
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 45_000, 200_000, 1_000_000])
+    parser.add_argument("--check-up-to", type=int, default=45_000, help="largest size also run with the legacy scan")
+    args = parser.parse_args()
+    bench(args.sizes, args.check_up_to)
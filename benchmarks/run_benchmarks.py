@@ -0,0 +1,162 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Times each stage of the splitting pipeline on synthetic corpora of increasing size (see `synthetic_corpus.py`),
+# offline and without the LDC data, and reports how each stage scales: its time and throughput per size and the
+# exponent of a power-law fit (1 is linear). Each stage also writes its `cs_data.profiling` report, so the
+# breakdown of a stage into its sub-steps is in the results too.
+#
+#   python benchmarks/run_benchmarks.py --sizes 10000 100000 1000000 --output bench.json
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+
+import numpy as np
+
+from synthetic_corpus import make_fisher_corpus, make_miami_corpus
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_ROOT)  # for `cs_data`
+from cs_data.profile_report import load_reports, stage_rows
+
+# (dataset, script) in the order `create_datasets.sh` runs them, the LID stage reads the Miami splits
+STAGES = [
+    ("miami", "process_miami_data.py"),
+    ("miami", "create_test_sets.py"),
+    ("fisher", "extract_cs_words_from_raw_data.py"),
+    ("fisher", "make_cs_splits.py"),
+    ("fisher", "combine_eval_splits.py"),
+    ("fisher", "split_train_and_make_lid.py"),
+]
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def stage_name(script: str) -> str:
+    return os.path.splitext(script)[0]
+
+
+def run_stage(work_path: str, dataset: str, script: str, profile_dir: str) -> dict:
+    """Runs one script in its dataset directory, returns its wall and CPU time and peak RSS (with its workers)"""
+    env = {**os.environ, "PYTHONPATH": REPO_ROOT, "CS_DATA_PROFILE_DIR": profile_dir}
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_ROOT, dataset, script)],
+        cwd=os.path.join(work_path, dataset),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    stderr = proc.stderr.read()
+    _, status, usage = os.wait4(proc.pid, 0)  # the usage includes the pool workers the script waited for
+    wall = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status):
+        sys.stderr.write(stderr.decode(errors="replace"))
+        raise RuntimeError(f"{dataset}/{script} failed in {work_path}")
+    return {
+        "wall_s": round(wall, 4),
+        "cpu_s": round(usage.ru_utime + usage.ru_stime, 4),
+        "peak_rss_mb": round(usage.ru_maxrss * RSS_UNIT / (1 << 20), 1),
+    }
+
+
+def prepare_work_path(work_path: str, num_lines: int, miami_lines: int, seed: int) -> float:
+    """Generates the inputs of both datasets, returns the seconds it took"""
+    start = time.perf_counter()
+    shutil.rmtree(work_path, ignore_errors=True)
+    make_fisher_corpus(work_path, num_lines, seed)
+    make_miami_corpus(work_path, miami_lines, seed)
+    # the lexicon of the Miami scripts is read relative to their working directory
+    os.symlink(os.path.join(REPO_ROOT, "miami", "common_words"), os.path.join(work_path, "miami", "common_words"))
+    os.makedirs(os.path.join(work_path, "miami", "output", "miami"))
+    return time.perf_counter() - start
+
+
+def run_size(work_dir: str, num_lines: int, miami_fraction: float, seed: int, stages: list, keep: bool) -> dict:
+    work_path = os.path.join(work_dir, f"lines-{num_lines}")
+    miami_lines = max(40, int(num_lines * miami_fraction))
+    print(f"{num_lines:,} Fisher lines, {miami_lines:,} Miami utterances: generating...", flush=True)
+    result = {"fisher_lines": num_lines, "miami_lines": miami_lines, "stages": {}}
+    result["generate_s"] = round(prepare_work_path(work_path, num_lines, miami_lines, seed), 3)
+
+    for dataset, script in STAGES:
+        name = stage_name(script)
+        profile_dir = os.path.join(work_path, "profiles", name)
+        timing = run_stage(work_path, dataset, script, profile_dir)
+        if name in stages:
+            timing["lines"] = miami_lines if dataset == "miami" else num_lines
+            timing["lines_per_s"] = round(timing["lines"] / timing["wall_s"], 1)
+            timing["steps"] = {key.partition(":")[2]: row for key, row in stage_rows(load_reports(profile_dir)).items()}
+            result["stages"][name] = timing
+            print(f"  {name:<34} {timing['wall_s']:>9.2f}s {timing['lines_per_s']:>12,.0f} lines/s {timing['peak_rss_mb']:>8.0f}MB", flush=True)
+    if not keep:
+        shutil.rmtree(work_path)
+    return result
+
+
+def scaling_exponent(lines: list, seconds: list) -> float:
+    """The slope of log(time) over log(size), None with fewer than two sizes"""
+    if len(lines) < 2:
+        return None
+    return float(np.polyfit(np.log(lines), np.log(np.maximum(seconds, 1e-6)), 1)[0])
+
+
+def report(results: list, stages: list):
+    sizes = [result["fisher_lines"] for result in results]
+    print(f"\n{'stage':<34}" + "".join(f"{size:>13,}" for size in sizes) + f"{'exponent':>10}")
+    for name in stages:
+        timings = [result["stages"][name] for result in results]
+        exponent = scaling_exponent([timing["lines"] for timing in timings], [timing["wall_s"] for timing in timings])
+        exponent_text = f"{exponent:.2f}" if exponent is not None else "-"
+        print(f"{name:<34}" + "".join(f"{timing['wall_s']:>12.2f}s" for timing in timings) + f"{exponent_text:>10}")
+        print(f"{'  lines/s':<34}" + "".join(f"{timing['lines_per_s']:>13,.0f}" for timing in timings))
+
+
+def plot(results: list, stages: list, path: str):
+    try:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print(f"Skipping {path}, install matplotlib to plot the scaling curves")
+        return
+    fig, ax = plt.subplots(figsize=(8, 5))
+    for name in stages:
+        timings = [result["stages"][name] for result in results]
+        ax.loglog([timing["lines"] for timing in timings], [timing["wall_s"] for timing in timings], marker="o", label=name)
+    ax.set_xlabel("lines")
+    ax.set_ylabel("wall time (s)")
+    ax.grid(True, which="both", alpha=0.3)
+    ax.legend(fontsize="small")
+    fig.savefig(path, bbox_inches="tight")
+    print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 30_000, 100_000], help="Fisher lines per run")
+    parser.add_argument("--miami-fraction", type=float, default=0.25, help="Miami utterances per Fisher line")
+    parser.add_argument("--stages", nargs="+", default=[stage_name(script) for _, script in STAGES], help="stages to report (all of them run)")
+    parser.add_argument("--work-dir", default="bench_work", help="where the synthetic corpora are generated")
+    parser.add_argument("--keep", action="store_true", help="keep each generated corpus and its outputs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the results as JSON")
+    parser.add_argument("--plot", default=None, help="plot the scaling curves to this image (needs matplotlib)")
+    args = parser.parse_args()
+
+    unknown = set(args.stages) - {stage_name(script) for _, script in STAGES}
+    if unknown:
+        parser.error(f"unknown stages {sorted(unknown)}")
+    results = [run_size(args.work_dir, size, args.miami_fraction, args.seed, args.stages, args.keep) for size in sorted(args.sizes)]
+    report(results, args.stages)
+    if args.output:
+        with open(args.output, "w") as fout:
+            json.dump(results, fout, indent=1)
+    if args.plot:
+        plot(results, args.stages, args.plot)
@@ -0,0 +1,270 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Generates synthetic Fisher and Miami inputs in the layout the dataset scripts read, so the pipeline can be
+# run and timed without the LDC corpora or the network:
+#   fisher/fisher-callhome-corpus-tags/corpus/ldc/fisher_{split}.es   (Spanish with `<foreign>` tags)
+#   fisher/fisher-callhome-corpus{,-tags}/mapping/fisher_{split}       (conversation and TDF line ids)
+#   fisher/splits_data/{split}/fisher_{split}.{es,en,en.0,en.1,yaml}  (clean text, translations, clip list)
+#   fisher/speech/fisher_{split}/{conversation}/*.wav                 (the extracted 16K utterances)
+#   fisher/ldc/LDC2010T04/data/transcripts/*.tdf, fisher/ldc/LDC2010S01/data/speech/*.sph   (with `--ldc`)
+#   miami/data/miami/beta/*.cha, miami/data/miami/audio/*.wav
+# The utterance WAVs are hardlinks to a small pool of short noise clips, so millions of them are quick to make
+# and the archive stages still read real audio. The text and tags are random, but every kind of `<foreign>`
+# tag mistake that `foreign_tags.py` handles and the CHAT markup that `process_miami_data.py` cleans shows up.
+#
+#   python benchmarks/synthetic_corpus.py /tmp/bench --fisher-lines 100000 --miami-lines 25000
+import os
+import wave
+import random
+import argparse
+
+import numpy as np
+
+SPLIT_SHARES = {"dev": 3979, "dev2": 3961, "test": 3641, "train": 138819}  # the line counts of the real splits
+SPANISH = "hola como estas bien gracias que pero y la el de no si mira entonces bueno casa trabajo familia".split()
+ENGLISH = "hello how are you fine thanks the and but okay so well house really yeah internet meeting".split()
+FOREIGN_TAGS = [
+    '<foreign lang="English">{0}</foreign>',
+    '<foreign lang="English">{0}</foreign>',
+    '<foreign lang="English">{0}</foreign>',
+    '<foreign lang+"English">{0}</foreign>',
+    '<foreign lan="English">{0}</foreign>',
+    '<foreign lang="English">{0} /foreign>',
+    '<foreign lang="English">(())</foreign>',
+    '<foreign lang="English"> </foreign>',
+    '<foreign lang="English">{0}</foreign> y <foreign lang="English">{1}</foreign>',
+]
+SAMPLE_RATE = 16000
+NUM_TEMPLATE_CLIPS = 64
+CHAT_MARKS = ["[/]", "[//]", "[!]", "[?]", "[*]", "[=! laughs]"]
+CHAT_ENDINGS = [".", ".", ".", "?", "!", "+...", "+//.", "+/.", "+/?"]
+
+
+def split_sizes(num_lines: int) -> dict:
+    """`num_lines` spread over the splits in the proportions of the real corpus"""
+    total = sum(SPLIT_SHARES.values())
+    sizes = {split: max(1, num_lines * share // total) for split, share in SPLIT_SHARES.items()}
+    sizes["train"] += max(0, num_lines - sum(sizes.values()))
+    return sizes
+
+
+def write_lines(path: str, lines: list):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fout:
+        fout.write("\n".join(lines) + "\n")
+
+
+def write_wav(path: str, samples: np.ndarray, sample_rate: int = SAMPLE_RATE, channels: int = 1):
+    with wave.open(path, "wb") as fout:
+        fout.setnchannels(channels)
+        fout.setsampwidth(2)
+        fout.setframerate(sample_rate)
+        fout.writeframes(np.ascontiguousarray(samples, dtype="<i2").tobytes())
+
+
+def noise(num_samples: int, rng: np.random.Generator) -> np.ndarray:
+    return (rng.standard_normal(num_samples) * 3000).astype(np.int16)
+
+
+##### Fisher #####
+def tagged_line(rng: random.Random) -> str:
+    """A Spanish line as in the tagged corpus, about a quarter of them with English `<foreign>` spans"""
+    words = [rng.choice(SPANISH) for _ in range(rng.randint(1, 12))]
+    draw = rng.random()
+    if draw < 0.25:
+        english = [" ".join(rng.choice(ENGLISH) for _ in range(rng.randint(1, 3))), rng.choice(ENGLISH)]
+        words.insert(rng.randint(0, len(words)), rng.choice(FOREIGN_TAGS).format(*english))
+    elif draw < 0.27:
+        words.insert(0, '<foreign lang="English"> meeting <foreign lang="English">')
+    elif draw < 0.3:
+        words.append("<laugh>")
+    return " ".join(words)
+
+
+def clean_line(line: str) -> str:
+    """The line as in the corpus without tags (`splits_data`)"""
+    tokens = line.replace("<", " <").replace(">", "> ").split()
+    return " ".join(
+        token for token in tokens if not token.startswith(("<", "lan")) and "foreign>" not in token
+    )
+
+
+def conversation_names(num_conversations: int, rng: random.Random) -> list:
+    """Sorted like the mapping files, so the YAML (listed by conversation) follows the line order"""
+    names = {
+        "2005%04d_%06d_%03d_fsp" % (rng.randint(0, 9999), rng.randint(0, 999999), rng.randint(0, 999))
+        for _ in range(num_conversations)
+    }
+    while len(names) < num_conversations:
+        names.add("2005%04d_%06d_%03d_fsp" % (rng.randint(0, 9999), rng.randint(0, 999999), rng.randint(0, 999)))
+    return sorted(names)
+
+
+def template_clips(path: str, rng: np.random.Generator, max_seconds: float) -> list:
+    """A pool of noise clips of 0.05s up to `max_seconds`, which the utterances link to"""
+    os.makedirs(path, exist_ok=True)
+    clip_paths = []
+    for idx, seconds in enumerate(np.linspace(0.05, max_seconds, NUM_TEMPLATE_CLIPS)):
+        clip_path = os.path.join(path, f"template{idx:02d}.wav")
+        write_wav(clip_path, noise(int(seconds * SAMPLE_RATE), rng))
+        clip_paths.append(clip_path)
+    return clip_paths
+
+
+def write_tdf(path: str, conversation: str, segments: list):
+    header = [
+        "file;unicode\tchannel;int\tstart;float\tend;float\tspeaker;unicode\tspeakerType;unicode\t"
+        "speakerDialect;unicode\ttranscript;unicode\tsection;int\tturn;int\tsegment;int\tsectionType;unicode\tsuType;unicode",
+        ";;MM sectionTypes\t[u'report', u'nontrans', None]",
+        ";;MM sectionBoundaries\t[0.0, 9999999.0]",
+    ]
+    lines = [
+        f"{conversation}.sph\t{channel}\t{start:.2f}\t{end:.2f}\tspeaker {channel}\tmale\tnative\t{text}\t0\t{idx}\t0\t\t"
+        for idx, (channel, start, end, text) in enumerate(segments)
+    ]
+    write_lines(path, header + lines)
+
+
+def write_sph(path: str, num_samples: int, rng: np.random.Generator, sample_rate: int = 8000):
+    """A 2 channel PCM SPHERE file (the real ones are u-law, which sox decodes the same way)"""
+    fields = [
+        "NIST_1A", "   1024", "sample_count -i %d" % num_samples, "channel_count -i 2", "sample_rate -i %d" % sample_rate,
+        "sample_n_bytes -i 2", "sample_byte_format -s2 01", "sample_coding -s3 pcm", "end_head",
+    ]
+    header = "\n".join(fields).encode() + b"\n"
+    with open(path, "wb") as fout:
+        fout.write(header.ljust(1024, b" "))
+        fout.write(noise(2 * num_samples, rng).astype("<i2").tobytes())
+
+
+def make_fisher_corpus(root: str, num_lines: int, seed: int = 0, max_seconds: float = 0.5, ldc: bool = False) -> dict:
+    """Writes a Fisher-shaped input tree of `num_lines` utterances under `root/fisher`, returns the split sizes"""
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    fisher_path = os.path.join(root, "fisher")
+    templates = template_clips(os.path.join(fisher_path, "templates"), np_rng, max_seconds)
+    sizes = split_sizes(num_lines)
+    for split, size in sizes.items():
+        tagged = [tagged_line(rng) for _ in range(size)]
+        english = [" ".join(rng.choice(ENGLISH) for _ in range(rng.randint(1, 10))) for _ in range(size)]
+        write_lines(os.path.join(fisher_path, f"fisher-callhome-corpus-tags/corpus/ldc/fisher_{split}.es"), tagged)
+        split_path = os.path.join(fisher_path, "splits_data", split)
+        write_lines(os.path.join(split_path, f"fisher_{split}.es"), [clean_line(line) for line in tagged])
+        for suffix in [".en"] if split == "train" else [".en.0", ".en.1"]:
+            write_lines(os.path.join(split_path, f"fisher_{split}{suffix}"), english)
+
+        # about 60 utterances per conversation, each one or two consecutive TDF segments
+        conversations = conversation_names(max(1, size // 60), rng)
+        boundaries = sorted(rng.sample(range(1, size), len(conversations) - 1)) if len(conversations) > 1 else []
+        mapping, yaml_lines = [], []
+        for conversation, start, end in zip(conversations, [0] + boundaries, boundaries + [size]):
+            clip_dir = os.path.join(fisher_path, "speech", f"fisher_{split}", conversation)
+            os.makedirs(clip_dir, exist_ok=True)
+            segments = []
+            for line_idx in range(start, end):
+                ids = [len(segments) + 1]
+                if rng.random() < 0.2:
+                    ids.append(ids[0] + 1)
+                mapping.append(f"{conversation} {'_'.join(map(str, ids))}")
+                for _ in ids:
+                    seg_start = segments[-1][2] + rng.uniform(0.0, 0.5) if segments else 0.0
+                    segments.append((rng.randint(0, 1), seg_start, seg_start + rng.uniform(0.1, max_seconds), tagged[line_idx]))
+                clip_name = f"fisher_{split}-utt{line_idx + 1:06d}.wav"
+                channel = segments[ids[0] - 1][0]  # of the line's first segment, as `extract-utterance-audios.py`
+                speaker_id = f"{conversation}.sph-c{channel}-speaker~{channel}"
+                yaml_lines.append('- { wav: %s, speaker_id: "%s" }' % (f"fisher_{split}/{conversation}/{clip_name}", speaker_id))
+                os.link(rng.choice(templates), os.path.join(clip_dir, clip_name))
+            if ldc:
+                write_tdf(os.path.join(fisher_path, "ldc/LDC2010T04/data/transcripts", f"{conversation}.tdf"), conversation, segments)
+                sph_path = os.path.join(fisher_path, "ldc/LDC2010S01/data/speech", f"{conversation}.sph")
+                os.makedirs(os.path.dirname(sph_path), exist_ok=True)
+                write_sph(sph_path, int((segments[-1][2] + 1) * 8000), np_rng)
+        for corpus in ["fisher-callhome-corpus-tags", "fisher-callhome-corpus"]:
+            write_lines(os.path.join(fisher_path, corpus, "mapping", f"fisher_{split}"), mapping)
+        write_lines(os.path.join(split_path, f"fisher_{split}.yaml"), yaml_lines)
+    return sizes
+
+
+##### Miami #####
+def chat_word(rng: random.Random) -> str:
+    draw = rng.random()
+    if draw < 0.45:
+        return rng.choice(SPANISH)
+    if draw < 0.7:
+        return rng.choice(ENGLISH) + rng.choice(["@s:eng", "@s:eng", "", "@s:eng&spa", "@s:spa+eng"])
+    if draw < 0.75:
+        return rng.choice(["(.)", "(..)", "xxx", "&uh", "&m", "o_k", "ice_cream", '+"', "+,"])
+    if draw < 0.8:
+        return f"<{rng.choice(SPANISH)} {rng.choice(ENGLISH)}@s:eng> {rng.choice(CHAT_MARKS[:3])}"
+    if draw < 0.85:
+        return f"{rng.choice(SPANISH)} {rng.choice(CHAT_MARKS[1:])}"
+    if draw < 0.9:
+        return rng.choice(SPANISH) + "(s)"
+    if draw < 0.95:
+        return rng.choice([",", f'"{rng.choice(SPANISH)}"', "mira_que"])
+    return rng.choice(ENGLISH) + "@s:eng,"
+
+
+def chat_file(name: str, num_utterances: int, rng: random.Random, max_ms: int) -> tuple:
+    """The lines of a CHAT transcript and its length in milliseconds"""
+    languages = rng.choice(["spa, eng", "eng, spa"])
+    lines = [
+        "@UTF8", "@Begin", f"@Languages:\t{languages}", "@Participants:\tMAR Maria Adult, LIN Linda Adult",
+        "@ID:\tspa|Bangor|MAR||female|||Adult|||", "@ID:\tspa|Bangor|LIN||female|||Adult|||", f"@Media:\t{name}, audio",
+    ]
+    time_ms = 500
+    for _ in range(num_utterances):
+        words = [chat_word(rng) for _ in range(rng.randint(1, 9))]
+        if rng.random() < 0.1:
+            words.insert(0, rng.choice(["[- eng]", "[- spa]"]))
+        if rng.random() < 0.03:
+            words = ["www"]
+        duration = rng.randint(100, max_ms)
+        bullet = f" \x15{time_ms}_{time_ms + duration}\x15" if rng.random() > 0.05 else ""
+        lines.append(f"*{rng.choice(['MAR', 'LIN'])}:\t{' '.join(words)} {rng.choice(CHAT_ENDINGS)}{bullet}")
+        if rng.random() < 0.7:
+            translation = [rng.choice(ENGLISH) for _ in range(rng.randint(1, 8))]
+            if rng.random() < 0.3:
+                translation.insert(1, "(laughs)")
+            lines.append("%eng:\t" + " ".join(translation) + rng.choice([" .", "?", " !", ""]))
+        time_ms += duration + rng.randint(0, 400)
+    lines.append("@End")
+    return lines, time_ms
+
+
+def make_miami_corpus(root: str, num_lines: int, seed: int = 0, max_seconds: float = 0.8) -> int:
+    """Writes Miami-shaped CHAT and WAV files with about `num_lines` utterances under `root/miami`, returns the files"""
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    chat_path = os.path.join(root, "miami", "data", "miami", "beta")
+    audio_path = os.path.join(root, "miami", "data", "miami", "audio")
+    os.makedirs(chat_path, exist_ok=True)
+    os.makedirs(audio_path, exist_ok=True)
+    buffer = noise(SAMPLE_RATE * 60, np_rng)  # each recording tiles this minute of noise
+
+    num_files = max(1, num_lines // 40)
+    for file_idx in range(num_files):
+        name = f"{rng.choice(['maria', 'herring', 'sastre', 'zeledon'])}{file_idx}"
+        num_utterances = num_lines // num_files + (file_idx < num_lines % num_files)
+        lines, length_ms = chat_file(name, num_utterances, rng, int(max_seconds * 1000))
+        write_lines(os.path.join(chat_path, f"{name}.cha"), lines)
+        # some recordings end before their last utterance, as in the real corpus
+        num_samples = int(max(0, length_ms - rng.randint(0, 1500)) / 1000 * SAMPLE_RATE)
+        write_wav(os.path.join(audio_path, f"{name}.wav"), np.resize(buffer, num_samples))
+    return num_files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root", help="directory to write the `fisher` and `miami` trees into")
+    parser.add_argument("--fisher-lines", type=int, default=10_000)
+    parser.add_argument("--miami-lines", type=int, default=2_500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ldc", action="store_true", help="also write the TDF transcripts and SPH audio of the conversations")
+    args = parser.parse_args()
+    sizes = make_fisher_corpus(args.root, args.fisher_lines, args.seed, ldc=args.ldc)
+    num_files = make_miami_corpus(args.root, args.miami_lines, args.seed)
+    print(f"Fisher splits: {sizes}, Miami: {num_files} CHAT files in {args.root}")
@@ -5,8 +5,18 @@
 # Copyright (C) 2022 Apple Inc. All Rights Reserved.
 #
 
-cd miami
-bash setup_all.sh
-cd ../fisher
-bash setup_all.sh
-cd ../
+# every script writes the profile of its stages here, see `cs_data/profiling.py`
+export CS_DATA_PROFILE_DIR=${CS_DATA_PROFILE_DIR:-$(pwd)/profiles/$(date +%Y%m%d-%H%M%S)}
+
+# the setup scripts only declare their stages into the plan, which then runs as a dependency graph: independent
+# stages run at once within `CS_DATA_CPUS` (all of them by default), see `cs_data/scheduler.py`
+export CS_DATA_PLAN=$(pwd)/build_plan.jsonl
+rm -f "${CS_DATA_PLAN}"
+(cd miami && bash setup_all.sh) || exit 1
+(cd fisher && bash setup_all.sh) || exit 1
+unset CS_DATA_PLAN
+
+python -m cs_data.scheduler run build_plan.jsonl ${CS_DATA_CPUS:+--cpus ${CS_DATA_CPUS}} || status=1
+
+python -m cs_data.profile_report summarize "${CS_DATA_PROFILE_DIR}"
+exit ${status:-0}
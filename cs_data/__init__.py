@@ -0,0 +1,16 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Helpers shared by the Fisher and Miami dataset scripts
+from cs_data.batching import BatchIterator
+from cs_data.dataset import CodeSwitchedDataset
+from cs_data.manifest import (
+    ManifestReader,
+    ManifestWriter,
+    SplitWriter,
+    iter_split,
+    load_split,
+    write_split,
+)
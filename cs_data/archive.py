@@ -0,0 +1,207 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Size-bounded, uncompressed clip archives. Each split's clips are stored in shards (`clips-00000.zip`, ...
+# or WebDataset style `clips-00000.tar`) next to an index `clips-00000.index.json` mapping each member
+# to the [offset, size] of its bytes in the shard, so a loader can read a clip without extracting anything
+import os
+import glob
+import json
+import mmap
+import struct
+import tarfile
+import zipfile
+from multiprocessing import Pool
+
+from cs_data.profiling import stage
+from cs_data.jobs import default_jobs
+
+ARCHIVE_FORMATS = ["zip", "tar"]
+DEFAULT_SHARD_SIZE = 1 << 30  # bytes
+INDEX_SUFFIX = ".index.json"
+
+ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+
+def shard_path(base_path: str, shard_idx: int, archive_format: str = "zip") -> str:
+    return f"{base_path}-{shard_idx:05d}.{archive_format}"
+
+
+def index_path(path: str) -> str:
+    return os.path.splitext(path)[0] + INDEX_SUFFIX
+
+
+def list_shards(base_path: str) -> list:
+    return sorted(
+        path for archive_format in ARCHIVE_FORMATS for path in glob.glob(f"{glob.escape(base_path)}-*.{archive_format}")
+    )
+
+
+def remove_shards(base_path: str):
+    """Removes the shards (and indexes) of an earlier run, so no stale shard is left behind"""
+    for path in list_shards(base_path):
+        os.remove(path)
+        if os.path.exists(index_path(path)):
+            os.remove(index_path(path))
+
+
+def zip_data_offset(fin, header_offset: int) -> int:
+    fin.seek(header_offset)
+    header = ZIP_LOCAL_HEADER.unpack(fin.read(ZIP_LOCAL_HEADER.size))
+    return header_offset + ZIP_LOCAL_HEADER.size + header[9] + header[10]  # + file name and extra field
+
+
+class ShardWriter:
+    """Writes one stored (uncompressed) zip or tar shard and its member index"""
+
+    def __init__(self, path: str, archive_format: str = "zip"):
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown archive format {archive_format}, expected one of {ARCHIVE_FORMATS}")
+        self.path = path
+        self.archive_format = archive_format
+        self.size = 0
+        self.index = {}
+        if archive_format == "zip":
+            self.archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED)
+        else:
+            self.archive = tarfile.open(path, "w", format=tarfile.GNU_FORMAT, dereference=True)  # clips may be symlinks
+
+    def add(self, src_path: str, arcname: str):
+        if self.archive_format == "zip":
+            self.archive.write(src_path, arcname)
+            info = self.archive.getinfo(arcname)
+            self.index[arcname] = info.header_offset  # resolved to the data offset on close
+            self.size += info.file_size
+        else:
+            info = self.archive.gettarinfo(src_path, arcname)
+            with open(src_path, "rb") as fin:
+                self.archive.addfile(info, fin)
+            # the data is the last thing written, padded to whole blocks
+            data_blocks = -(-info.size // tarfile.BLOCKSIZE)
+            self.index[arcname] = [self.archive.offset - data_blocks * tarfile.BLOCKSIZE, info.size]
+            self.size += info.size
+
+    def close(self) -> dict:
+        self.archive.close()
+        if self.archive_format == "zip":
+            with zipfile.ZipFile(self.path) as archive, open(self.path, "rb") as fin:
+                for info in archive.infolist():
+                    self.index[info.filename] = [zip_data_offset(fin, info.header_offset), info.file_size]
+
+        with open(index_path(self.path), "w") as fout:
+            json.dump(self.index, fout)
+        return self.index
+
+
+class ShardedArchiveWriter:
+    """Streams clips into shards of at most `shard_size` bytes (a larger clip gets a shard of its own)"""
+
+    def __init__(self, base_path: str, shard_size: int = DEFAULT_SHARD_SIZE, archive_format: str = "zip"):
+        remove_shards(base_path)
+        self.base_path = base_path
+        self.shard_size = shard_size
+        self.archive_format = archive_format
+        self.shards = []
+        self.shard = None
+
+    def add(self, src_path: str, arcname: str = None):
+        size = os.path.getsize(src_path)
+        if self.shard is not None and self.shard.size and self.shard.size + size > self.shard_size:
+            self.shard.close()
+            self.shard = None
+        if self.shard is None:
+            self.shard = ShardWriter(
+                shard_path(self.base_path, len(self.shards), self.archive_format), self.archive_format
+            )
+            self.shards.append(self.shard.path)
+        self.shard.add(src_path, arcname or os.path.basename(src_path))
+
+    def close(self) -> list:
+        if self.shard is not None:
+            self.shard.close()
+            self.shard = None
+        return self.shards
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def plan_shards(files: list, shard_size: int) -> list:
+    """Groups (src_path, arcname) pairs, in order, into shards of at most `shard_size` bytes"""
+    shards = [[]]
+    current_size = 0
+    for src_path, arcname in files:
+        size = os.path.getsize(src_path)
+        if shards[-1] and current_size + size > shard_size:
+            shards.append([])
+            current_size = 0
+        shards[-1].append((src_path, arcname))
+        current_size += size
+    return shards if shards[-1] else []
+
+
+def write_shard(job) -> str:
+    path, archive_format, files = job
+    shard = ShardWriter(path, archive_format)
+    for src_path, arcname in files:
+        shard.add(src_path, arcname)
+    shard.close()
+    return path
+
+
+def build_sharded_archive(
+    src_dir: str, base_path: str = None, shard_size: int = DEFAULT_SHARD_SIZE, archive_format: str = "zip", jobs: int = 1
+) -> list:
+    """Archives every file in `src_dir` (by default into `{src_dir}-00000.zip`, ...), writing the shards in parallel"""
+    base_path = base_path or src_dir.rstrip("/")
+    files = [
+        (os.path.join(src_dir, file_name), file_name) for file_name in sorted(os.listdir(src_dir))
+        if os.path.isfile(os.path.join(src_dir, file_name))
+    ]
+    remove_shards(base_path)
+    shard_jobs = [
+        (shard_path(base_path, shard_idx, archive_format), archive_format, shard_files)
+        for shard_idx, shard_files in enumerate(plan_shards(files, shard_size))
+    ]
+    with stage("build_sharded_archive", items=len(files)):
+        if jobs > 1 and len(shard_jobs) > 1:
+            with Pool(min(jobs, len(shard_jobs))) as pool:
+                return pool.map(write_shard, shard_jobs)
+        return [write_shard(job) for job in shard_jobs]
+
+
+def load_index(path: str) -> dict:
+    with open(index_path(path), "r") as fin:
+        return json.load(fin)
+
+
+def read_member(path: str, offset: int, size: int) -> bytes:
+    """Reads one member of a shard straight from its byte range"""
+    with open(path, "rb") as fin:
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return data[offset : offset + size]
+
+
+def open_member(base_path: str, arcname: str) -> bytes:
+    """Finds `arcname` in the shards of `base_path` and returns its bytes"""
+    for path in list_shards(base_path):
+        index = load_index(path)
+        if arcname in index:
+            return read_member(path, *index[arcname])
+    raise KeyError(f"{arcname} is not in any shard of {base_path}")
+
+
+def add_archive_arguments(parser):
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE >> 20, help="max size of a clip archive shard in MB")
+    parser.add_argument("--archive-format", choices=ARCHIVE_FORMATS, default="zip", help="format of the clip archive shards")
+    parser.add_argument("--archive-jobs", type=int, default=default_jobs(), help="number of shards written in parallel")
+
+
+def archive_options(args) -> dict:
+    """The `build_sharded_archive` keyword arguments from the flags of `add_archive_arguments`"""
+    return {"shard_size": args.shard_size << 20, "archive_format": args.archive_format, "jobs": args.archive_jobs}
@@ -0,0 +1,188 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Length-bucketed batching over a `CodeSwitchedDataset`: utterances are grouped into duration buckets, packed into
+# batches whose padded length (batch size x longest utterance) stays within a budget of audio seconds, and the
+# batches are dealt out deterministically to data-parallel workers. With the same seed and epoch, every worker
+# computes the same batches, so no coordination is needed
+import os
+import struct
+from typing import Iterator, List
+
+import numpy as np
+
+from cs_data.dataset import CodeSwitchedDataset
+from cs_data.manifest import manifest_path
+from cs_data.sampling import IndexView
+
+DURATIONS_SUFFIX = ".durations.npy"
+WAV_HEADER_BYTES = 4096  # enough for the `fmt ` chunk and any metadata before `data`
+RIFF_CHUNK = struct.Struct("<4sI")
+
+
+def wav_duration(header: bytes) -> float:
+    """The duration in seconds of a WAV file, from its header"""
+    if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        raise ValueError("Not a WAV file")
+    pos = 12
+    byte_rate = None
+    while pos + RIFF_CHUNK.size <= len(header):
+        chunk_id, size = RIFF_CHUNK.unpack_from(header, pos)
+        if chunk_id == b"fmt ":
+            byte_rate = struct.unpack_from("<I", header, pos + 16)[0]
+        elif chunk_id == b"data":
+            if not byte_rate:
+                raise ValueError("WAV data before its format")
+            return size / byte_rate
+        pos += RIFF_CHUNK.size + size + (size & 1)
+    raise ValueError(f"No data chunk in the first {len(header)} bytes")
+
+
+def utterance_durations(dataset: CodeSwitchedDataset) -> np.ndarray:
+    """
+    The duration of every record: the `duration` field (Miami) or else the clip's WAV header (Fisher).
+        They are cached as `{name}.durations.npy` next to the split.
+    """
+    source = manifest_path(dataset.base_path, dataset.name)
+    if not os.path.isfile(source):
+        source = os.path.join(dataset.base_path, f"{dataset.name}.transcript")
+    cache_path = os.path.join(dataset.base_path, dataset.name + DURATIONS_SUFFIX)
+    if os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(source):
+        durations = np.load(cache_path)
+        if len(durations) == len(dataset):
+            return durations
+
+    durations = np.empty(len(dataset), dtype=np.float64)
+    for idx, record in enumerate(dataset):
+        if record.get("duration") is not None:
+            durations[idx] = record["duration"]
+        else:
+            durations[idx] = wav_duration(dataset.clip(idx, WAV_HEADER_BYTES))
+    try:
+        np.save(cache_path, durations)
+    except OSError:
+        pass  # e.g. a read-only copy of the data
+    return durations
+
+
+def bucket_boundaries(durations: np.ndarray, num_buckets: int) -> np.ndarray:
+    """Duration quantiles splitting the utterances into `num_buckets` buckets of about the same size"""
+    if not len(durations):
+        return np.zeros(0)
+    return np.unique(np.quantile(durations, np.linspace(0, 1, num_buckets + 1)[1:-1]))
+
+
+def pack_batches(indices: np.ndarray, durations: np.ndarray, max_seconds: float, max_batch_size: int = None) -> list:
+    """
+    Greedily packs `indices`, in order, into batches where size x longest duration <= `max_seconds`.
+        An utterance longer than `max_seconds` gets a batch of its own.
+    """
+    batches = []
+    start = 0
+    longest = 0.0
+    for pos, duration in enumerate(durations[indices].tolist()):
+        size = pos - start
+        new_longest = max(longest, duration)
+        if size and ((size + 1) * new_longest > max_seconds or (max_batch_size and size >= max_batch_size)):
+            batches.append(indices[start:pos])
+            start, new_longest = pos, duration
+        longest = new_longest
+    if start < len(indices):
+        batches.append(indices[start:])
+    return batches
+
+
+def make_batches(
+    durations: np.ndarray,
+    max_seconds: float,
+    num_buckets: int = 20,
+    max_batch_size: int = None,
+    shuffle: bool = True,
+    seed: int = 0,
+    epoch: int = 0,
+) -> List[np.ndarray]:
+    """
+    Splits the utterances into duration buckets and packs each bucket into batches. With `shuffle`, the
+        utterances within a bucket and the order of the batches change with the (seed, epoch), otherwise
+        the buckets are packed in order of duration.
+    """
+    rng = np.random.default_rng([seed, epoch])
+    order = rng.permutation(len(durations)) if shuffle else np.argsort(durations, kind="stable")
+    buckets = np.searchsorted(bucket_boundaries(durations, num_buckets), durations[order], side="right")
+    grouping = np.argsort(buckets, kind="stable")  # grouped by bucket, shuffled (or sorted) within it
+    order, buckets = order[grouping], buckets[grouping]
+
+    batches = []
+    for bucket in np.split(order, np.flatnonzero(np.diff(buckets)) + 1):
+        batches.extend(pack_batches(bucket, durations, max_seconds, max_batch_size))
+    if shuffle:
+        batches = [batches[idx] for idx in rng.permutation(len(batches))]
+    return batches
+
+
+def shard_batches(batches: list, num_shards: int, shard_id: int, even: bool = True) -> list:
+    """
+    The batches of one of `num_shards` workers, taking every `num_shards`-th batch. With `even`, the last
+        batches are repeated from the start so that every worker gets the same number of batches.
+    """
+    if not 0 <= shard_id < num_shards:
+        raise ValueError(f"Got shard {shard_id} of {num_shards}")
+    if even and batches and len(batches) % num_shards:
+        num_missing = num_shards - len(batches) % num_shards
+        batches = batches + [batches[idx % len(batches)] for idx in range(num_missing)]
+    return batches[shard_id::num_shards]
+
+
+def padding_ratio(durations: np.ndarray, batches: list) -> float:
+    """The fraction of the padded audio seconds that is padding"""
+    padded = sum(len(batch) * durations[batch].max() for batch in batches if len(batch))
+    return 1 - sum(durations[batch].sum() for batch in batches) / padded if padded else 0.0
+
+
+class BatchIterator:
+    """
+    Iterates over length-bucketed batches of a split, as lazy views of its records. Call `set_epoch` before each
+        epoch to reshuffle, all workers with the same seed and epoch agree on the batches.
+    """
+
+    def __init__(
+        self,
+        dataset: CodeSwitchedDataset,
+        max_seconds: float,
+        num_buckets: int = 20,
+        max_batch_size: int = None,
+        shuffle: bool = True,
+        seed: int = 0,
+        num_shards: int = 1,
+        shard_id: int = 0,
+        even: bool = True,
+    ):
+        self.dataset = dataset
+        self.durations = utterance_durations(dataset)
+        self.max_seconds = max_seconds
+        self.num_buckets = num_buckets
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_shards = num_shards
+        self.shard_id = shard_id
+        self.even = even
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def batch_indices(self) -> List[np.ndarray]:
+        batches = make_batches(
+            self.durations, self.max_seconds, self.num_buckets, self.max_batch_size, self.shuffle, self.seed, self.epoch
+        )
+        return shard_batches(batches, self.num_shards, self.shard_id, self.even)
+
+    def __len__(self) -> int:
+        return len(self.batch_indices())
+
+    def __iter__(self) -> Iterator[IndexView]:
+        for batch in self.batch_indices():
+            yield IndexView(self.dataset, batch)
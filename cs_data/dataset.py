@@ -0,0 +1,226 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Lazy reader over the generated splits, e.g. `CodeSwitchedDataset("fisher/eval/cs")[0]`. Opening a split only
+# maps its manifest (or, for splits written without one, the line offsets of its YAML and text files, which are
+# indexed once and cached next to them), records and clips are read when they are accessed
+import io
+import os
+import mmap
+import zipfile
+from typing import Iterator
+
+import numpy as np
+import yaml
+
+from cs_data.archive import index_path, list_shards, load_index
+from cs_data.manifest import YAML_LOADER, ManifestReader, join_texts, manifest_path
+from cs_data.sampling import IndexView
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# where the splits of each dataset are written, relative to the repository
+SPLIT_ROOTS = {
+    "fisher": os.path.join("fisher", "output", "fisher"),
+    "miami": os.path.join("miami", "output", "miami"),
+    "lid": os.path.join("fisher", "output", "lid"),
+}
+OFFSETS_SUFFIX = ".offsets.npy"
+
+
+def resolve_split(name: str, root: str = REPO_ROOT):
+    """The directory and file name of a split, from e.g. `fisher/eval/cs`, `miami/mono`, `lid/fisher_train_cs_dev`"""
+    if os.path.isdir(name):
+        base_path = name
+    else:
+        dataset, _, split = name.partition("/")
+        if dataset not in SPLIT_ROOTS or not split:
+            raise ValueError(f"Unknown split {name}, expected one of {list(SPLIT_ROOTS)} followed by the split path")
+        base_path = os.path.join(root, SPLIT_ROOTS[dataset], split)
+    if not os.path.isdir(base_path):
+        raise FileNotFoundError(f"No split at {base_path}, has it been generated?")
+
+    for suffix in [".manifest", ".transcript"]:
+        file_names = sorted(file_name for file_name in os.listdir(base_path) if file_name.endswith(suffix))
+        if file_names:
+            return base_path, file_names[0][: -len(suffix)]
+    raise FileNotFoundError(f"{base_path} has no manifest or transcript")
+
+
+def find_splits(search_paths: list = None) -> list:
+    """Every generated split directory (the ones holding a manifest or transcript), by default in the whole repo"""
+    search_paths = search_paths or [os.path.join(REPO_ROOT, path) for path in sorted(set(SPLIT_ROOTS.values()))]
+    splits = []
+    for search_path in search_paths:
+        for path, dirs, files in os.walk(search_path):
+            dirs[:] = [dir_name for dir_name in dirs if dir_name != "clips"]
+            if any(file_name.endswith((".manifest", ".transcript")) for file_name in files):
+                splits.append(path)
+    return sorted(set(splits))
+
+
+def line_offsets(buf, item_starts: bool = False) -> np.ndarray:
+    """
+    The byte offsets of the lines in `buf`, followed by its end. With `item_starts`, only the lines
+        starting an item of a top-level YAML block list are kept.
+    """
+    data = np.frombuffer(buf, dtype=np.uint8)
+    starts = np.concatenate([[0], np.flatnonzero(data == ord("\n")) + 1])
+    starts = starts[starts < len(data)]
+    if item_starts:
+        padded = np.concatenate([data, [0]])
+        starts = starts[(padded[starts] == ord("-")) & np.isin(padded[starts + 1], [ord(" "), ord("\n")])]
+    return np.concatenate([starts, [len(data)]]).astype(np.int64)
+
+
+class LineFile:
+    """Memory-maps a text file and reads its lines (or YAML items) by index, through a cached offset index"""
+
+    def __init__(self, path: str, item_starts: bool = False):
+        self.path = path
+        with open(path, "rb") as fin:
+            size = os.fstat(fin.fileno()).st_size
+            self.buf = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.offsets = self.load_offsets(path + OFFSETS_SUFFIX, size, item_starts)
+
+    def load_offsets(self, cache_path: str, size: int, item_starts: bool) -> np.ndarray:
+        if os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(self.path):
+            offsets = np.load(cache_path)
+            if len(offsets) and offsets[-1] == size:
+                return offsets
+        offsets = line_offsets(self.buf, item_starts)
+        try:
+            with open(cache_path, "wb") as fout:
+                np.save(fout, offsets)
+        except OSError:
+            pass  # e.g. a read-only copy of the data, the index is just rebuilt next time
+        return offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> str:
+        return str(self.buf[self.offsets[idx] : self.offsets[idx + 1]], "utf-8")
+
+    def close(self):
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+
+
+class TextSplitReader:
+    """Reads the records of a split written without a manifest, from its YAML, transcript and translation"""
+
+    def __init__(self, base_path: str, name: str):
+        self.instances = LineFile(os.path.join(base_path, f"{name}.yaml"), item_starts=True)
+        self.transcript = LineFile(os.path.join(base_path, f"{name}.transcript"))
+        self.translation = LineFile(os.path.join(base_path, f"{name}.translation"))
+        lengths = [len(self.instances), len(self.transcript), len(self.translation)]
+        assert len(set(lengths)) == 1, f"{base_path}/{name} has different lengths: {lengths}"
+
+    def __len__(self) -> int:
+        return len(self.transcript)
+
+    def __getitem__(self, idx: int) -> dict:
+        instance = yaml.load(self.instances[idx], Loader=YAML_LOADER)[0]
+        return join_texts(instance, self.transcript[idx].strip(), self.translation[idx].strip())
+
+    def close(self):
+        for lines in [self.instances, self.transcript, self.translation]:
+            lines.close()
+
+
+class ClipStore:
+    """Reads the clips of a split from its `clips` directory, or else straight from its archive shards"""
+
+    def __init__(self, base_path: str):
+        self.clips_path = os.path.join(base_path, "clips")
+        self.shards = None  # {arcname: (shard idx, offset, size)}, loaded on the first clip read from them
+        self.shard_bufs = []
+        self.legacy_zip = os.path.join(base_path, "clips.zip")
+
+    def load_shards(self):
+        self.shards = {}
+        for shard_idx, path in enumerate(list_shards(self.clips_path)):
+            with open(path, "rb") as fin:
+                self.shard_bufs.append(mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ))
+            if os.path.isfile(index_path(path)):
+                for arcname, (offset, size) in load_index(path).items():
+                    self.shards[arcname] = (shard_idx, offset, size)
+
+    def read(self, clip_name: str, num_bytes: int = None) -> bytes:
+        """The clip's bytes, or only its first `num_bytes` (e.g. the header)"""
+        path = os.path.join(self.clips_path, clip_name)
+        if os.path.isfile(path):
+            with open(path, "rb") as fin:
+                return fin.read(-1 if num_bytes is None else num_bytes)
+
+        if self.shards is None:
+            self.load_shards()
+        if clip_name in self.shards:
+            shard_idx, offset, size = self.shards[clip_name]
+            size = size if num_bytes is None else min(size, num_bytes)
+            return self.shard_bufs[shard_idx][offset : offset + size]
+        if os.path.isfile(self.legacy_zip):  # a `clips.zip` from before the shards
+            with zipfile.ZipFile(self.legacy_zip) as archive, archive.open(clip_name) as fin:
+                return fin.read(-1 if num_bytes is None else num_bytes)
+        raise KeyError(f"No clip {clip_name} in {self.clips_path}")
+
+    def close(self):
+        for buf in self.shard_bufs:
+            buf.close()
+        self.shard_bufs = []
+        self.shards = None
+
+
+class CodeSwitchedDataset:
+    """
+    A generated split, opened by name (`fisher/eval/cs`, `miami/mono`, ...) or directory.
+        Indexing gives the record (its YAML fields plus `transcript`/`translation`), a slice gives a lazy view of
+        them, and `clip`/`audio` read the record's audio.
+    """
+
+    def __init__(self, name: str, root: str = REPO_ROOT):
+        self.base_path, self.name = resolve_split(name, root)
+        path = manifest_path(self.base_path, self.name)
+        if os.path.isfile(path):
+            self.records = ManifestReader(path)
+        else:
+            self.records = TextSplitReader(self.base_path, self.name)
+        self.clips = ClipStore(self.base_path)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return IndexView(self, np.arange(len(self))[idx])
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Index {idx} out of range for {len(self)} records")
+        return self.records[idx]
+
+    def __iter__(self) -> Iterator[dict]:
+        for idx in range(len(self)):
+            yield self.records[idx]
+
+    def clip(self, idx: int, num_bytes: int = None) -> bytes:
+        """The bytes of the record's audio file, or only its first `num_bytes`"""
+        return self.clips.read(os.path.basename(self[idx]["wav"]), num_bytes)
+
+    def audio(self, idx: int):
+        """The record's (samples, sample rate), decoded with `soundfile`"""
+        import soundfile as sf  # only needed to decode, so opening a split stays quick
+
+        return sf.read(io.BytesIO(self.clip(idx)))
+
+    def close(self):
+        self.records.close()
+        self.clips.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
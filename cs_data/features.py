@@ -0,0 +1,284 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Precomputed log-mel filterbank features for the clips of the generated splits, so training doesn't recompute
+# them every epoch. The features are computed with NumPy only (Kaldi-style framing, Povey window and mel scale)
+# and appended to a store of memory-mappable float32 chunks, with an index from clip id to its rows and the hash
+# of the audio it was computed from. Rerunning only computes the clips that are new or whose audio changed.
+# A dataset's splits share one store (`{dataset}/output/features`), so a clip in several splits is stored once.
+# The rows of replaced clips stay in the chunks until they are over `COMPACT_FRACTION` of the store, then saving
+# copies the indexed rows into new chunks and removes the old ones.
+#
+# Layout of a store directory: config.json (feature options) | index.json {clip id: [chunk, row, frames, hash]}
+#   | chunk-00000.f32, ... (rows of `num_mel_bins` float32, numbered on after a compaction)
+#
+# From the shell, for the given splits (by name or directory) or every split under the `--search` directories:
+#   python -m cs_data.features fisher/eval/cs miami/mono --jobs 8
+#   python -m cs_data.features --search output/fisher output/lid
+import os
+import io
+import sys
+import json
+import hashlib
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+import soundfile as sf
+
+from cs_data.dataset import CodeSwitchedDataset, find_splits
+from cs_data.jobs import default_jobs
+
+DEFAULT_OPTIONS = {
+    "sample_rate": 16000,
+    "num_mel_bins": 80,
+    "frame_length_ms": 25.0,
+    "frame_shift_ms": 10.0,
+    "preemphasis": 0.97,
+    "low_freq": 20.0,
+    "high_freq": 0.0,  # <= 0 is relative to the Nyquist frequency
+}
+FEATURES_DIR = "features"
+CHUNK_ROWS = 1 << 20  # rows per chunk file, 320MB with 80 mel bins
+COMPACT_FRACTION = 0.25  # of the stored rows no longer indexed, past which `save` compacts the store
+LOG_FLOOR = float(np.finfo(np.float32).eps)
+
+
+##### features #####
+def mel_scale(freq):
+    return 1127.0 * np.log(1.0 + np.asarray(freq) / 700.0)
+
+
+def mel_filterbank(num_mel_bins: int, fft_size: int, sample_rate: int, low_freq: float, high_freq: float) -> np.ndarray:
+    """Triangular filters, equally spaced on the mel scale, of shape (num_mel_bins, fft_size // 2 + 1)"""
+    high_freq = high_freq if high_freq > 0 else sample_rate / 2 + high_freq
+    fft_mels = mel_scale(np.arange(fft_size // 2 + 1) * sample_rate / fft_size)
+    mel_points = np.linspace(mel_scale(low_freq), mel_scale(high_freq), num_mel_bins + 2)
+    left, center, right = mel_points[:-2, None], mel_points[1:-1, None], mel_points[2:, None]
+    rising = (fft_mels[None, :] - left) / (center - left)
+    falling = (right - fft_mels[None, :]) / (right - center)
+    return np.maximum(0.0, np.minimum(rising, falling))
+
+
+def log_mel_fbank(samples: np.ndarray, options: dict = None) -> np.ndarray:
+    """
+    Log-mel filterbank energies of shape (frames, num_mel_bins) for 1-d samples at int16 scale (as Kaldi uses),
+        all frames at once. Only whole frames are kept, so clips shorter than a frame give no rows.
+    """
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    sample_rate = options["sample_rate"]
+    frame_length = int(sample_rate * options["frame_length_ms"] / 1000)
+    frame_shift = int(sample_rate * options["frame_shift_ms"] / 1000)
+    fft_size = 1 << (frame_length - 1).bit_length()
+    if len(samples) < frame_length:
+        return np.zeros((0, options["num_mel_bins"]), dtype=np.float32)
+
+    frames = np.lib.stride_tricks.sliding_window_view(np.asarray(samples, dtype=np.float64), frame_length)
+    frames = frames[::frame_shift]
+    frames = frames - frames.mean(axis=1, keepdims=True)  # remove the DC offset
+    preemphasis = options["preemphasis"]
+    frames = np.concatenate([frames[:, :1] * (1 - preemphasis), frames[:, 1:] - preemphasis * frames[:, :-1]], axis=1)
+    frames *= np.hanning(frame_length) ** 0.85  # Povey window
+
+    power = np.abs(np.fft.rfft(frames, n=fft_size)) ** 2
+    filters = mel_filterbank(options["num_mel_bins"], fft_size, sample_rate, options["low_freq"], options["high_freq"])
+    return np.log(np.maximum(power @ filters.T, LOG_FLOOR)).astype(np.float32)
+
+
+def audio_hash(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def clip_id(record: dict) -> str:
+    """The key of a record's clip in a store"""
+    return os.path.basename(record["wav"])
+
+
+##### store #####
+def default_store_path(base_path: str) -> str:
+    """`{dataset}/output/features` for a split in `{dataset}/output/...`, next to (not in) the splits"""
+    parts = os.path.abspath(base_path).split(os.sep)
+    if "output" not in parts:
+        return base_path.rstrip(os.sep) + "." + FEATURES_DIR
+    idx = len(parts) - 1 - parts[::-1].index("output")
+    return os.sep.join(parts[: idx + 1] + [FEATURES_DIR])
+
+
+class FeatureStore:
+    """Features keyed by clip id, appended to float32 chunk files that are memory-mapped to read them"""
+
+    def __init__(self, path: str, options: dict = None):
+        self.path = path
+        self.options = {**DEFAULT_OPTIONS, **(options or {})}
+        self.dim = self.options["num_mel_bins"]
+        self.index = {}
+        self.chunks = {}  # chunk idx -> memmap
+        self.fout = None
+        config_path = os.path.join(path, "config.json")
+        if os.path.isfile(config_path):
+            with open(config_path, "r") as fin:
+                config = json.load(fin)
+            if config == self.options:
+                with open(os.path.join(path, "index.json"), "r") as fin:
+                    self.index = json.load(fin)
+            elif options is None:  # opened for reading, take its options
+                self.options, self.dim = config, config["num_mel_bins"]
+                with open(os.path.join(path, "index.json"), "r") as fin:
+                    self.index = json.load(fin)
+            else:
+                print(f"The feature options of {path} changed, recomputing all of its features")
+
+    def chunk_path(self, chunk_idx: int) -> str:
+        return os.path.join(self.path, f"chunk-{chunk_idx:05d}.f32")
+
+    def chunk_indices(self) -> list:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(int(file_name[6:-4]) for file_name in os.listdir(self.path)
+                      if file_name.startswith("chunk-") and file_name.endswith(".f32"))
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def hash(self, key: str) -> str:
+        return self.index[key][3] if key in self.index else None
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        """The (frames, num_mel_bins) features of a clip, as a read-only view of the chunk"""
+        chunk_idx, row, num_frames, _ = self.index[key]
+        if chunk_idx not in self.chunks:
+            self.chunks[chunk_idx] = np.memmap(self.chunk_path(chunk_idx), dtype=np.float32, mode="r").reshape(-1, self.dim)
+        return self.chunks[chunk_idx][row : row + num_frames]
+
+    def open_for_append(self):
+        os.makedirs(self.path, exist_ok=True)
+        if not self.index:  # new, or the options changed: start over
+            for file_name in os.listdir(self.path):
+                if file_name.startswith("chunk-"):
+                    os.remove(os.path.join(self.path, file_name))
+        chunk_indices = self.chunk_indices()
+        self.chunk_idx = chunk_indices[-1] if chunk_indices else 0
+        # rows of an interrupted run are past the indexed ones and simply left unused
+        path = self.chunk_path(self.chunk_idx)
+        self.num_rows = os.path.getsize(path) // (4 * self.dim) if os.path.isfile(path) else 0
+        self.fout = open(path, "ab")
+        self.fout.truncate(self.num_rows * 4 * self.dim)
+
+    def add(self, key: str, features: np.ndarray, data_hash: str):
+        if self.fout is None:
+            self.open_for_append()
+        if self.num_rows and self.num_rows + len(features) > CHUNK_ROWS:
+            self.fout.close()
+            self.chunk_idx += 1
+            self.num_rows = 0
+            self.fout = open(self.chunk_path(self.chunk_idx), "ab")
+        self.fout.write(np.ascontiguousarray(features, dtype="<f4").tobytes())
+        self.index[key] = [self.chunk_idx, self.num_rows, len(features), data_hash]
+        self.num_rows += len(features)
+        self.chunks.pop(self.chunk_idx, None)  # the mapping is stale once the chunk grows
+
+    def compact(self) -> list:
+        """
+        Copies the indexed rows into new chunks after the existing ones and points the index at them, returning
+            the old chunks to remove once the index is saved (until then, the saved index still reads them)
+        """
+        old_chunks = self.chunk_indices()
+        self.chunk_idx, self.num_rows = old_chunks[-1] + 1, 0
+        self.fout = open(self.chunk_path(self.chunk_idx), "ab")
+        for key, (_, _, _, data_hash) in sorted(self.index.items(), key=lambda item: item[1][:2]):
+            self.add(key, self[key], data_hash)
+        self.fout.close()
+        self.fout = None
+        self.chunks = {}
+        return old_chunks
+
+    def save(self):
+        """Writes the index and options, only then are the new features part of the store"""
+        if self.fout is not None:
+            self.fout.close()
+            self.fout = None
+        os.makedirs(self.path, exist_ok=True)
+        # rows of replaced clips (or of interrupted runs) are dropped once they are a good part of the store
+        stored_rows = sum(os.path.getsize(self.chunk_path(idx)) // (4 * self.dim) for idx in self.chunk_indices())
+        indexed_rows = sum(num_frames for _, _, num_frames, _ in self.index.values())
+        old_chunks = self.compact() if stored_rows - indexed_rows > COMPACT_FRACTION * stored_rows else []
+        for file_name, content in [("index.json", self.index), ("config.json", self.options)]:
+            with open(os.path.join(self.path, file_name + ".tmp"), "w") as fout:
+                json.dump(content, fout)
+            os.replace(os.path.join(self.path, file_name + ".tmp"), os.path.join(self.path, file_name))
+        for chunk_idx in old_chunks:
+            os.remove(self.chunk_path(chunk_idx))
+
+
+##### computing the features of a split #####
+WORKER = {}
+
+
+def init_worker(base_path: str, options: dict):
+    WORKER["dataset"] = CodeSwitchedDataset(base_path)
+    WORKER["options"] = options
+
+
+def compute_clip(job):
+    """Features of one clip, or None when its audio hash is the one already stored"""
+    idx, known_hash = job
+    data = WORKER["dataset"].clip(idx)
+    data_hash = audio_hash(data)
+    if data_hash == known_hash:
+        return idx, data_hash, None
+    samples, sample_rate = sf.read(io.BytesIO(data), dtype="int16", always_2d=True)
+    if sample_rate != WORKER["options"]["sample_rate"]:
+        raise ValueError(f"Expected {WORKER['options']['sample_rate']}Hz audio, got {sample_rate}Hz for clip {idx}")
+    return idx, data_hash, log_mel_fbank(samples[:, 0], WORKER["options"])
+
+
+def compute_split_features(name: str, store_path: str = None, options: dict = None, jobs: int = 1) -> FeatureStore:
+    """Computes the features of every clip of a split that isn't in its store yet (or whose audio changed)"""
+    dataset = CodeSwitchedDataset(name)
+    store = FeatureStore(store_path or default_store_path(dataset.base_path), options)
+    keys = [clip_id(record) for record in dataset]
+    clip_jobs = [(idx, store.hash(key)) for idx, key in enumerate(keys)]
+
+    if jobs > 1 and len(clip_jobs) > 1:
+        with Pool(jobs, initializer=init_worker, initargs=(dataset.base_path, store.options)) as pool:
+            num_computed = add_results(store, keys, pool.imap(compute_clip, clip_jobs, chunksize=64))
+    else:
+        init_worker(dataset.base_path, store.options)
+        num_computed = add_results(store, keys, map(compute_clip, clip_jobs))
+    store.save()
+    print(f"{dataset.base_path}: computed {num_computed} of {len(keys)} clips, stored in {store.path}")
+    return store
+
+
+def add_results(store: FeatureStore, keys: list, results) -> int:
+    num_computed = 0
+    for idx, data_hash, features in results:
+        if features is not None:
+            store.add(keys[idx], features, data_hash)
+            num_computed += 1
+    return num_computed
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog="python -m cs_data.features")
+    parser.add_argument("splits", nargs="*", help="split names (e.g. fisher/eval/cs) or directories")
+    parser.add_argument("--search", nargs="*", default=None, help="also every split under these directories (all splits if nothing is given)")
+    parser.add_argument("--store-dir", default=None, help="where to store the features, by default `{dataset}/output/features`")
+    parser.add_argument("--num-mel-bins", type=int, default=DEFAULT_OPTIONS["num_mel_bins"])
+    parser.add_argument("--jobs", type=int, default=default_jobs(), help="number of processes computing features")
+    args = parser.parse_args(argv)
+    splits = list(args.splits)
+    if args.search is not None or not splits:
+        splits += find_splits(args.search)
+    for name in splits:
+        compute_split_features(name, args.store_dir, {"num_mel_bins": args.num_mel_bins}, args.jobs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,15 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# How many processes a script uses by default: when `cs_data/scheduler.py` runs its stage, the CPUs it gave the
+# stage (`CS_DATA_JOBS`), so concurrent stages share the machine instead of each starting a pool per CPU
+import os
+
+JOBS_ENV = "CS_DATA_JOBS"
+
+
+def default_jobs() -> int:
+    """The number of processes a script should use: the CPUs given to its stage, or else all of them"""
+    return int(os.environ.get(JOBS_ENV) or os.cpu_count())
@@ -0,0 +1,382 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# A compact, indexed record file holding a split's manifest (wav path, offsets, statistics, ...)
+# together with its transcript and translation, so the pipeline stages don't have to round-trip
+# everything through YAML. YAML/JSONL are only written as an (optional) export.
+#
+# Layout: MAGIC | uint32 header length | JSON header {"fields": [...]} | records | uint64 index | footer
+# Each record stores one tagged value per field, so ints/floats/bools/None round-trip exactly.
+import os
+import json
+import mmap
+import struct
+import array
+from typing import Iterable, Iterator, List, Tuple
+
+import numpy as np
+import yaml
+
+from cs_data.profiling import stage
+
+MAGIC = b"CSMANIF1"
+HEADER_LENGTH = struct.Struct("<I")
+FOOTER = struct.Struct("<QQ8s")  # index offset, number of records, magic
+TEXT_FIELDS = ("transcript", "translation")
+
+# value tags
+MISSING, NONE, FALSE, TRUE, INT, FLOAT, STR = range(7)
+INT_VALUE = struct.Struct("<q")
+FLOAT_VALUE = struct.Struct("<d")
+STR_LENGTH = struct.Struct("<I")
+
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def manifest_path(base_path: str, name: str) -> str:
+    return os.path.join(base_path, f"{name}.manifest")
+
+
+def encode_record(record: dict, fields: List[str]) -> bytes:
+    out = bytearray()
+    num_found = 0
+    for field in fields:
+        if field not in record:
+            out.append(MISSING)
+            continue
+        value = record[field]
+        num_found += 1
+        if value is None:
+            out.append(NONE)
+        elif isinstance(value, bool):
+            out.append(TRUE if value else FALSE)
+        elif isinstance(value, int):
+            out.append(INT)
+            out += INT_VALUE.pack(value)
+        elif isinstance(value, float):
+            out.append(FLOAT)
+            out += FLOAT_VALUE.pack(value)
+        elif isinstance(value, str):
+            encoded = value.encode("utf-8")
+            out.append(STR)
+            out += STR_LENGTH.pack(len(encoded))
+            out += encoded
+        else:
+            raise TypeError(f"Can't store {type(value)} for field {field}")
+    if len(record) != num_found:
+        raise KeyError(f"Record has fields that are not in {fields}: {list(record)}")
+    return bytes(out)
+
+
+def decode_record(buf, offset: int, fields: List[str]) -> dict:
+    record = {}
+    for field in fields:
+        tag = buf[offset]
+        offset += 1
+        if tag == MISSING:
+            continue
+        elif tag == NONE:
+            record[field] = None
+        elif tag == FALSE or tag == TRUE:
+            record[field] = tag == TRUE
+        elif tag == INT:
+            record[field] = INT_VALUE.unpack_from(buf, offset)[0]
+            offset += INT_VALUE.size
+        elif tag == FLOAT:
+            record[field] = FLOAT_VALUE.unpack_from(buf, offset)[0]
+            offset += FLOAT_VALUE.size
+        elif tag == STR:
+            length = STR_LENGTH.unpack_from(buf, offset)[0]
+            offset += STR_LENGTH.size
+            record[field] = str(buf[offset : offset + length], "utf-8")
+            offset += length
+        else:
+            raise ValueError(f"Corrupt manifest, got tag {tag} for field {field}")
+    return record
+
+
+class ManifestWriter:
+    """Streams records to a manifest file, the index is written when it is closed"""
+
+    def __init__(self, path: str, fields: List[str]):
+        self.path = path
+        self.fields = list(fields)
+        self.offsets = array.array("Q")  # 8 bytes per record, for streaming large splits
+        self.fout = open(path + ".tmp", "wb")
+        header = json.dumps({"fields": self.fields}).encode("utf-8")
+        self.fout.write(MAGIC)
+        self.fout.write(HEADER_LENGTH.pack(len(header)))
+        self.fout.write(header)
+        self.position = len(MAGIC) + HEADER_LENGTH.size + len(header)
+
+    def write(self, record: dict):
+        encoded = encode_record(record, self.fields)
+        self.offsets.append(self.position)
+        self.fout.write(encoded)
+        self.position += len(encoded)
+
+    def close(self):
+        if self.fout is None:
+            return
+        self.fout.write(np.asarray(self.offsets, dtype="<u8").tobytes())
+        self.fout.write(FOOTER.pack(self.position, len(self.offsets), MAGIC))
+        self.fout.close()
+        self.fout = None
+        os.replace(self.path + ".tmp", self.path)  # never leave a half written manifest behind
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.fout.close()
+            os.remove(self.path + ".tmp")
+
+
+class ManifestReader:
+    """Memory-maps a manifest, records are decoded lazily by index, slice or iteration"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as fin:
+            self.buf = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buf[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a manifest file")
+        header_length = HEADER_LENGTH.unpack_from(self.buf, len(MAGIC))[0]
+        header_start = len(MAGIC) + HEADER_LENGTH.size
+        self.fields = json.loads(self.buf[header_start : header_start + header_length])["fields"]
+        index_offset, num_records, magic = FOOTER.unpack_from(self.buf, len(self.buf) - FOOTER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is truncated")
+        self.offsets = np.frombuffer(self.buf, dtype="<u8", count=num_records, offset=index_offset)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        return decode_record(self.buf, int(self.offsets[idx]), self.fields)
+
+    def __iter__(self) -> Iterator[dict]:
+        for offset in self.offsets.tolist():
+            yield decode_record(self.buf, offset, self.fields)
+
+    def column(self, field: str) -> list:
+        return [record.get(field) for record in self]
+
+    def close(self):
+        self.offsets = None
+        self.buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_manifest(path: str, records: Iterable[dict], fields: List[str] = None):
+    """Writes records to a manifest, the fields default to the keys of the records in order"""
+    records = list(records) if fields is None else records
+    if fields is None:
+        fields = []
+        for record in records:
+            fields.extend(key for key in record if key not in fields)
+    with ManifestWriter(path, fields) as writer:
+        for record in records:
+            writer.write(record)
+
+
+def read_manifest(path: str) -> List[dict]:
+    with ManifestReader(path) as reader:
+        return list(reader)
+
+
+##### YAML/JSONL, for inputs made outside of Python and as final exports #####
+def load_yaml(path: str) -> list:
+    with open(path, "r") as fin:
+        return yaml.load(fin, Loader=YAML_LOADER)
+
+
+def iter_yaml_records(path: str, chunk_size: int = 1000) -> Iterator[dict]:
+    """Streams the items of a top-level YAML list, e.g. the ones written by `yaml.dump` or `prepare-sets.sh`"""
+    with open(path, "r") as fin:
+        chunk = []
+        num_items = 0
+        for line in fin:
+            if line.startswith("-") and line[1:2] in (" ", "\n"):
+                if num_items == chunk_size:
+                    yield from yaml.load("".join(chunk), Loader=YAML_LOADER)
+                    chunk, num_items = [], 0
+                num_items += 1
+            elif not chunk and line.strip() and not line.startswith(" "):
+                # not a block list (e.g. `[]`), just load all of it
+                fin.seek(0)
+                yield from yaml.load(fin, Loader=YAML_LOADER) or []
+                return
+            chunk.append(line)
+        if chunk:
+            yield from yaml.load("".join(chunk), Loader=YAML_LOADER) or []
+
+
+class YamlExporter:
+    """Streams records to a YAML list, with the same output as dumping the whole list at once"""
+
+    def __init__(self, path: str, allow_unicode: bool = False):
+        self.fout = open(path, "w")
+        self.allow_unicode = allow_unicode
+        self.num_records = 0
+
+    def write(self, record: dict):
+        self.fout.write(yaml.dump([record], allow_unicode=self.allow_unicode))
+        self.num_records += 1
+
+    def close(self):
+        if not self.num_records:
+            self.fout.write(yaml.dump([]))
+        self.fout.close()
+
+
+class JsonlExporter:
+    def __init__(self, path: str, sort_keys: bool = False):
+        self.fout = open(path, "w")
+        self.sort_keys = sort_keys
+
+    def write(self, record: dict):
+        self.fout.write(json.dumps(record, sort_keys=self.sort_keys))
+        self.fout.write("\n")
+
+    def close(self):
+        self.fout.close()
+
+
+##### splits: a manifest plus the transcript/translation files #####
+def split_texts(record: dict) -> Tuple[dict, str, str]:
+    """Separates a manifest record into the YAML instance, transcript and translation"""
+    instance = {key: value for key, value in record.items() if key not in TEXT_FIELDS}
+    return instance, record["transcript"], record["translation"]
+
+
+def join_texts(instance: dict, transcript: str, translation: str) -> dict:
+    record = dict(instance)
+    record["transcript"] = transcript
+    record["translation"] = translation
+    return record
+
+
+class SplitWriter:
+    """
+    Streams a split to `{name}.manifest` and `{name}.transcript`/`{name}.translation`, with optional
+        `{name}.yaml`/`{name}.jsonl` exports of the instances.
+    """
+
+    def __init__(
+        self,
+        base_path: str,
+        name: str,
+        fields: List[str],
+        export_yaml: bool = True,
+        export_jsonl: bool = False,
+        allow_unicode: bool = False,
+        sort_jsonl_keys: bool = False,
+    ):
+        os.makedirs(base_path, exist_ok=True)
+        fields = [field for field in fields if field not in TEXT_FIELDS] + list(TEXT_FIELDS)
+        self.manifest = ManifestWriter(manifest_path(base_path, name), fields)
+        self.transcript = open(os.path.join(base_path, f"{name}.transcript"), "w")
+        self.translation = open(os.path.join(base_path, f"{name}.translation"), "w")
+        self.exporters = []
+        if export_yaml:
+            self.exporters.append(YamlExporter(os.path.join(base_path, f"{name}.yaml"), allow_unicode))
+        if export_jsonl:
+            self.exporters.append(JsonlExporter(os.path.join(base_path, f"{name}.jsonl"), sort_jsonl_keys))
+        self.num_records = 0
+
+    def write(self, instance: dict, transcript: str, translation: str):
+        assert "\n" not in transcript, transcript
+        assert "\n" not in translation, translation
+        self.manifest.write(join_texts(instance, transcript, translation))
+        for fout, line in [(self.transcript, transcript), (self.translation, translation)]:
+            fout.write(line)
+            fout.write("\n")
+        for exporter in self.exporters:
+            exporter.write(instance)
+        self.num_records += 1
+
+    def close(self):
+        self.manifest.close()
+        self.transcript.close()
+        self.translation.close()
+        for exporter in self.exporters:
+            exporter.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_split(
+    base_path: str,
+    name: str,
+    yaml_data: List[dict],
+    transcript: List[str],
+    translation: List[str],
+    **kwargs,
+):
+    assert len(yaml_data) == len(transcript) == len(translation)
+    fields = []
+    for instance in yaml_data:
+        fields.extend(key for key in instance if key not in fields)
+    with stage("write_split", items=len(yaml_data)), SplitWriter(base_path, name, fields, **kwargs) as writer:
+        for instance, transcript_line, translation_line in zip(yaml_data, transcript, translation):
+            writer.write(instance, transcript_line, translation_line)
+
+
+def read_lines(path: str) -> List[str]:
+    with open(path, "r") as fin:
+        return [line.strip() for line in fin]
+
+
+def iter_split(base_path: str, name: str) -> Iterator[Tuple[dict, str, str]]:
+    """Streams (instance, transcript, translation) from the split's manifest, or its YAML/text files"""
+    path = manifest_path(base_path, name)
+    if os.path.isfile(path):
+        with ManifestReader(path) as reader:
+            for record in reader:
+                yield split_texts(record)
+    else:
+        with open(os.path.join(base_path, f"{name}.transcript"), "r") as transcripts, open(
+            os.path.join(base_path, f"{name}.translation"), "r"
+        ) as translations:
+            for instance, transcript, translation in zip(
+                iter_yaml_records(os.path.join(base_path, f"{name}.yaml")), transcripts, translations
+            ):
+                yield instance, transcript.strip(), translation.strip()
+
+
+def load_split(base_path: str, name: str) -> Tuple[List[dict], List[str], List[str]]:
+    """Loads a split as the lists (yaml_data, transcript, translation)"""
+    path = manifest_path(base_path, name)
+    with stage("load_split") as record:
+        if os.path.isfile(path):
+            yaml_data, transcript, translation = [], [], []
+            for instance, transcript_line, translation_line in iter_split(base_path, name):
+                yaml_data.append(instance)
+                transcript.append(transcript_line)
+                translation.append(translation_line)
+        else:
+            yaml_data = load_yaml(os.path.join(base_path, f"{name}.yaml"))
+            transcript = read_lines(os.path.join(base_path, f"{name}.transcript"))
+            translation = read_lines(os.path.join(base_path, f"{name}.translation"))
+        record.add_items(len(yaml_data))
+    assert len(yaml_data) == len(transcript) == len(translation), [len(yaml_data), len(transcript), len(translation)]
+    return yaml_data, transcript, translation
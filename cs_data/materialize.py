@@ -0,0 +1,72 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Puts clips into a split's `clips` directory without copying the audio: hardlinks when the source is
+# on the same filesystem, otherwise a reflink (copy-on-write clone) and finally a symlink
+import os
+import errno
+import shutil
+
+from cs_data.profiling import stage
+
+CLIP_MODES = ["auto", "hardlink", "reflink", "symlink", "copy"]
+
+FICLONE = 0x40049409  # linux ioctl, supported by btrfs/xfs and others
+
+
+def reflink(src: str, dst: str):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform", src)
+
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        try:
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+        except OSError:
+            fout.close()
+            os.remove(dst)
+            raise
+
+
+def symlink(src: str, dst: str):
+    # relative, so the links survive moving the whole tree
+    target = os.path.realpath(src)
+    os.symlink(os.path.relpath(target, os.path.dirname(os.path.abspath(dst))), dst)
+
+
+def materialize_clip(src: str, dst: str, mode: str = "auto"):
+    """Makes `dst` a copy of `src`, by default without duplicating its data on disk"""
+    if os.path.lexists(dst):
+        os.remove(dst)  # don't write through an old link into the source clip
+
+    if mode == "copy":
+        shutil.copy(src, dst)
+    elif mode == "hardlink":
+        os.link(src, dst)
+    elif mode == "reflink":
+        reflink(src, dst)
+    elif mode == "symlink":
+        symlink(src, dst)
+    elif mode == "auto":
+        for link in [os.link, reflink]:
+            try:
+                return link(src, dst)
+            except OSError:
+                continue  # e.g. across filesystems or unsupported
+        symlink(src, dst)
+    else:
+        raise ValueError(f"Unknown clip mode {mode}, expected one of {CLIP_MODES}")
+
+
+def materialize_tree(src_dir: str, dst_dir: str, mode: str = "auto"):
+    """Like `copy_tree`, but each file is materialized with `materialize_clip`"""
+    with stage("materialize_tree") as record:
+        for root, _, files in os.walk(src_dir):
+            out_dir = os.path.join(dst_dir, os.path.relpath(root, src_dir))
+            os.makedirs(out_dir, exist_ok=True)
+            for file_name in files:
+                materialize_clip(os.path.join(root, file_name), os.path.join(out_dir, file_name), mode)
+            record.add_items(len(files))
@@ -0,0 +1,111 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Reads the stage profiles written by `cs_data/profiling.py`: a table of the stages of a run, or the wall times of
+# two runs side by side, failing when a stage got slower (e.g. to check a change for regressions).
+#   python -m cs_data.profile_report summarize profiles/20220601-120000
+#   python -m cs_data.profile_report compare profiles/20220601-120000 profiles/20220602-120000
+import os
+import sys
+import json
+import argparse
+from typing import List
+
+from cs_data.profiling import IO_FIELDS
+
+# a stage reports `process_peak_rss_mb` instead of its own `peak_rss_mb` where it can't be measured per stage
+PEAK_FIELDS = ["peak_rss_mb", "process_peak_rss_mb", "children_peak_rss_mb"]
+
+
+def load_reports(profile_dir: str) -> List[dict]:
+    reports = []
+    for file_name in sorted(os.listdir(profile_dir)):
+        if file_name.endswith(".json"):
+            with open(os.path.join(profile_dir, file_name), "r") as fin:
+                reports.append(json.load(fin))
+    return reports
+
+
+def stage_rows(reports: List[dict]) -> dict:
+    """{`script:stage`: stage report}, repeated stages (e.g. per split) are added up"""
+    rows = {}
+    for report in reports:
+        for item in report["stages"]:
+            key = f"{os.path.splitext(report['script'])[0]}:{item['name']}"
+            if key not in rows:
+                rows[key] = dict(item)
+                continue
+            row = rows[key]
+            for field in ["wall_s", "cpu_s", "children_cpu_s", *IO_FIELDS.values()]:
+                row[field] += item[field]
+            for field in PEAK_FIELDS:
+                if field in item:
+                    row[field] = max(row.get(field, 0), item[field])
+            if item["items"] is not None:
+                row["items"] = (row["items"] or 0) + item["items"]
+            row["items_per_s"] = round(row["items"] / row["wall_s"], 3) if row["items"] and row["wall_s"] > 0 else None
+    return rows
+
+
+def format_bytes(num_bytes: int) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(num_bytes) < 1024 or unit == "GB":
+            return f"{num_bytes:.0f}{unit}" if unit == "B" else f"{num_bytes:.1f}{unit}"
+        num_bytes /= 1024
+
+
+def summarize(profile_dir: str):
+    rows = stage_rows(load_reports(profile_dir))
+    width = max([len(key) for key in rows] + [5])
+    print(f"{'stage':<{width}} {'wall s':>9} {'cpu s':>9} {'child s':>9} {'rss MB':>8} {'read':>9} {'written':>9} {'items/s':>11}")
+    for key, row in rows.items():
+        items_per_s = f"{row['items_per_s']:,.0f}" if row["items_per_s"] is not None else "-"
+        rss = f"{max(row.get(field, 0) for field in PEAK_FIELDS):.0f}" + ("*" if "process_peak_rss_mb" in row else "")
+        print(
+            f"{key:<{width}} {row['wall_s']:>9.2f} {row['cpu_s']:>9.2f} {row['children_cpu_s']:>9.2f} "
+            f"{rss:>8} {format_bytes(row['read_bytes']):>9} {format_bytes(row['write_bytes']):>9} {items_per_s:>11}"
+        )
+    if any("process_peak_rss_mb" in row for row in rows.values()):
+        print("* peak RSS of the whole process so far, not of the stage alone")
+
+
+def compare(old_dir: str, new_dir: str, threshold: float = 0.1) -> int:
+    """Prints the wall time of each stage in both runs, returns the number of stages slower by over `threshold`"""
+    old_rows, new_rows = stage_rows(load_reports(old_dir)), stage_rows(load_reports(new_dir))
+    num_slower = 0
+    width = max([len(key) for key in [*old_rows, *new_rows]] + [5])
+    print(f"{'stage':<{width}} {'old s':>9} {'new s':>9} {'change':>8}")
+    for key in list(old_rows) + [key for key in new_rows if key not in old_rows]:
+        old_wall = old_rows[key]["wall_s"] if key in old_rows else None
+        new_wall = new_rows[key]["wall_s"] if key in new_rows else None
+        if old_wall and new_wall is not None:
+            change = new_wall / old_wall - 1
+            flag = "  slower" if change > threshold else ""
+            num_slower += change > threshold
+            print(f"{key:<{width}} {old_wall:>9.2f} {new_wall:>9.2f} {change:>+8.0%}{flag}")
+        else:
+            old_text, new_text = [f"{wall:.2f}" if wall is not None else "-" for wall in [old_wall, new_wall]]
+            print(f"{key:<{width}} {old_text:>9} {new_text:>9}")
+    return num_slower
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog="python -m cs_data.profile_report")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    summarize_parser = subparsers.add_parser("summarize", help="table of the stages of a run")
+    summarize_parser.add_argument("profile_dir")
+    compare_parser = subparsers.add_parser("compare", help="wall times of two runs, fails if a stage got slower")
+    compare_parser.add_argument("old_dir")
+    compare_parser.add_argument("new_dir")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+    if args.action == "summarize":
+        summarize(args.profile_dir)
+        return 0
+    return 1 if compare(args.old_dir, args.new_dir, args.threshold) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Stage-level profiling of the dataset scripts: each `with stage("name")` block records its wall time, CPU time
+# (of the process and of the subprocesses and pool workers it waited for), peak RSS, bytes read/written and
+# items per second. The peak RSS of a stage is its own on Linux, where the high-water mark of the process is reset
+# when a stage starts; elsewhere it is only the peak of the process so far, reported as `process_peak_rss_mb`. Stages nest, a sub-step is reported as `parent/child`. When `CS_DATA_PROFILE_DIR` is set,
+# every script writes a JSON report of its stages there when it exits (`create_datasets.sh` sets it per run),
+# see `cs_data/profile_report.py` to read them.
+#
+#   with stage("write_split", items=len(yaml_data)):
+#       ...
+import os
+import sys
+import json
+import time
+import atexit
+import socket
+import resource
+import threading
+import contextlib
+
+PROFILE_DIR_ENV = "CS_DATA_PROFILE_DIR"
+PROC_IO = "/proc/self/io"
+PROC_STATUS = "/proc/self/status"
+PROC_CLEAR_REFS = "/proc/self/clear_refs"
+IO_FIELDS = {"rchar": "read_bytes", "wchar": "write_bytes", "read_bytes": "disk_read_bytes", "write_bytes": "disk_write_bytes"}
+# RSS is in KB on Linux, bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def read_io(path: str = PROC_IO) -> dict:
+    """Bytes read and written so far (including finished children), zeros where /proc isn't available"""
+    counters = dict.fromkeys(IO_FIELDS.values(), 0)
+    try:
+        with open(path, "r") as fin:
+            for line in fin:
+                key, _, value = line.partition(":")
+                if key in IO_FIELDS:
+                    counters[IO_FIELDS[key]] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+def snapshot() -> dict:
+    times = os.times()
+    return {
+        "wall": time.perf_counter(),
+        "cpu": times.user + times.system,
+        "children_cpu": times.children_user + times.children_system,
+        **read_io(),
+    }
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    return resource.getrusage(who).ru_maxrss * RSS_UNIT / (1 << 20)
+
+
+def read_hwm_mb() -> float:
+    """The RSS high-water mark of the process since it was last reset (`VmHWM`), None without /proc"""
+    try:
+        with open(PROC_STATUS, "r") as fin:
+            for line in fin:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def reset_hwm() -> bool:
+    """Resets the RSS high-water mark of the process to its current RSS, returns whether it could (Linux only)"""
+    try:
+        with open(PROC_CLEAR_REFS, "w") as fout:
+            fout.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def wait_child(pid: int):
+    """
+    Waits for a child process, returns its exit status, resource usage and IO counters. They are the child's
+        own (with the children it waited for), where the counters of this process would also hold those of any
+        other child that ended meanwhile. The IO is read before the child is reaped, zeros without /proc.
+    """
+    io = dict.fromkeys(IO_FIELDS.values(), 0)
+    if hasattr(os, "waitid"):
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)  # done, but still there to read
+        io = read_io(f"/proc/{pid}/io")
+    _, status, usage = os.wait4(pid, 0)
+    return status, usage, io
+
+
+def child_report(name: str, wall: float, usage, io: dict) -> dict:
+    """The report of a stage run as a child process, from `wait_child`"""
+    report = {
+        "name": name,
+        "wall_s": round(wall, 6),
+        "cpu_s": 0.0,
+        "children_cpu_s": round(usage.ru_utime + usage.ru_stime, 6),
+        "peak_rss_mb": 0.0,
+        "children_peak_rss_mb": round(usage.ru_maxrss * RSS_UNIT / (1 << 20), 3),
+    }
+    report.update(io)
+    report["items"] = None
+    report["items_per_s"] = None
+    return report
+
+
+class StageRecord:
+    """A running stage, `add_items` counts the items it processed for the items/s rate"""
+
+    def __init__(self, name: str, items: int = None):
+        self.name = name
+        self.items = items
+        self.start = snapshot()
+        self.own_peak = False  # whether `peak_mb` is the stage's own, from a reset high-water mark
+        self.peak_mb = 0.0
+
+    def add_items(self, num_items: int = 1):
+        self.items = (self.items or 0) + num_items
+
+    def finish(self) -> dict:
+        end = snapshot()
+        wall = end["wall"] - self.start["wall"]
+        report = {
+            "name": self.name,
+            "wall_s": round(wall, 6),
+            "cpu_s": round(end["cpu"] - self.start["cpu"], 6),
+            "children_cpu_s": round(end["children_cpu"] - self.start["children_cpu"], 6),
+        }
+        if self.own_peak:
+            report["peak_rss_mb"] = round(self.peak_mb, 3)
+        else:
+            report["process_peak_rss_mb"] = round(peak_rss_mb(), 3)  # of the process so far, maybe an earlier stage's
+        report["children_peak_rss_mb"] = round(peak_rss_mb(resource.RUSAGE_CHILDREN), 3)
+        for field in IO_FIELDS.values():
+            report[field] = end[field] - self.start[field]
+        report["items"] = self.items
+        report["items_per_s"] = round(self.items / wall, 3) if self.items is not None and wall > 0 else None
+        return report
+
+
+class Profiler:
+    """The stages of this process, written as one report when it exits"""
+
+    def __init__(self):
+        self.local = threading.local()  # stages run from several threads (e.g. by the scheduler) nest separately
+        self.stages = []
+        self.started = time.time()
+        self.start = snapshot()
+        self.registered = False
+        self.lock = threading.Lock()
+        self.open = []  # the running stages of every thread
+        self.peak_mb = 0.0  # of the whole process, as the high-water mark is reset
+
+    def register(self):
+        if not self.registered:
+            atexit.register(self.save)
+            self.registered = True
+
+    def add(self, report: dict):
+        """Adds the report of a stage measured elsewhere, e.g. a `child_report`"""
+        self.register()
+        self.stages.append(report)
+
+    @contextlib.contextmanager
+    def stage(self, name: str, items: int = None):
+        self.register()
+        stack = self.local.__dict__.setdefault("stack", [])
+        record = StageRecord("/".join([item.name for item in stack[-1:]] + [name]), items)
+        with self.lock:
+            self.track_peaks()  # the running stages keep their peak so far, the new one starts from the current RSS
+            record.own_peak = reset_hwm()
+            self.open.append(record)
+        stack.append(record)
+        try:
+            yield record
+        finally:
+            stack.pop()
+            with self.lock:
+                self.track_peaks()
+                self.open.remove(record)
+            self.stages.append(record.finish())
+
+    def track_peaks(self):
+        """Raises the peak of the running stages and of the process to the high-water mark since the last reset"""
+        hwm = read_hwm_mb()
+        if hwm is not None:
+            for record in self.open:
+                record.peak_mb = max(record.peak_mb, hwm)
+            self.peak_mb = max(self.peak_mb, hwm)
+
+    def report(self) -> dict:
+        total = StageRecord("total")
+        total.start = self.start
+        with self.lock:
+            self.track_peaks()
+        total.own_peak, total.peak_mb = True, max(self.peak_mb, peak_rss_mb())
+        return {
+            "script": os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else "python",
+            "argv": sys.argv[1:],
+            "cwd": os.getcwd(),
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "total": total.finish(),
+            "stages": self.stages,
+        }
+
+    def save(self, profile_dir: str = None) -> str:
+        """Writes the report to `profile_dir` (by default `$CS_DATA_PROFILE_DIR`, nothing is written without it)"""
+        profile_dir = profile_dir or os.environ.get(PROFILE_DIR_ENV)
+        if not profile_dir or not self.stages:
+            return None
+        os.makedirs(profile_dir, exist_ok=True)
+        report = self.report()
+        script = os.path.splitext(report["script"])[0]
+        path = os.path.join(profile_dir, f"{time.strftime('%H%M%S', time.localtime(self.started))}-{script}-{os.getpid()}.json")
+        with open(path, "w") as fout:
+            json.dump(report, fout, indent=1)
+        return path
+
+
+PROFILER = Profiler()
+
+
+def stage(name: str, items: int = None):
+    """Profiles a block as a stage of this script (or a sub-step of the enclosing stage)"""
+    return PROFILER.stage(name, items)
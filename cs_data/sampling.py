@@ -0,0 +1,48 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Sampling on index arrays: draws the same items as `random.sample` did in the scripts, then selects
+# records through lazy views instead of copying them into NumPy object/unicode arrays
+import random
+from typing import Sequence, Tuple
+
+import numpy as np
+
+
+def sample_indices(num_items: int, num_samples: int, rng=random) -> np.ndarray:
+    """`rng.sample(range(num_items), num_samples)` as an array, in the order drawn"""
+    # `sample` draws the same from a range as from `list(range(...))`, without building the list
+    return np.array(rng.sample(range(num_items), num_samples), dtype=np.int64)
+
+
+def split_indices(num_items: int, sampled: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """The sorted sampled indices and the sorted rest, in O(num_items)"""
+    mask = np.zeros(num_items, dtype=bool)
+    mask[sampled] = True
+    return np.flatnonzero(mask), np.flatnonzero(~mask)
+
+
+class IndexView(Sequence):
+    """A read-only view of `data` at `indices`, the items are only looked up when accessed"""
+
+    def __init__(self, data: Sequence, indices: np.ndarray):
+        self.data = data
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return IndexView(self.data, self.indices[idx])
+        return self.data[int(self.indices[idx])]
+
+    def __iter__(self):
+        data = self.data
+        for idx in self.indices.tolist():
+            yield data[idx]
+
+    def tolist(self) -> list:
+        return list(self)
@@ -0,0 +1,217 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Runs the stages of the whole build as a dependency graph. `create_datasets.sh` collects the stages that the
+# `setup_all.sh` scripts declare (with `CS_DATA_PLAN` set, see `cs_data/stage_cache.py`) into a plan file, and
+# the scheduler runs them: a stage waits for the earlier stages that write its inputs (or read or write its
+# outputs), independent stages run concurrently within a CPU and IO budget. Each stage is still skipped when
+# it is up to date, and is told the CPUs it was given through `CS_DATA_JOBS` (see `cs_data/jobs.py`).
+# The output of each stage goes to `{log-dir}/{dataset}.{stage}.log`.
+#
+# From the shell:
+#   python -m cs_data.scheduler run build_plan.jsonl --cpus 32 --io 2
+#   python -m cs_data.scheduler show build_plan.jsonl
+import os
+import sys
+import json
+import glob
+import math
+import time
+import fnmatch
+import argparse
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Set
+
+from cs_data.jobs import JOBS_ENV
+from cs_data.stage_cache import CACHE_DIR, Stage, StageCache
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOG_DIR = "logs"
+DEFAULT_IO = 2
+
+
+class PlannedStage(Stage):
+    """A stage of the plan, with where its cache is and whether it was forced"""
+
+    def __init__(self, cache_dir: str = None, force: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        self.cache_dir = cache_dir or os.path.join(self.cwd, CACHE_DIR)
+        self.force = force
+
+    @property
+    def label(self) -> str:
+        """The stage's name, prefixed with its directory since e.g. both datasets have a `features` stage"""
+        return f"{os.path.basename(os.path.normpath(self.cwd))}:{self.name}"
+
+
+def load_plan(path: str) -> List[PlannedStage]:
+    with open(path, "r") as fin:
+        stages = [PlannedStage(**json.loads(line)) for line in fin if line.strip()]
+    labels = [stage.label for stage in stages]
+    duplicates = sorted({label for label in labels if labels.count(label) > 1})
+    if duplicates:
+        raise ValueError(f"Stages declared more than once: {duplicates}")
+    return stages
+
+
+def stage_paths(stage: Stage, patterns: list) -> list:
+    return [os.path.normpath(os.path.join(os.path.abspath(stage.cwd), pattern)) for pattern in patterns]
+
+
+def paths_overlap(first: str, second: str) -> bool:
+    """
+    Whether two paths (or globs) can name the same file: one is inside the other, component by component, where
+        a glob component matches the other component, and two globs are taken to overlap
+    """
+    for first_part, second_part in zip(first.split(os.sep), second.split(os.sep)):
+        if first_part == second_part:
+            continue
+        first_glob, second_glob = glob.has_magic(first_part), glob.has_magic(second_part)
+        if first_glob and second_glob:
+            continue
+        if not (first_glob and fnmatch.fnmatchcase(second_part, first_part)) and not (
+            second_glob and fnmatch.fnmatchcase(first_part, second_part)
+        ):
+            return False
+    return True
+
+
+def any_overlap(firsts: list, seconds: list) -> bool:
+    return any(paths_overlap(first, second) for first in firsts for second in seconds)
+
+
+def dependencies(stages: List[PlannedStage]) -> Dict[str, Set[str]]:
+    """
+    The labels of the stages each stage waits for: the earlier ones writing its inputs, reading or writing its
+        outputs, or named in its `after` (by name in the same directory, or by label). Only earlier stages
+        count, so the graph runs the stages in an order the sequential scripts could have run them in.
+    """
+    paths = {stage.label: (stage_paths(stage, stage.inputs), stage_paths(stage, stage.outputs)) for stage in stages}
+    graph = {}
+    for idx, stage in enumerate(stages):
+        inputs, outputs = paths[stage.label]
+        after = {name if ":" in name else f"{os.path.basename(os.path.normpath(stage.cwd))}:{name}" for name in stage.after}
+        unknown = after - {other.label for other in stages[:idx]}
+        if unknown:
+            raise ValueError(f"{stage.label} is after {sorted(unknown)}, which are not declared before it")
+        graph[stage.label] = set(after)
+        for other in stages[:idx]:
+            other_inputs, other_outputs = paths[other.label]
+            if any_overlap(other_outputs, inputs + outputs) or any_overlap(other_inputs, outputs):
+                graph[stage.label].add(other.label)
+    return graph
+
+
+def cpu_share(spec: str, budget: int) -> int:
+    """The CPUs of a stage out of the `budget`: a number, a percentage of the budget or `all`"""
+    if spec == "all":
+        num_cpus = budget
+    elif spec.endswith("%"):
+        num_cpus = math.ceil(budget * float(spec[:-1]) / 100)
+    else:
+        num_cpus = int(spec)
+    return max(1, min(budget, num_cpus))
+
+
+class Scheduler:
+    """Runs the stages of a plan as soon as their dependencies are done and they fit in the budget"""
+
+    def __init__(self, stages: List[PlannedStage], cpus: int = None, io: int = DEFAULT_IO, log_dir: str = LOG_DIR, force: bool = False):
+        self.stages = stages
+        self.graph = dependencies(stages)
+        self.cpus = cpus or os.cpu_count()
+        self.io = max(1, io)
+        self.log_dir = log_dir
+        self.force = force
+        self.caches = {}
+
+    def cache(self, stage: PlannedStage) -> StageCache:
+        if stage.cache_dir not in self.caches:
+            self.caches[stage.cache_dir] = StageCache(stage.cache_dir)
+        return self.caches[stage.cache_dir]
+
+    def stage_env(self, num_cpus: int) -> dict:
+        env = {**os.environ, JOBS_ENV: str(num_cpus)}
+        env["PYTHONPATH"] = os.pathsep.join([REPO_ROOT] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+        return env
+
+    def run_stage(self, stage: PlannedStage, num_cpus: int) -> bool:
+        log_path = os.path.join(self.log_dir, stage.label.replace(":", ".") + ".log")
+        return self.cache(stage).run(stage, self.force or stage.force, self.stage_env(num_cpus), log_path, stage.label)
+
+    def run(self) -> bool:
+        """Runs every stage, returns whether they all succeeded. After a failure, only the running ones finish."""
+        os.makedirs(self.log_dir, exist_ok=True)
+        pending = list(self.stages)  # in declaration order, which is also the priority
+        done, failed = set(), []
+        running = {}  # future: (stage, cpus, io, start)
+        used_cpus = used_io = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, len(self.stages))) as pool:
+            while pending or running:
+                for stage in list(pending) if not failed else []:
+                    num_cpus, io = cpu_share(stage.cpus, self.cpus), min(stage.io, self.io)
+                    if self.graph[stage.label] <= done and used_cpus + num_cpus <= self.cpus and used_io + io <= self.io:
+                        pending.remove(stage)
+                        used_cpus, used_io = used_cpus + num_cpus, used_io + io
+                        running[pool.submit(self.run_stage, stage, num_cpus)] = (stage, num_cpus, io, time.perf_counter())
+                if not running:
+                    break  # what is left waits on a failed stage
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, num_cpus, io, stage_start = running.pop(future)
+                    used_cpus, used_io = used_cpus - num_cpus, used_io - io
+                    try:
+                        ran = future.result()
+                        done.add(stage.label)
+                        if ran:
+                            print(f"[{stage.label}] done in {time.perf_counter() - stage_start:.1f}s", flush=True)
+                    except subprocess.CalledProcessError as e:
+                        failed.append(stage.label)
+                        print(f"[{stage.label}] failed with exit code {e.returncode}, see {self.log_dir}", flush=True)
+                    except Exception as e:  # e.g. a missing executable, or an input that can't be read
+                        failed.append(stage.label)
+                        print(f"[{stage.label}] failed: {type(e).__name__}: {e}", flush=True)
+
+        print(f"{len(done)} of {len(self.stages)} stages done in {time.perf_counter() - start:.1f}s", flush=True)
+        if pending:
+            print(f"Not run because of the failures: {', '.join(stage.label for stage in pending)}")
+        return not failed
+
+    def waves(self) -> List[List[PlannedStage]]:
+        """The stages grouped by how many stages they wait for in a row, as an unlimited budget would start them"""
+        depth = {}
+        for stage in self.stages:
+            depth[stage.label] = max([depth[label] + 1 for label in self.graph[stage.label]], default=0)
+        return [[stage for stage in self.stages if depth[stage.label] == level] for level in range(max(depth.values(), default=-1) + 1)]
+
+    def show(self):
+        for level, stages in enumerate(self.waves()):
+            print(f"wave {level}:")
+            for stage in stages:
+                after = ", ".join(sorted(self.graph[stage.label])) or "-"
+                print(f"  {stage.label:<28} cpus {cpu_share(stage.cpus, self.cpus):>3}  io {stage.io}  after {after}")
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog="python -m cs_data.scheduler")
+    parser.add_argument("action", choices=["run", "show"], help="run the plan, or show its dependency graph")
+    parser.add_argument("plan", help="the plan file collected with `CS_DATA_PLAN`")
+    parser.add_argument("--cpus", type=int, default=None, help="CPUs shared by the running stages, all of them by default")
+    parser.add_argument("--io", type=int, default=DEFAULT_IO, help="IO budget, e.g. the downloads and archive writing at once")
+    parser.add_argument("--log-dir", default=LOG_DIR)
+    parser.add_argument("--force", action="store_true", help="rerun every stage")
+    args = parser.parse_args(argv)
+
+    scheduler = Scheduler(load_plan(args.plan), args.cpus, args.io, args.log_dir, args.force)
+    if args.action == "show":
+        scheduler.show()
+        return 0
+    return 0 if scheduler.run() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
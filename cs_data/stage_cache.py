@@ -0,0 +1,287 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Skips pipeline stages whose inputs have not changed. Each stage records the content hashes of its input
+# files (stat fingerprints for directories, which can hold 100k+ clips), its parameters and its command in
+# `.stage_cache/{name}.json`; it is rerun only when one of these changes or an output is missing. Since
+# the outputs of a stage are the inputs of the next, a change only reruns the stages downstream of it.
+#
+# From the shell:
+#   python -m cs_data.stage_cache run --name cs_splits --inputs cs_corpus speech --outputs output/fisher \
+#       --param seed=1 -- python make_cs_splits.py
+# With `CS_DATA_PLAN` set, `run` only appends the stage to that plan file, for `cs_data/scheduler.py` to run.
+import os
+import sys
+import glob
+import json
+import time
+import shlex
+import hashlib
+import argparse
+import threading
+import subprocess
+
+from cs_data import profiling
+
+CACHE_DIR = ".stage_cache"
+PLAN_ENV = "CS_DATA_PLAN"
+HASH_CHUNK_SIZE = 1 << 20
+SCRIPT_SUFFIXES = (".py", ".sh")
+IGNORED_DIRS = {"__pycache__", CACHE_DIR}
+
+
+class Stage:
+    """
+    A pipeline step: a command, the paths it reads and the paths it writes. `cpus` ("4", "50%" or "all"),
+        `io` and `after` are only used by the scheduler and are not part of the fingerprint.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        command,
+        inputs=(),
+        outputs=(),
+        params: dict = None,
+        cwd: str = ".",
+        cpus: str = "1",
+        io: int = 0,
+        after=(),
+    ):
+        self.name = name
+        self.command = command if isinstance(command, str) else list(command)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = {key: str(value) for key, value in (params or {}).items()}
+        self.cwd = cwd
+        self.cpus = str(cpus)
+        self.io = io
+        self.after = list(after)
+
+    def to_dict(self) -> dict:
+        keys = ["name", "command", "inputs", "outputs", "params", "cwd", "cpus", "io", "after"]
+        return {key: getattr(self, key) for key in keys}
+
+    def script_inputs(self) -> list:
+        """The scripts the command runs, so that editing one of them reruns the stage"""
+        args = shlex.split(self.command) if isinstance(self.command, str) else self.command
+        return [
+            arg for arg in args
+            if arg.endswith(SCRIPT_SUFFIXES) and os.path.isfile(os.path.join(self.cwd, arg))
+        ]
+
+    def __repr__(self):
+        return f"Stage({self.name!r})"
+
+
+def expand_paths(patterns: list, cwd: str = ".") -> list:
+    """Expands globs, keeping patterns without a match so a missing input is still recorded"""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(os.path.join(cwd, pattern)))
+        paths.extend([os.path.relpath(match, cwd) for match in matches] or [pattern])
+    return sorted(set(paths))
+
+
+def fingerprint_dir(path: str) -> str:
+    """Hash of the names, sizes and mtimes of every file under `path`"""
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(dir_name for dir_name in dirs if dir_name not in IGNORED_DIRS)
+        for file_name in sorted(files):
+            file_path = os.path.join(root, file_name)
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue  # a dangling link
+            digest.update(f"{os.path.relpath(file_path, path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return "dir:" + digest.hexdigest()
+
+
+class StageCache:
+    """The stage records in `cache_dir`, plus a memo of file hashes keyed by size and mtime"""
+
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.memo_path = os.path.join(cache_dir, "file_hashes.json")
+        self.lock = threading.Lock()  # stages may be run from several threads
+        os.makedirs(cache_dir, exist_ok=True)
+        self.memo = self.read_json(self.memo_path) or {}
+
+    @staticmethod
+    def read_json(path: str):
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r") as fin:
+            return json.load(fin)
+
+    @staticmethod
+    def write_json(path: str, data):
+        with open(path + ".tmp", "w") as fout:
+            json.dump(data, fout, indent=1, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+    def record_path(self, stage: Stage) -> str:
+        return os.path.join(self.cache_dir, f"{stage.name}.json")
+
+    def hash_file(self, path: str) -> str:
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        with self.lock:
+            memo = self.memo.get(key)
+        if memo is not None and memo[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return memo[2]
+
+        digest = hashlib.sha1()
+        with open(path, "rb") as fin:
+            for chunk in iter(lambda: fin.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        with self.lock:
+            self.memo[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def hash_path(self, path: str) -> str:
+        if os.path.isdir(path):
+            return fingerprint_dir(path)
+        if os.path.isfile(path):
+            return self.hash_file(path)
+        return "missing"
+
+    def fingerprint(self, stage: Stage) -> dict:
+        inputs = expand_paths(stage.inputs + stage.script_inputs(), stage.cwd)
+        return {
+            "command": stage.command,
+            "params": stage.params,
+            "inputs": {path: self.hash_path(os.path.join(stage.cwd, path)) for path in inputs},
+        }
+
+    def stale_reason(self, stage: Stage) -> str:
+        """Why `stage` has to run, or None when it is up to date"""
+        record = self.read_json(self.record_path(stage))
+        if record is None:
+            return "never run"
+        for path in expand_paths(stage.outputs, stage.cwd):
+            if not os.path.exists(os.path.join(stage.cwd, path)):
+                return f"output {path} is missing"
+        fingerprint = self.fingerprint(stage)
+        if record["command"] != fingerprint["command"]:
+            return "the command changed"
+        if record["params"] != fingerprint["params"]:
+            return "the parameters changed"
+        for path, digest in fingerprint["inputs"].items():
+            if record["inputs"].get(path) != digest:
+                return f"input {path} changed"
+        if set(record["inputs"]) != set(fingerprint["inputs"]):
+            return "the inputs changed"
+        return None
+
+    def record(self, stage: Stage):
+        # fingerprinted after the run, so a stage that rewrites its inputs (or adds files to an input
+        # directory) does not invalidate itself
+        self.write_json(self.record_path(stage), self.fingerprint(stage))
+        with self.lock:
+            self.write_json(self.memo_path, self.memo)
+
+    def invalidate(self, stage_name: str):
+        if os.path.isfile(os.path.join(self.cache_dir, f"{stage_name}.json")):
+            os.remove(os.path.join(self.cache_dir, f"{stage_name}.json"))
+
+    def run(self, stage: Stage, force: bool = False, env: dict = None, log_path: str = None, label: str = None) -> bool:
+        """
+        Runs `stage` unless it is up to date, returns whether it ran. With `log_path`, its output goes there.
+            It is profiled as `label` (by default its name), e.g. `fisher:features` when both datasets have one.
+        """
+        label = label or stage.name
+        reason = "forced" if force else self.stale_reason(stage)
+        if reason is None:
+            print(f"[{label}] up to date, skipping", flush=True)
+            return False
+
+        print(f"[{label}] running ({reason})", flush=True)
+        self.invalidate(stage.name)  # a failed run must not look finished
+        log = open(log_path, "w") if log_path is not None else None
+        try:
+            start = time.perf_counter()
+            proc = subprocess.Popen(
+                stage.command, cwd=stage.cwd, shell=isinstance(stage.command, str), env=env,
+                stdout=log, stderr=subprocess.STDOUT if log is not None else None,
+            )
+            # measured on the command itself, as other stages may be running from this process at the same time
+            status, usage, io = profiling.wait_child(proc.pid)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+        finally:
+            if log is not None:
+                log.close()
+        profiling.PROFILER.add(profiling.child_report(label, time.perf_counter() - start, usage, io))
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, stage.command)
+        self.record(stage)
+        return True
+
+
+def parse_params(params: list) -> dict:
+    parsed = {}
+    for param in params:
+        key, sep, value = param.partition("=")
+        if not sep:
+            raise ValueError(f"Parameters are given as key=value, got {param}")
+        parsed[key] = value
+    return parsed
+
+
+def main(argv: list = None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = []
+    if "--" in argv:  # everything after `--` is the stage's command
+        command = argv[argv.index("--") + 1 :]
+        argv = argv[: argv.index("--")]
+
+    parser = argparse.ArgumentParser(prog="python -m cs_data.stage_cache")
+    parser.add_argument("action", choices=["run", "status", "invalidate"])
+    parser.add_argument("--name", required=True, help="name of the stage, its record is `{cache-dir}/{name}.json`")
+    parser.add_argument("--inputs", nargs="*", default=[], help="files, directories or globs the stage reads")
+    parser.add_argument("--outputs", nargs="*", default=[], help="files or directories the stage writes")
+    parser.add_argument("--param", nargs="*", default=[], help="key=value parameters that should rerun the stage when changed")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--force", action="store_true", help="run even if the stage is up to date")
+    parser.add_argument("--cpus", default="1", help="for the scheduler: CPUs the stage uses, a number, a share of them (50%%) or all")
+    parser.add_argument("--io", type=int, default=0, help="for the scheduler: units of the IO budget the stage uses")
+    parser.add_argument("--after", nargs="*", default=[], help="for the scheduler: stages to wait for besides the ones writing its inputs")
+    args = parser.parse_args(argv)
+
+    stage = Stage(
+        args.name, command, args.inputs, args.outputs, parse_params(args.param), cpus=args.cpus, io=args.io, after=args.after
+    )
+    if args.action == "run" and os.environ.get(PLAN_ENV):
+        if not command:
+            parser.error("`run` needs the stage's command after `--`")
+        stage.cwd = os.getcwd()
+        with open(os.environ[PLAN_ENV], "a") as fout:
+            fout.write(json.dumps({**stage.to_dict(), "cache_dir": os.path.abspath(args.cache_dir), "force": args.force}) + "\n")
+        print(f"[{stage.name}] planned")
+        return 0
+
+    cache = StageCache(args.cache_dir)
+    if args.action == "invalidate":
+        cache.invalidate(args.name)
+        return 0
+
+    if args.action == "status":
+        reason = cache.stale_reason(stage)
+        print(f"[{stage.name}] {'up to date' if reason is None else 'stale: ' + reason}")
+        return 0 if reason is None else 1
+
+    if not command:
+        parser.error("`run` needs the stage's command after `--`")
+    try:
+        cache.run(stage, args.force)
+    except subprocess.CalledProcessError as e:
+        print(f"[{stage.name}] failed with exit code {e.returncode}")
+        return e.returncode
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
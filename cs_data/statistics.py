@@ -0,0 +1,442 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Streaming statistics of the code-switched data: per split, histograms of the CS ratio, language switches,
+# duration, tokens and tokens per second of the utterances, and a summary (count, mean, std, min, max) of each
+# per speaker and per recording. They are accumulated one utterance at a time, and the statistics of parallel
+# workers merge into the same totals as one pass would give, so each script can report on what it writes
+# (`cs_corpus/statistics.json`, `output/miami/all/statistics.json`) and a built dataset can be checked without
+# loading it into pandas:
+#   python -m cs_data.statistics --search output/fisher output/lid --output output/statistics.json
+#   python -m cs_data.statistics miami/cs miami/mono --parquet statistics.parquet
+import os
+import sys
+import copy
+import json
+import math
+import bisect
+import argparse
+from multiprocessing import Pool
+from typing import Iterator, List
+
+import numpy as np
+
+from cs_data.batching import WAV_HEADER_BYTES, wav_duration
+from cs_data.dataset import CodeSwitchedDataset, find_splits
+from cs_data.jobs import default_jobs
+from cs_data.profiling import stage
+
+STATISTICS_FILE = "statistics.json"
+# the bin edges of each metric's histogram, values outside of them are counted in the first or last bin
+METRIC_EDGES = {
+    "cs_ratio": np.linspace(0, 1, 21).round(2).tolist(),
+    "switches": list(range(0, 11)),  # language changes between neighbouring words
+    "cs_spans": list(range(0, 11)),  # stretches of the embedded language
+    "duration_s": np.arange(0, 30.5, 0.5).tolist(),
+    "tokens": list(range(0, 105, 5)),
+    "tokens_per_s": np.arange(0, 10.25, 0.25).tolist(),
+}
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+class Summary:
+    """Count, sum, sum of squares, min and max of a metric, enough for its mean and std"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.sum_sq = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.sum_sq += value * value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def add_many(self, values: np.ndarray):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.sum_sq += float(np.dot(values, values))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other: "Summary"):
+        self.count += other.count
+        self.total += other.total
+        self.sum_sq += other.sum_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else math.nan
+
+    @property
+    def std(self) -> float:
+        if not self.count:
+            return math.nan
+        return math.sqrt(max(0.0, self.sum_sq / self.count - self.mean ** 2))
+
+    def to_dict(self) -> dict:
+        if not self.count:
+            return {"count": 0, "total": 0.0, "sum_sq": 0.0, "min": None, "max": None}
+        return {"count": self.count, "total": self.total, "sum_sq": self.sum_sq, "min": self.min, "max": self.max}
+
+    def restore(self, data: dict):
+        if data["count"]:
+            self.count, self.total, self.sum_sq = data["count"], data["total"], data["sum_sq"]
+            self.min, self.max = data["min"], data["max"]
+        return self
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Summary":
+        return cls().restore(data)
+
+
+class Histogram(Summary):
+    """A `Summary` with the counts of the values in the bins between `edges`"""
+
+    def __init__(self, edges: list):
+        super().__init__()
+        self.edges = list(edges)
+        self.counts = [0] * (len(self.edges) - 1)
+
+    def bin(self, value: float) -> int:
+        return min(max(bisect.bisect_right(self.edges, value) - 1, 0), len(self.counts) - 1)
+
+    def add(self, value: float):
+        super().add(value)
+        self.counts[self.bin(value)] += 1
+
+    def add_many(self, values: np.ndarray):
+        values = np.asarray(values, dtype=np.float64)
+        super().add_many(values)
+        bins = np.clip(np.searchsorted(self.edges, values, side="right") - 1, 0, len(self.counts) - 1)
+        for idx, count in enumerate(np.bincount(bins, minlength=len(self.counts)).tolist()):
+            self.counts[idx] += count
+
+    def merge(self, other: "Histogram"):
+        if other.edges != self.edges:
+            raise ValueError(f"Can't merge histograms of different bins: {self.edges} and {other.edges}")
+        super().merge(other)
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+
+    def quantile(self, q: float) -> float:
+        """Estimated from the bins, as if the values of a bin were spread evenly over it"""
+        if not self.count:
+            return math.nan
+        target = q * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            if count and seen + count >= target:
+                # the first and last bins also hold the values outside of the edges
+                low = self.min if idx == 0 else max(self.edges[idx], self.min)
+                high = self.max if idx == len(self.counts) - 1 else min(self.edges[idx + 1], self.max)
+                return low + (high - low) * (target - seen) / count
+            seen += count
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {**super().to_dict(), "edges": self.edges, "counts": self.counts}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Histogram":
+        histogram = cls(data["edges"]).restore(data)
+        histogram.counts = list(data["counts"])
+        return histogram
+
+
+class GroupStatistics:
+    """
+    The utterances of a split, speaker or recording: how many, how many of the ones known to be code-switched or
+        not (`labelled`) are, and each metric
+    """
+
+    def __init__(self, histograms: bool = True):
+        self.histograms = histograms
+        self.utterances = 0
+        self.labelled = 0
+        self.code_switched = 0
+        self.metrics = {}
+
+    def metric(self, name: str) -> Summary:
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(METRIC_EDGES[name]) if self.histograms and name in METRIC_EDGES else Summary()
+        return self.metrics[name]
+
+    def add(self, values: dict, code_switched: bool = None):
+        self.utterances += 1
+        if code_switched is not None:
+            self.labelled += 1
+            self.code_switched += bool(code_switched)
+        for name, value in values.items():
+            if value is not None:
+                self.metric(name).add(value)
+
+    def merge(self, other: "GroupStatistics"):
+        self.utterances += other.utterances
+        self.labelled += other.labelled
+        self.code_switched += other.code_switched
+        for name, summary in other.metrics.items():
+            if name in self.metrics:
+                self.metrics[name].merge(summary)
+            else:
+                self.metrics[name] = copy.deepcopy(summary)
+
+    def to_dict(self) -> dict:
+        return {
+            "utterances": self.utterances,
+            "labelled": self.labelled,
+            "code_switched": self.code_switched,
+            "metrics": {name: summary.to_dict() for name, summary in sorted(self.metrics.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, histograms: bool = True) -> "GroupStatistics":
+        group = cls(histograms)
+        group.utterances, group.labelled, group.code_switched = data["utterances"], data["labelled"], data["code_switched"]
+        for name, summary in data["metrics"].items():
+            group.metrics[name] = Histogram.from_dict(summary) if "edges" in summary else Summary.from_dict(summary)
+        return group
+
+
+class SplitStatistics(GroupStatistics):
+    """The histograms of a split, and the summaries of its speakers and recordings"""
+
+    def __init__(self):
+        super().__init__(histograms=True)
+        self.speakers = {}
+        self.files = {}
+
+    def add(self, values: dict, code_switched: bool = None, speaker: str = None, file: str = None):
+        super().add(values, code_switched)
+        for groups, key in [(self.speakers, speaker), (self.files, file)]:
+            if key is not None:
+                if key not in groups:
+                    groups[key] = GroupStatistics(histograms=False)
+                groups[key].add(values, code_switched)
+
+    def merge(self, other: "SplitStatistics"):
+        super().merge(other)
+        for groups, other_groups in [(self.speakers, other.speakers), (self.files, other.files)]:
+            for key, group in other_groups.items():
+                if key in groups:
+                    groups[key].merge(group)
+                else:
+                    groups[key] = copy.deepcopy(group)
+
+    def to_dict(self) -> dict:
+        return {
+            **super().to_dict(),
+            "speakers": {key: group.to_dict() for key, group in sorted(self.speakers.items())},
+            "files": {key: group.to_dict() for key, group in sorted(self.files.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SplitStatistics":
+        split = cls()
+        totals = GroupStatistics.from_dict(data)
+        split.utterances, split.labelled, split.code_switched = totals.utterances, totals.labelled, totals.code_switched
+        split.metrics = totals.metrics
+        split.speakers = {key: GroupStatistics.from_dict(group, False) for key, group in data["speakers"].items()}
+        split.files = {key: GroupStatistics.from_dict(group, False) for key, group in data["files"].items()}
+        return split
+
+
+class CorpusStatistics:
+    """
+    The statistics of every split, added one utterance at a time. Statistics of the same splits gathered
+        separately (e.g. by each worker, on its part of the files) merge into the totals of all of them.
+    """
+
+    def __init__(self):
+        self.splits = {}
+
+    def split(self, name: str) -> SplitStatistics:
+        if name not in self.splits:
+            self.splits[name] = SplitStatistics()
+        return self.splits[name]
+
+    def add(self, split: str, values: dict, code_switched: bool = None, speaker: str = None, file: str = None):
+        """
+        Adds an utterance's metrics (see `METRIC_EDGES`). Without `code_switched`, it is if its `cs_ratio` is above 0,
+            and unknown without either.
+        """
+        if code_switched is None and values.get("cs_ratio") is not None:
+            code_switched = values["cs_ratio"] > 0
+        self.split(split).add(values, code_switched, speaker, file)
+
+    def merge(self, other: "CorpusStatistics") -> "CorpusStatistics":
+        for name, split in other.splits.items():
+            if name in self.splits:
+                self.splits[name].merge(split)
+            else:
+                self.splits[name] = copy.deepcopy(split)
+        return self
+
+    def to_dict(self) -> dict:
+        return {"splits": {name: split.to_dict() for name, split in sorted(self.splits.items())}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CorpusStatistics":
+        statistics = cls()
+        statistics.splits = {name: SplitStatistics.from_dict(split) for name, split in data["splits"].items()}
+        return statistics
+
+    def save(self, path: str):
+        with open(path + ".tmp", "w") as fout:
+            json.dump(self.to_dict(), fout, indent=1)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> "CorpusStatistics":
+        with open(path, "r") as fin:
+            return cls.from_dict(json.load(fin))
+
+    def rows(self) -> Iterator[dict]:
+        """One flat row per split, speaker and recording and metric, e.g. for a data frame"""
+        for name, split in sorted(self.splits.items()):
+            groups = [("split", name, split)]
+            groups += [("speaker", key, group) for key, group in sorted(split.speakers.items())]
+            groups += [("file", key, group) for key, group in sorted(split.files.items())]
+            for level, key, group in groups:
+                for metric, summary in sorted(group.metrics.items()):
+                    row = {
+                        "split": name,
+                        "level": level,
+                        "group": key,
+                        "utterances": group.utterances,
+                        "labelled": group.labelled,
+                        "code_switched": group.code_switched,
+                        "metric": metric,
+                        "count": summary.count,
+                        "mean": summary.mean,
+                        "std": summary.std,
+                        "min": summary.min if summary.count else math.nan,
+                        "max": summary.max if summary.count else math.nan,
+                    }
+                    for q in QUANTILES:
+                        row[f"p{round(q * 100)}"] = summary.quantile(q) if isinstance(summary, Histogram) else math.nan
+                    yield row
+
+    def save_parquet(self, path: str) -> bool:
+        """Writes `rows` as a Parquet table, returns False when pandas can't (without pyarrow or fastparquet)"""
+        import pandas as pd
+
+        try:
+            pd.DataFrame(list(self.rows())).to_parquet(path)
+        except ImportError:
+            print(f"Skipping {path}, install pyarrow to write it")
+            return False
+        return True
+
+    def print_summary(self, metrics: List[str] = ("cs_ratio", "switches", "cs_spans", "duration_s", "tokens_per_s")):
+        width = max([len(name) for name in self.splits] + [5])
+        print(f"{'split':<{width}} {'utts':>8} {'cs %':>6} {'speakers':>8} {'files':>6}" + "".join(f" {metric:>13}" for metric in metrics))
+        for name, split in sorted(self.splits.items()):
+            cs_percent = f"{100 * split.code_switched / split.labelled:.1f}" if split.labelled else "-"
+            means = "".join(
+                f" {split.metrics[metric].mean:>13.3f}" if metric in split.metrics else f" {'-':>13}" for metric in metrics
+            )
+            print(f"{name:<{width}} {split.utterances:>8} {cs_percent:>6} {len(split.speakers):>8} {len(split.files):>6}{means}")
+
+
+def count_switches(tags: list) -> int:
+    """The language changes between neighbouring words, from their tags"""
+    return sum(first != second for first, second in zip(tags, tags[1:]))
+
+
+def count_spans(tags: list, main_lang: str) -> int:
+    """The stretches of words not in `main_lang`, from their tags"""
+    return sum(tag != main_lang and (idx == 0 or tags[idx - 1] == main_lang) for idx, tag in enumerate(tags))
+
+
+def utterance_values(record: dict, duration: float = None) -> dict:
+    """The metrics of a split's record, from what it has: the CS ratio and tags of the Miami records, say"""
+    duration = record.get("duration", duration)
+    tokens = len(record.get("transcript", "").split())
+    values = {"tokens": tokens, "duration_s": duration}
+    if duration:
+        values["tokens_per_s"] = tokens / duration
+    if record.get("cs_percent") is not None:
+        values["cs_ratio"] = min(float(record["cs_percent"]), 1.0)
+    if record.get("tagged_words"):
+        tags = [word.rsplit("=", 1)[-1] for word in record["tagged_words"].split(" ")]
+        values["switches"] = count_switches(tags)
+        if record.get("main_lang"):
+            values["cs_spans"] = count_spans(tags, record["main_lang"])
+    return values
+
+
+def recording_name(record: dict) -> str:
+    """The Fisher conversation (the directory of `old_wav`) or Miami recording (`{name}_p{idx}.wav`) of a record"""
+    if record.get("old_wav"):
+        return os.path.basename(os.path.dirname(record["old_wav"]))
+    return os.path.splitext(os.path.basename(record["wav"]))[0].rsplit("_p", 1)[0]
+
+
+def split_statistics(name: str) -> CorpusStatistics:
+    """The statistics of one generated split, the durations of records without one read from the clip headers"""
+    dataset = CodeSwitchedDataset(name)
+    key = os.path.relpath(dataset.base_path)
+    statistics = CorpusStatistics()
+    statistics.split(key)  # listed even when empty
+    for idx, record in enumerate(dataset):
+        duration = None
+        if record.get("duration") is None:
+            try:
+                duration = wav_duration(dataset.clip(idx, WAV_HEADER_BYTES))
+            except (KeyError, ValueError, OSError):
+                pass  # e.g. a split written without its clips
+        code_switched = record.get("code_switched")
+        statistics.add(key, utterance_values(record, duration), code_switched, record.get("speaker_id"), recording_name(record))
+    return statistics
+
+
+def gather_statistics(splits: list, jobs: int = 1) -> CorpusStatistics:
+    statistics = CorpusStatistics()
+    with stage("statistics", items=len(splits)):
+        if jobs > 1 and len(splits) > 1:
+            with Pool(min(jobs, len(splits))) as pool:
+                results = pool.map(split_statistics, splits)
+        else:
+            results = map(split_statistics, splits)
+        for result in results:
+            statistics.merge(result)
+    return statistics
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog="python -m cs_data.statistics")
+    parser.add_argument("splits", nargs="*", help="split names (e.g. fisher/eval/cs) or directories")
+    parser.add_argument("--search", nargs="*", default=None, help="also every split under these directories (all splits if nothing is given)")
+    parser.add_argument("--jobs", type=int, default=default_jobs(), help="number of splits read in parallel")
+    parser.add_argument("--output", default=STATISTICS_FILE, help="where to write the JSON report")
+    parser.add_argument("--parquet", default=None, help="also write a table of the summaries as Parquet")
+    args = parser.parse_args(argv)
+    splits = list(args.splits)
+    if args.search is not None or not splits:
+        splits += find_splits(args.search)
+
+    statistics = gather_statistics(splits, args.jobs)
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    statistics.save(args.output)
+    if args.parquet:
+        statistics.save_parquet(args.parquet)
+    statistics.print_summary()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# the `cs_corpus` indexes of a Fisher split: `{split}_cs.es` and `{split}_mono.es` (the line numbers of the
+# code-switched and monolingual lines), `{split}_cs_words_cs_only.es` (the CS words of each CS line) and
+# `{split}_cs.npy`, a bool array of whether each line is code-switched
+import os
+import collections
+import numpy as np
+
+CS_CORPUS_PATH = "cs_corpus"
+
+
+class CsIndexWriter:
+    """Writes all of a split's indexes in the same pass over its lines"""
+
+    def __init__(self, output_path: str, file_name: str):
+        self.paths = {
+            suffix: os.path.join(output_path, file_name.replace(".es", suffix))
+            for suffix in ["_cs.es", "_mono.es", "_cs_words_cs_only.es", "_cs.npy"]
+        }
+        self.cs_out = open(self.paths["_cs.es"], "w")
+        self.mono_out = open(self.paths["_mono.es"], "w")
+        self.words_out = open(self.paths["_cs_words_cs_only.es"], "w")
+        self.is_cs = []
+        self.num_terminated = 0  # only lines ending in "\n" count
+        self.pending = collections.deque()  # lines read, but not yet known to be counted
+
+    def add_line(self, spans: list, terminated: bool):
+        """Adds the next line, with its (non-empty) foreign spans"""
+        self.pending.append(spans)
+        self.num_terminated += terminated
+        while self.pending and len(self.is_cs) < self.num_terminated:
+            self.write_line(self.pending.popleft())
+
+    def write_line(self, spans: list):
+        idx = len(self.is_cs)
+        self.is_cs.append(bool(spans))
+        if spans:
+            self.cs_out.write(f"{idx}\n")
+            self.words_out.write("".join(span.text + " " for span in spans) + "\n")
+        else:
+            self.mono_out.write(f"{idx}\n")
+
+    def close(self) -> np.ndarray:
+        # lines after the last "\n" are not part of the split
+        for out in [self.cs_out, self.mono_out, self.words_out]:
+            out.close()
+        is_cs = np.array(self.is_cs, dtype=bool)
+        np.save(self.paths["_cs.npy"], is_cs)
+        return is_cs
+
+
+def load_index_file(path: str) -> np.ndarray:
+    with open(path) as fin:
+        return np.array([int(line.strip()) for line in fin], dtype=np.int64)
+
+
+def load_cs_mask(split: str, corpus_path: str = CS_CORPUS_PATH, mmap_mode: str = None) -> np.ndarray:
+    """
+    Whether each line of the split is code-switched, from the bitmap or else the cs/mono index files.
+        With `mmap_mode` (e.g. "r") the bitmap is memory-mapped instead of read.
+    """
+    bitmap_path = os.path.join(corpus_path, f"fisher_{split}_cs.npy")
+    if os.path.isfile(bitmap_path):
+        return np.load(bitmap_path, mmap_mode=mmap_mode)
+
+    cs_idxs = load_index_file(os.path.join(corpus_path, f"fisher_{split}_cs.es"))
+    mono_idxs = load_index_file(os.path.join(corpus_path, f"fisher_{split}_mono.es"))
+    is_cs = np.zeros(len(cs_idxs) + len(mono_idxs), dtype=bool)
+    is_cs[cs_idxs] = True
+    return is_cs
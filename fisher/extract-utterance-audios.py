@@ -6,43 +6,134 @@
 #
 
 # this file extracts the utterance from the larger audio file given the mapping
+#
+# Each conversation is decoded once (both channels, resampled to 16K) and all of
+# its utterances are sliced out of the decoded buffer. Conversations are spread
+# across a process pool. The segments are looked up in the transcript index
+# (`tdf_index.npz`), and the YAML audio mapping is written in mapping order.
 
 import sys
 import os
+import json
+import argparse
 import subprocess
+import wave
+from multiprocessing import Pool
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # for `cs_data`
+from cs_data.profiling import stage
+from cs_data.jobs import default_jobs
+from tdf_index import TDF_INDEX_PATH, TdfIndex
+
+TARGET_RATE = 16000
+
+
+def read_audio_info(path):
+  """Returns (channel_count, sample_rate) from the SPHERE header, falling back to soxi"""
+  with open(path, "rb") as fin:
+    head = fin.read(1024)
+  if head.startswith(b"NIST_1A"):
+    header_size = int(head.split(b"\n")[1])
+    if header_size > len(head):
+      with open(path, "rb") as fin:
+        head = fin.read(header_size)
+    fields = {}
+    for line in head.split(b"\n")[2:]:
+      if line.startswith(b"end_head"):
+        break
+      parts = line.split(None, 2)
+      if len(parts) == 3:
+        fields[parts[0].decode()] = parts[2].decode()
+    return int(fields["channel_count"]), int(fields["sample_rate"])
+
+  channels = subprocess.check_output(["sox", "--i", "-c", path])
+  rate = subprocess.check_output(["sox", "--i", "-r", path])
+  return int(channels), int(float(rate))
+
+
+def decode_conversation(path):
+  """Decodes a whole conversation to 16K signed 16-bit samples, shape (frames, channels)"""
+  channels, rate = read_audio_info(path)
+  cmd = ["sox", path, "-t", "raw", "-e", "signed-integer", "-b", "16", "-L", "-", "rate", str(TARGET_RATE)]
+  pcm = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+  return np.frombuffer(pcm, dtype="<i2").reshape(-1, channels), rate
+
+
+def to_samples(seconds, rate):
+  # same rounding as sox uses when parsing `trim` positions
+  return int(seconds * rate + 0.5)
+
+
+def write_wav(path, samples):
+  with wave.open(path, "wb") as fout:
+    fout.setnchannels(1)
+    fout.setsampwidth(2)
+    fout.setframerate(TARGET_RATE)
+    fout.writeframes(np.ascontiguousarray(samples, dtype="<i2").tobytes())
+
+
+def segment_conversation(job):
+  """Decodes one conversation and writes every segment that belongs to it"""
+  src_path, segments = job
+  audio, rate = decode_conversation(src_path)
+  written = []
+  for uttID, wavFilename, channel, uttStart, uttDur in segments:
+    # trim at the source rate, like `sox ... trim start dur rate 16000` did
+    start = to_samples(uttStart, rate) * TARGET_RATE // rate
+    end = start + to_samples(uttDur, rate) * TARGET_RATE // rate
+    write_wav(wavFilename + ".wav", audio[start:end, channel])
+    written.append(uttID)
+  return written
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("mapping", help="mapping file")
+  parser.add_argument("speech_dir", help="LDC speech directory")
+  parser.add_argument("--tdf-index", default=TDF_INDEX_PATH, help="index of the LDC transcripts, see `tdf_index.py`")
+  parser.add_argument("--yaml", default=None, help="write the YAML audio mapping of the split here")
+  parser.add_argument("--jobs", type=int, default=default_jobs(), help="number of conversations decoded in parallel")
+  args = parser.parse_args()
+  srcAudioDir = args.speech_dir
+  index = TdfIndex.load(args.tdf_index)
+  setName = os.path.basename(args.mapping)
+
+  # group the segments by conversation so each source file is only decoded once, the YAML follows the mapping
+  conversations = {}
+  yamlOut = open(args.yaml, "w") if args.yaml else None
+  with stage("read_mapping") as record:
+    for lineno, line in enumerate(open(args.mapping)):
+      utterances, ids = line.split()
+      lineNums = [int(x) for x in ids.split('_')]
+      rows = index.rows(utterances, lineNums)
+      segments = index.segments(rows)
+      output = " ".join(index.segment_text(row) for row in rows.tolist())
+      fileName, channel, uttStart, _, speaker = segments[0]
+      speaker = speaker.replace(' ', '~')
+      uttDur = segments[-1][3] - uttStart
+      audioName = "%s-utt%06d" % (setName, lineno+1)
+      uttID = "%s-%s-c%s-%s" % (audioName, fileName, channel, speaker)
+      spkID = "%s-c%s-%s" % (fileName, channel, speaker)
+      wavFilename = os.path.join(setName, os.path.join(fileName[:-4], audioName))
+      print(uttID, wavFilename, spkID, lineno+1, output, uttStart, uttDur)
+      os.makedirs(os.path.dirname(wavFilename), exist_ok=True)
+      if yamlOut:
+        # the speaker as in the `ids` (conversation, channel and TDF speaker), quoted as TDF speakers are free text
+        yamlOut.write("- { wav: %s.wav, speaker_id: %s }\n" % (wavFilename, json.dumps(spkID)))
+      conversations.setdefault(os.path.join(srcAudioDir, fileName), []).append(
+        (uttID, wavFilename, channel, uttStart, uttDur))
+      record.add_items()
+  if yamlOut:
+    yamlOut.close()
+
+  with stage("segment", items=sum(len(segments) for segments in conversations.values())):
+    with Pool(max(1, args.jobs)) as pool:
+      for written in pool.imap_unordered(segment_conversation, conversations.items()):
+        for uttID in written:
+          print(uttID, file=sys.stderr)
+
 
-if len(sys.argv) != 3:
-  print("Usage: %s <mapping file> <LDC-speech-dir>" % sys.argv[0])
-  sys.exit(1)
-srcAudioDir=sys.argv[2]
-
-utterance = None
-mapping = {}
-for line in sys.stdin:
-  if line.startswith('##'):
-    utterance = line.strip().split(' ')[2]
-    lineno = 1
-  else:
-    mapping[(utterance,repr(lineno))] = line.strip()
-    lineno += 1
-
-for lineno, line in enumerate(open(sys.argv[1])):
-  utterances, ids = line.split()
-  output = " ".join(mapping[(utterances,x)] for x in ids.split('_'))
-  uttList=[mapping[(utterances,x)] for x in ids.split('_')]
-  firstToks=uttList[0].split('+')
-  firstToks[4] = firstToks[4].replace(' ', '~')
-  uttStart=float(firstToks[2])
-  uttDur=float(uttList[-1].split('+')[3])-uttStart
-  audioName="%s-utt%06d" % (os.path.basename(sys.argv[1]), lineno+1)
-  uttID="%s-%s-c%s-%s" % (audioName, firstToks[0], firstToks[1], firstToks[4])
-  spkID="%s-c%s-%s" % (firstToks[0], firstToks[1], firstToks[4])
-  wavFilename=os.path.join(os.path.basename(sys.argv[1]), os.path.join(firstToks[0][:-4], audioName))
-  print(uttID, wavFilename, spkID, lineno+1, output, uttStart, uttDur) # used in the `prepare-sets.sh bash script`
-  directory = os.path.dirname(wavFilename)
-  try:
-    os.stat(directory)
-  except:
-    os.mkdir(directory)       
-  cmd="/usr/bin/sox %s -c 1 --encoding signed-integer %s.wav remix %d trim %f %f rate 16000" % (os.path.join(srcAudioDir, firstToks[0]), wavFilename, int(firstToks[1])+1, uttStart, uttDur)
-  print(uttID, repr(subprocess.check_output(cmd.split(" "))), file=sys.stderr)
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,311 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# streaming tokenizer for the `<foreign lang="...">` code-switching markup of the tagged Fisher transcripts.
+# It follows the tokenizing rules of Python's html.parser and the tree rules of BeautifulSoup (which this
+# replaced), so malformed lines give the same tag texts and languages as before, without building a tree
+import re
+import html
+import html.entities
+import collections
+
+# the data has some small errors to fix, applied in this order
+FIXES = [
+    ('lang+"English"', 'lang="English"'),
+    ('lan="English"', 'lang="English"'),
+    (" /foreign>", "</foreign>"),
+    ('<foreign lang="English"> meeting <foreign lang="English">', '<foreign lang="English"> meeting </foreign>'),
+]
+
+MARKUP = re.compile("[&<]")
+START_TAG_OPEN = re.compile("<[a-zA-Z]")
+START_TAG_END = re.compile(r"""
+  <[a-zA-Z][^\t\n\r\f />\x00]*       # tag name
+  (?:[\s/]*                          # optional whitespace before attribute name
+    (?:(?<=['"\s/])[^\s/>][^\s/=>]*  # attribute name
+      (?:\s*=+\s*                    # value indicator
+        (?:'[^']*'                   # LITA-enclosed value
+          |"[^"]*"                   # LIT-enclosed value
+          |(?!['"])[^>\s]*           # bare value
+         )
+        \s*                          # possibly followed by a space
+       )?(?:\s|/(?!>))*
+     )*
+   )?
+  \s*                                # trailing whitespace
+""", re.VERBOSE)
+TAG_NAME = re.compile(r"([a-zA-Z][^\t\n\r\f />\x00]*)(?:\s|/(?!>))*")
+ATTRIBUTE = re.compile(r"""((?<=['"\s/])[^\s/>][^\s/=>]*)(\s*=+\s*('[^']*'|"[^"]*"|(?!['"])[^>\s]*))?(?:\s|/(?!>))*""")
+END_TAG = re.compile(r"</\s*([a-zA-Z][-.a-zA-Z0-9:_]*)\s*>")
+COMMENT_CLOSE = re.compile(r"--\s*>")
+ENTITY_REF = re.compile("&([a-zA-Z][-.a-zA-Z0-9]*)[^a-zA-Z0-9]")
+CHAR_REF = re.compile("&#(?:[0-9]+|[xX][0-9a-fA-F]+)[^0-9a-fA-F]")
+INCOMPLETE_REF = re.compile("&[a-zA-Z#]")
+ENTITIES = {name.rstrip(";"): text for name, text in html.entities.html5.items()}
+
+# tags which can't hold text, so are closed right away
+EMPTY_ELEMENTS = {
+    "area", "base", "basefont", "bgsound", "br", "col", "command", "embed", "frame", "hr", "image", "img",
+    "input", "isindex", "keygen", "link", "menuitem", "meta", "nextid", "param", "source", "spacer", "track", "wbr",
+}
+PRESERVE_WHITESPACE = {"pre", "textarea"}
+ASCII_SPACES = " \n\t\x0c\r"
+EMPTY_CS_TEXTS = ["", "(())"]
+
+# token kinds
+DATA, START, START_END, END, COMMENT = range(5)
+
+ForeignSpan = collections.namedtuple("ForeignSpan", ["line_idx", "lang", "text", "cs_ratio"])
+
+
+def fix_small_errors(line: str) -> str:
+    """The data has some small errors to fix"""
+    for error, fix in FIXES:
+        line = line.replace(error, fix)
+    return line
+
+
+def char_ref(name: str) -> str:
+    code = int(name[1:], 16) if name[:1] in ["x", "X"] else int(name)
+    if code < 256:
+        try:
+            return bytes([code]).decode("windows-1252")  # often meant as cp1252 rather than unicode
+        except UnicodeDecodeError:
+            pass
+    try:
+        return chr(code)
+    except (ValueError, OverflowError):
+        return "\N{REPLACEMENT CHARACTER}"
+
+
+def entity_ref(name: str) -> str:
+    return ENTITIES.get(name, "&" + name)
+
+
+def scan_start_tag(line: str, i: int):
+    """Returns the end of the start tag at `i` (-1 if it is unfinished) and its token"""
+    j = START_TAG_END.match(line, i).end()
+    next_char = line[j : j + 1]
+    if next_char == ">":
+        end_pos = j + 1
+    elif next_char == "/":
+        if not line.startswith("/>", j):
+            return -1, None
+        end_pos = j + 2
+    elif next_char == "" or next_char.isascii() and (next_char.isalpha() or next_char in "=/"):
+        return -1, None  # the line ends inside the tag
+    else:
+        end_pos = j if j > i else i + 1
+
+    match = TAG_NAME.match(line, i + 1)
+    name = match.group(1).lower()
+    attributes = []
+    k = match.end()
+    while k < end_pos:
+        match = ATTRIBUTE.match(line, k)
+        if not match:
+            break
+        attribute, rest, value = match.groups()
+        if not rest:
+            value = None
+        elif value[:1] == "'" == value[-1:] or value[:1] == '"' == value[-1:]:
+            value = value[1:-1]
+        if value:
+            value = html.unescape(value)
+        attributes.append((attribute.lower(), value))
+        k = match.end()
+
+    end = line[k:end_pos].strip()
+    if end not in [">", "/>"]:
+        return end_pos, (DATA, line[i:end_pos])
+    return end_pos, (START_END if end.endswith("/>") else START, name, attributes)
+
+
+def scan_end_tag(line: str, i: int):
+    """Returns the end of the end tag at `i` (-1 if it is unfinished) and its token"""
+    gt_pos = line.find(">", i + 1)
+    if gt_pos < 0:
+        return -1, None
+    match = END_TAG.match(line, i)
+    if match:
+        return gt_pos + 1, (END, match.group(1).lower())
+
+    match = TAG_NAME.match(line, i + 2)
+    if match:  # e.g. `</foreign x>`
+        return line.find(">", match.end()) + 1, (END, match.group(1).lower())
+    if line.startswith("</>", i):
+        return i + 3, None
+    return gt_pos + 1, (COMMENT,)  # e.g. `</ 5>`, dropped
+
+
+def scan_declaration(line: str, i: int):
+    """Comments, processing instructions and declarations hold no text"""
+    if line.startswith("<!--", i):
+        match = COMMENT_CLOSE.search(line, i + 4)
+        end_pos = match.end() if match else -1
+    elif line[i : i + 9].lower() == "<!doctype":
+        end_pos = line.find(">", i + 9)
+        end_pos = end_pos + 1 if end_pos >= 0 else -1
+    else:
+        end_pos = line.find(">", i + 2)
+        end_pos = end_pos + 1 if end_pos >= 0 else -1
+    return end_pos, (COMMENT,) if end_pos >= 0 else None
+
+
+def scan(line: str, i: int, end: bool, tokens: list) -> int:
+    """Tokenizes `line` from `i` until the end or something unfinished, returns where it stopped"""
+    n = len(line)
+    while i < n:
+        match = MARKUP.search(line, i)
+        j = match.start() if match else n
+        if i < j:
+            tokens.append((DATA, line[i:j]))
+        i = j
+        if i == n:
+            break
+
+        if line.startswith("<", i):
+            if START_TAG_OPEN.match(line, i):
+                k, token = scan_start_tag(line, i)
+            elif line.startswith("</", i):
+                k, token = scan_end_tag(line, i)
+            elif line.startswith("<!", i) or line.startswith("<?", i):
+                k, token = scan_declaration(line, i)
+            elif i + 1 < n:
+                k, token = i + 1, (DATA, "<")
+            else:
+                break
+            if k < 0:
+                if not end:
+                    break
+                # the rest of a broken tag is text
+                k = line.find(">", i + 1)
+                if k < 0:
+                    k = line.find("<", i + 1)
+                    k = k if k >= 0 else i + 1
+                else:
+                    k += 1
+                token = (DATA, line[i:k])
+            if token is not None:
+                tokens.append(token)
+            i = k
+        elif line.startswith("&#", i):
+            match = CHAR_REF.match(line, i)
+            if not match:
+                if ";" in line[i:]:
+                    tokens.append((DATA, "&#"))
+                    i += 2
+                break
+            tokens.append((DATA, char_ref(match.group()[2:-1])))
+            i = match.end() if match.group().endswith(";") else match.end() - 1
+        else:
+            match = ENTITY_REF.match(line, i)
+            if match:
+                tokens.append((DATA, entity_ref(match.group(1))))
+                i = match.end() if match.group().endswith(";") else match.end() - 1
+            elif INCOMPLETE_REF.match(line, i):
+                if end and i + 2 == n:
+                    i += 1  # a trailing `&x` loses its `&`
+                break
+            elif i + 1 < n:
+                tokens.append((DATA, "&"))
+                i += 1
+            else:
+                break
+    return i
+
+
+def tokenize(line: str) -> list:
+    """The tokens of a line, as (kind, ...) tuples"""
+    tokens = []
+    # a first pass as if more text could follow, then the rest is read as the end of the input
+    i = scan(line, 0, False, tokens)
+    i = scan(line, i, True, tokens)
+    if i < len(line):
+        tokens.append((DATA, line[i:]))
+    return tokens
+
+
+def parse_foreign_tags(line: str):
+    """Returns the (lang, text) of every foreign tag in the line, in order of their start, and the line's text"""
+    tags = []  # [lang, [text chunks]], nested tags also add their text to the enclosing ones
+    open_tags = []  # stack of (tag name, index in `tags` or None)
+    closed_empty_tags = []
+    line_text = []
+    pending_text = []
+
+    def flush_text():
+        text = "".join(pending_text)
+        pending_text.clear()
+        if not text:
+            return
+        if not text.strip(ASCII_SPACES) and not PRESERVE_WHITESPACE.intersection(name for name, _ in open_tags):
+            text = "\n" if "\n" in text else " "  # whitespace between tags is collapsed
+        line_text.append(text)
+        for _, tag_idx in open_tags:
+            if tag_idx is not None:
+                tags[tag_idx][1].append(text)
+
+    def close_tag(name: str):
+        # closes the most recent open tag of that name, and everything opened inside it
+        flush_text()
+        for stack_idx in range(len(open_tags) - 1, -1, -1):
+            if open_tags[stack_idx][0] == name:
+                del open_tags[stack_idx:]
+                break
+
+    for token in tokenize(line):
+        kind = token[0]
+        if kind == DATA:
+            pending_text.append(token[1])
+        elif kind == COMMENT:
+            flush_text()
+        elif kind == END:
+            if token[1] in closed_empty_tags:
+                closed_empty_tags.remove(token[1])  # e.g. the `</br>` of `<br></br>`
+            else:
+                close_tag(token[1])
+        else:
+            flush_text()
+            _, name, attributes = token
+            tag_idx = None
+            if name == "foreign":
+                attributes = dict(attributes)  # the last of a repeated attribute wins
+                if "lang" not in attributes:
+                    raise ValueError(f"Got a foreign tag without a language in line: {line}")
+                tag_idx = len(tags)
+                tags.append([attributes["lang"] or "", []])
+            open_tags.append((name, tag_idx))
+            if kind == START_END:
+                close_tag(name)
+            elif name in EMPTY_ELEMENTS:
+                close_tag(name)
+                closed_empty_tags.append(name)
+    flush_text()
+
+    return [(lang, "".join(text)) for lang, text in tags], "".join(line_text)
+
+
+def extract_foreign_spans(line: str, line_idx: int):
+    """The non-empty foreign spans of a line, with the fraction of the line's tokens that are code-switched"""
+    tags, line_text = parse_foreign_tags(fix_small_errors(line))
+    inside_texts = [text for _, text in tags]
+
+    # get the CS text and dataset statistics
+    num_cs_tokens = len([item for item in " ".join(inside_texts).strip().split(" ") if item != ""])
+    num_line_tokens = len([item for item in line_text.split(" ") if item != ""])
+    if not num_line_tokens:
+        raise ValueError(f"Got a line without any text: {line}")
+    cs_ratio = num_cs_tokens / num_line_tokens
+    if cs_ratio > 1.0:
+        raise ValueError(f"Got {num_cs_tokens} CS tokens for {num_line_tokens} tokens in line: {line}")
+
+    spans = [
+        ForeignSpan(line_idx, lang, text.strip(), cs_ratio)
+        for lang, text in tags
+        if text.strip() not in EMPTY_CS_TEXTS
+    ]
+    return spans, cs_ratio
+
@@ -5,122 +5,114 @@
 
 # This file does the initial splitting from the Fisher ASR splits into a CS and monolingual sets
 import os
-import yaml
-import shutil
+import sys
+import argparse
+import itertools
+from typing import Iterator, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # for `cs_data`
+from cs_data.archive import DEFAULT_SHARD_SIZE, ShardedArchiveWriter, add_archive_arguments, archive_options
+from cs_data.manifest import SplitWriter, iter_yaml_records
+from cs_data.materialize import CLIP_MODES, materialize_clip
+from cs_data.profiling import stage
+from cs_index import load_cs_mask
 
 DATASET_NAMES = ["cs", "mono"]
 SPLITS = ["dev", "dev2", "test", "train"]
+AUDIO_PATH = "speech"
+
+
+def iter_split_inputs(split: str) -> Iterator[Tuple[dict, str, str]]:
+    """Streams the line-aligned (instance, transcript, translation) of an ASR split"""
+    base_path = f"splits_data/{split}"
+    translation_path = (
+        f"{base_path}/fisher_{split}.en.0"
+        if split != "train"
+        else f"{base_path}/fisher_{split}.en"
+    )  # many refs, we use en.0 although others are possible
+    missing = object()
+    with open(f"{base_path}/fisher_{split}.es", "r") as transcripts, open(translation_path, "r") as translations:
+        records = iter_yaml_records(f"{base_path}/fisher_{split}.yaml")
+        for instance, transcript, translation in itertools.zip_longest(
+            records, transcripts, translations, fillvalue=missing
+        ):
+            if missing in (instance, transcript, translation):
+                raise ValueError(f"The YAML, transcript and translation of {split} have different lengths")
+            yield instance, transcript.strip(), translation.strip()
 
 
-def split_data():
-    for split in SPLITS:
-        print(f"Loading the data for {split}...")
-        base_path = f"splits_data/{split}"
-        base_output_path = f"output/fisher/{split}"
-        transcript = []
-        translation = []
-        with open(f"{base_path}/fisher_{split}.yaml", "r") as fin:
-            yaml_data = yaml.safe_load(fin)
-        with open(f"{base_path}/fisher_{split}.es", "r") as fin:
-            for line in fin:
-                transcript.append(line.strip())
-        translation_path = (
-            f"{base_path}/fisher_{split}.en.0"
-            if split != "train"
-            else f"{base_path}/fisher_{split}.en"
+class ClipSplit:
+    """A CS or monolingual part of a split: its texts, manifest and clips, written as records come in"""
+
+    def __init__(self, base_path: str, fields: list, export_yaml: bool, clip_mode: str, archive_kwargs: dict):
+        self.clips_path = os.path.join(base_path, "clips")
+        os.makedirs(self.clips_path, exist_ok=True)
+        self.writer = SplitWriter(base_path, "fisher", fields, export_yaml=export_yaml)
+        self.clip_mode = clip_mode
+        # the clips are archived as they come, so `--archive-jobs` doesn't apply here
+        self.archive = ShardedArchiveWriter(
+            self.clips_path,
+            archive_kwargs.get("shard_size", DEFAULT_SHARD_SIZE),
+            archive_kwargs.get("archive_format", "zip"),
         )
-        with open(
-            translation_path, "r"
-        ) as fin:  # many refs, we use en.0 although others are possible
-            for line in fin:
-                translation.append(line.strip())
-
-        assert len(transcript) == len(yaml_data) == len(translation)
-        print(f"Length of the original data is {len(transcript)}")
-
-        ## Load code switched indexes ##
-        mono_idxs = []
-        cs_idxs = []
-        with open(f"cs_corpus/fisher_{split}_mono.es", "r") as fin:
-            for line in fin:
-                mono_idxs.append(line.strip())
-        with open(f"cs_corpus/fisher_{split}_cs.es", "r") as fin:
-            for line in fin:
-                cs_idxs.append(line.strip())
-        assert len(cs_idxs) + len(mono_idxs) == len(transcript)
-        cs_idxs = set(cs_idxs)
-
-        mono = [[], [], []]
-        cs = [[], [], []]
-        print("Separating the data...")
-        for idx in range(len(yaml_data)):
-            new_yaml_instance = yaml_data[idx]
-            new_yaml_instance["old_wav"] = new_yaml_instance["wav"]
-            new_yaml_instance["wav"] = (
-                "clips/" + new_yaml_instance["wav"].split("/")[-1]
-            )
-
-            if str(idx) in cs_idxs:
-                cs[0].append(new_yaml_instance)
-                cs[1].append(transcript[idx])
-                cs[2].append(translation[idx])
-            else:
-                mono[0].append(new_yaml_instance)
-                mono[1].append(transcript[idx])
-                mono[2].append(translation[idx])
-
-        print("Writing the data out...")
-        for (name, datasets) in zip(DATASET_NAMES, [cs, mono]):
-            print(f"Length of the data {name} is {len(datasets[0])}")
-            if not os.path.isdir(os.path.join(base_output_path, name)):
-                os.makedirs(os.path.join(base_output_path, name))
-            with open(
-                os.path.join(base_output_path, name, f"fisher.yaml"), "w"
-            ) as fout:
-                fout.write(yaml.dump(datasets[0]))
-            with open(
-                os.path.join(base_output_path, name, f"fisher.transcript"), "w"
-            ) as fout:
-                for line in datasets[1]:
-                    assert "\n" not in line, line
-                    fout.write(line)
-                    fout.write("\n")
-            with open(
-                os.path.join(base_output_path, name, f"fisher.translation"), "w"
-            ) as fout:
-                for line in datasets[2]:
-                    assert "\n" not in line, line
-                    fout.write(line)
-                    fout.write("\n")
-
-        print("Moving clip data...")
-        mono_clips = [item["old_wav"] for item in mono[0]]
-        cs_clips = [item["old_wav"] for item in cs[0]]
-        audio_path = "speech"
-        assert len(mono_clips) == len(mono[0])
-        assert len(cs_clips) == len(cs[0])
-        for (name, file_paths) in zip(DATASET_NAMES, [cs_clips, mono_clips]):
-            for file_path in file_paths:
-                file_ending = "/".join(
-                    file_path.split("/")[-2:]
-                )  # last two are the ones we need
-                if not os.path.isdir(os.path.join(base_output_path, name, "clips")):
-                    os.makedirs(os.path.join(base_output_path, name, "clips"))
-
-                shutil.copy(
-                    os.path.join(audio_path, f"fisher_{split}", file_ending),
-                    os.path.join(
-                        base_output_path, name, "clips", file_path.split("/")[-1]
-                    ),
+
+    def write(self, instance: dict, transcript: str, translation: str, audio_path: str):
+        clip_path = os.path.join(self.clips_path, os.path.basename(instance["wav"]))
+        self.writer.write(instance, transcript, translation)
+        materialize_clip(audio_path, clip_path, self.clip_mode)
+        self.archive.add(clip_path)
+
+    def close(self) -> int:
+        self.writer.close()
+        self.archive.close()
+        return self.writer.num_records
+
+
+def split_data(export_yaml: bool = True, clip_mode: str = "auto", archive_kwargs: dict = None, splits: list = SPLITS):
+    for split in splits:
+        with stage(f"split_{split}") as record:
+            print(f"Splitting the data for {split}...")
+            base_output_path = f"output/fisher/{split}"
+
+            ## Load code switched indexes, one byte per line ##
+            is_cs = load_cs_mask(split, mmap_mode="r")
+
+            records = iter_split_inputs(split)
+            first = next(records, None)
+            fields = list(first[0]) + ["old_wav"] if first is not None else ["wav", "old_wav"]
+            parts = {
+                name: ClipSplit(
+                    os.path.join(base_output_path, name), fields, export_yaml, clip_mode, archive_kwargs or {}
+                )
+                for name in DATASET_NAMES
+            }
+
+            num_lines = 0
+            for idx, (instance, transcript, translation) in enumerate(
+                itertools.chain([first] if first is not None else [], records)
+            ):
+                assert idx < len(is_cs), f"{split} has more lines than its CS index"
+                old_wav = instance["wav"]
+                instance["old_wav"] = old_wav
+                instance["wav"] = "clips/" + old_wav.split("/")[-1]
+                file_ending = "/".join(old_wav.split("/")[-2:])  # last two are the ones we need
+                parts["cs" if is_cs[idx] else "mono"].write(
+                    instance, transcript, translation, os.path.join(AUDIO_PATH, f"fisher_{split}", file_ending)
                 )
+                num_lines += 1
+            record.add_items(num_lines)
 
-            # make it a zip file
-            shutil.make_archive(
-                os.path.join(base_output_path, name, "clips"),
-                "zip",
-                os.path.join(base_output_path, name, "clips"),
-            )
+            assert num_lines == len(is_cs), f"{split} has {num_lines} lines but its CS index has {len(is_cs)}"
+            print(f"Length of the original data is {num_lines}")
+            for name, part in parts.items():
+                print(f"Length of the data {name} is {part.close()}")
 
 
 if __name__ == "__main__":
-    split_data()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--splits", nargs="*", choices=SPLITS, default=SPLITS, help="only make these splits")
+    parser.add_argument("--no-yaml", action="store_true", help="only write the manifests, without the YAML exports")
+    parser.add_argument("--clip-mode", choices=CLIP_MODES, default="auto", help="how clips are put into the splits, auto links them")
+    add_archive_arguments(parser)
+    args = parser.parse_args()
+    split_data(not args.no_yaml, args.clip_mode, archive_options(args), args.splits)
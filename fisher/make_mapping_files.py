@@ -4,67 +4,64 @@
 #
 
 import os
+import sys
+import argparse
 import numpy as np
 import pandas as pd
 
-FILE_LEN_MAP = {
-    "dev": 3979,
-    "dev2": 3961,
-    "test": 3641,
-    "train": 138819
-}
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # for `cs_data`
+from cs_data.profiling import stage
+from cs_index import load_cs_mask, load_index_file
 
-def make_mappings():
-    SPLITS = ["dev", "dev2", "test", "train"]
-    idx_map = {}
-    for cs_type in ["cs", "mono"]:
-        for split in SPLITS:
-            loaded_idxs = []
-            with open(f"cs_corpus/fisher_{split}_{cs_type}.es") as fin:
-                for line in fin:
-                    loaded_idxs.append(int(line.strip()))
-            idx_map[f"{split}-{cs_type}"] = set(loaded_idxs)
+SPLITS = ["dev", "dev2", "test", "train"]
 
-    # Build Eval/Test set 
-    cur_split_data = []
-    for split in ["dev", "dev2", "test"]:
-        split_audio_path = pd.read_csv(f"fisher-callhome-corpus-tags/mapping/fisher_{split}", index_col=None, delimiter=" ", header=None)
-        split_audio_path.columns = ["AudioFile", "LineNum"]
-        for idx in range(FILE_LEN_MAP[split]):
-            audio_details = split_audio_path.loc[idx]
-            details = {"file": f"fisher_{split}", "file_line_num": idx, "split": "test",
-                         "audio_file": audio_details["AudioFile"], "audio_file_line_num": audio_details["LineNum"]}
-            if idx in idx_map[f"{split}-cs"]:
-                details["cs_type"] = "cs"
-            else:
-                details["cs_type"] = "mono"
-            cur_split_data.append(details)
 
-    # Training and Dev sets
-    cs_count = 0
-    cs_is_dev = []
-    with open("train_vs_dev_cs.txt", "r") as fin:
-        for line in fin:
-            cs_is_dev.append(int(line.strip()))
-    cs_is_dev = set(cs_is_dev)
-    split_audio_path = pd.read_csv(f"fisher-callhome-corpus-tags/mapping/fisher_train", index_col=None, delimiter=" ", header=None)
+def split_mapping(split: str, is_cs: np.ndarray) -> pd.DataFrame:
+    """The mapping of every line of `split` to its audio file, joined on the line number"""
+    split_audio_path = pd.read_csv(f"fisher-callhome-corpus-tags/mapping/fisher_{split}", index_col=None, delimiter=" ", header=None)
     split_audio_path.columns = ["AudioFile", "LineNum"]
-    for idx in range(FILE_LEN_MAP["train"]):
-        audio_details = split_audio_path.loc[idx]
-        details = {"file": f"fisher_train", "file_line_num": idx, "split": "train",
-                        "audio_file": audio_details["AudioFile"], "audio_file_line_num": audio_details["LineNum"]}
-        if idx in idx_map[f"train-cs"]:
-            details["cs_type"] = "cs"
-            if cs_count in cs_is_dev:
-                details["split"] = "dev"
-            cs_count += 1
-        else:
-            details["cs_type"] = "mono"
-        cur_split_data.append(details)
+    assert len(split_audio_path) >= len(is_cs), f"the mapping for {split} is shorter than its data"
+    split_audio_path = split_audio_path.iloc[: len(is_cs)]
+    return pd.DataFrame({
+        "file": f"fisher_{split}",
+        "file_line_num": np.arange(len(is_cs)),
+        "split": "train" if split == "train" else "test",
+        "audio_file": split_audio_path["AudioFile"].to_numpy(),
+        "audio_file_line_num": split_audio_path["LineNum"].to_numpy(),
+        "cs_type": np.where(is_cs, "cs", "mono"),
+    })
+
 
-    df = pd.DataFrame(cur_split_data)
-    df.to_csv(f"fisher_mapping.csv")
+def make_mappings(write_parquet: bool = True):
+    # Build Eval/Test set, then the Training and Dev sets
+    mappings = []
+    with stage("build_mapping") as record:
+        for split in SPLITS:
+            is_cs = load_cs_mask(split)
+            mapping = split_mapping(split, is_cs)
+            if split == "train":
+                # `train_vs_dev_cs.txt` holds the positions, among the CS lines, of the ones moved to dev
+                cs_is_dev = np.zeros(is_cs.sum(), dtype=bool)
+                cs_is_dev[load_index_file("train_vs_dev_cs.txt")] = True
+                is_dev = np.zeros(len(is_cs), dtype=bool)
+                is_dev[np.flatnonzero(is_cs)] = cs_is_dev
+                mapping.loc[is_dev, "split"] = "dev"
+            mappings.append(mapping)
+
+        df = pd.concat(mappings, ignore_index=True)
+        record.add_items(len(df))
+    with stage("write_mapping", items=len(df)):
+        df.to_csv(f"fisher_mapping.csv")
+        if write_parquet:
+            try:
+                df.to_parquet("fisher_mapping.parquet")
+            except ImportError:
+                print("Skipping fisher_mapping.parquet, install pyarrow to write it")
     print("Made mapping files for Fisher")
 
+
 if __name__ == "__main__":
-    make_mappings()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-parquet", action="store_true", help="only write the CSV mapping")
+    args = parser.parse_args()
+    make_mappings(not args.no_parquet)
@@ -6,35 +6,27 @@
 #
 
 
-# This file converts the speech data into 16K audio and creates the YAML files containing the mapping
+# This file converts the speech data into 16K audio and creates the YAML files containing the mapping.
+# It prepares the sets given as arguments (e.g. `bash prepare-sets.sh fisher_dev`), by default all of them,
+# into `speech/{set}` and `splits_data/{split}/{set}.yaml`
 
 FISHER_TDF_DIR=${LDC2010T04}/data/transcripts
 FISHER_SPEECH_DIR=${LDC2010S01}/data/speech
 PARALLEL_DATA_DIR=fisher-callhome-corpus
+SETS=${@:-fisher_train fisher_dev fisher_dev2 fisher_test}
 
-process_audio()
-{
-  C=${1}
-  mkdir -p ${C}
-  echo  ${PARALLEL_DATA_DIR}/mapping/${C}
-  ufiles=$(cat ${PARALLEL_DATA_DIR}/mapping/$C | cut -d' ' -f1 | uniq)
-  # echo $ufiles
-  for i in $ufiles; do
-      echo "## FILE $i"
-      cat ${FISHER_TDF_DIR}/$i.tdf | 
-	grep -v ";;MM" | grep -v "file;unicode" |
-	cut -f 1-5 | tr '\t' '+'
-  done | python extract-utterance-audios.py ${PARALLEL_DATA_DIR}/mapping/$C ${FISHER_SPEECH_DIR} > ${C}/ids \
-	   2>${C}.prepare-audio.log
-}
+# parse the transcripts of all conversations once, the sets look their segments up in the index
+# (`setup_all.sh` builds it as a stage of its own)
+if [ ! -f tdf_index.npz ]; then
+  python tdf_index.py ${FISHER_TDF_DIR} tdf_index.npz
+fi
 
-for SET in fisher_{train,dev,dev2,test}; do
-  process_audio ${SET}
-done
-
-# make YAML audio mapping
-for convname in fisher_{train,dev,dev2,test}/*fsp; do
-    for filename in $convname/*.wav; do
-        echo "- { wav: $filename }" >> $(dirname $convname).yaml
-    done
+# extract the audio, writing the YAML audio mapping in the order of the mapping file
+for SET in ${SETS}; do
+  split=${SET#fisher_}
+  mkdir -p ${SET} speech splits_data/${split}
+  echo ${PARALLEL_DATA_DIR}/mapping/${SET}
+  python extract-utterance-audios.py ${PARALLEL_DATA_DIR}/mapping/${SET} ${FISHER_SPEECH_DIR} \
+    --tdf-index tdf_index.npz --yaml splits_data/${split}/${SET}.yaml > ${SET}/ids 2>${SET}.prepare-audio.log || exit 1
+  rm -rf speech/${SET} && mv ${SET} speech/
 done
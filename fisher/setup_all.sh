@@ -3,40 +3,61 @@
 # Copyright (C) 2022 Apple Inc. All Rights Reserved.
 #
 
+# every stage is skipped when its inputs are unchanged since its last run (see `cs_data/stage_cache.py`),
+# delete `.stage_cache` or pass `--force` to a stage to rerun it. Run from `create_datasets.sh`, the stages are
+# only declared here and run as a dependency graph (see `cs_data/scheduler.py`), `--cpus`/`--io` are their budget
+export PYTHONPATH="$(cd .. && pwd)${PYTHONPATH:+:$PYTHONPATH}"
+stage() { python -m cs_data.stage_cache run "$@"; }
+FISHER_TDF_DIR=${LDC2010T04}/data/transcripts
+FISHER_SPEECH_DIR=${LDC2010S01}/data/speech
+
 # get the Fisher data with CS tags
-git clone https://github.com/orionw/fisher-callhome-corpus.git
-mv fisher-callhome-corpus fisher-callhome-corpus-tags
-cd fisher-callhome-corpus-tags
-make
-cd ../
-python extract_cs_words_from_raw_data.py # makes indexes of CS data and keeps the CS words
+stage --name tags_corpus --io 1 --outputs fisher-callhome-corpus-tags/corpus/ldc -- bash -c "
+  rm -rf fisher-callhome-corpus-tags &&
+  git clone https://github.com/orionw/fisher-callhome-corpus.git fisher-callhome-corpus-tags &&
+  make -C fisher-callhome-corpus-tags"
+# makes indexes of CS data and keeps the CS words
+stage --name cs_indexes --cpus 25% --inputs fisher-callhome-corpus-tags/corpus/ldc --outputs cs_corpus \
+  -- python extract_cs_words_from_raw_data.py
 
 # make the clean data without the CS tags to use
-git clone -b keep_tags https://github.com/orionw/fisher-callhome-corpus.git
-cd fisher-callhome-corpus
-make
-cp corpus/ldc/fisher_dev.{en,es}* ../splits_data/dev/
-cp corpus/ldc/fisher_train.{en,es}* ../splits_data/train/
-cp corpus/ldc/fisher_dev2.{en,es}* ../splits_data/dev2/
-cp corpus/ldc/fisher_test.{en,es}* ../splits_data/test/
-cd ../
+stage --name parallel_corpus --io 1 --outputs fisher-callhome-corpus/corpus/ldc fisher-callhome-corpus/mapping -- bash -c "
+  rm -rf fisher-callhome-corpus &&
+  git clone -b keep_tags https://github.com/orionw/fisher-callhome-corpus.git &&
+  make -C fisher-callhome-corpus"
+stage --name splits_text --inputs fisher-callhome-corpus/corpus/ldc --outputs "splits_data/*/fisher_*.e[ns]*" -- bash -c '
+  for split in dev train dev2 test; do cp fisher-callhome-corpus/corpus/ldc/fisher_${split}.{en,es}* splits_data/${split}/; done &&
+  sed -i "s/\r//g" splits_data/*/fisher_*.e[ns]*  # something adds extra carriage returns'
 
-# prepare the speech data (process to 16K, match to the other data lines)
-bash prepare-sets.sh
-cp fisher_train.yaml splits_data/train/
-cp fisher_test.yaml splits_data/test/
-cp fisher_dev.yaml splits_data/dev/
-cp fisher_dev2.yaml splits_data/dev2/
-mkdir speech
-mv fisher_train speech
-mv fisher_dev speech
-mv fisher_dev2 speech
-mv fisher_test speech
+# prepare the speech data (process to 16K, match to the other data lines), each set on its own
+stage --name tdf_index --inputs tdf_index.py ${FISHER_TDF_DIR} --outputs tdf_index.npz \
+  -- python tdf_index.py ${FISHER_TDF_DIR} tdf_index.npz
+for split in train dev dev2 test; do
+  stage --name speech_${split} --cpus $([ ${split} = train ] && echo 50% || echo 12%) \
+    --inputs prepare-sets.sh extract-utterance-audios.py tdf_index.npz fisher-callhome-corpus/mapping/fisher_${split} ${FISHER_SPEECH_DIR} \
+    --outputs speech/fisher_${split} splits_data/${split}/fisher_${split}.yaml -- bash prepare-sets.sh fisher_${split}
+done
 
 # make the CS and Monolingual splits
-sed -i "s/\r//g" splits_data/*/*  # something adds extra carriage returns
-python make_cs_splits.py
+for split in dev dev2 test train; do
+  stage --name cs_splits_${split} --cpus $([ ${split} = train ] && echo 25% || echo 1) --io 1 \
+    --inputs "splits_data/${split}/fisher_*" cs_corpus speech/fisher_${split} ../cs_data \
+    --outputs output/fisher/${split} -- python make_cs_splits.py --splits ${split}
+done
 # make the `eval` set consisting of dev dev2 test
-python combine_eval_splits.py
-python split_train_and_make_lid.py # split into training and dev CS sets and determine the LID
-python make_mapping_files.py # if you want the mapping files, optional
+stage --name eval_split --inputs output/fisher/dev output/fisher/dev2 output/fisher/test ../cs_data \
+  --outputs output/fisher/eval -- python combine_eval_splits.py
+# split into training and dev CS sets and determine the LID
+stage --name lid --io 1 --inputs output/fisher/eval/cs output/fisher/train cs_corpus ../miami/output/miami/mono_train ../cs_data \
+  --outputs output/lid train_vs_dev_cs.txt output/fisher/eval/cs/fisher.labels output/fisher/eval/cs/fisher.labels.npy \
+  --param seed=1 -- python split_train_and_make_lid.py
+# if you want the mapping files, optional
+stage --name mapping --inputs cs_corpus train_vs_dev_cs.txt --outputs fisher_mapping.csv -- python make_mapping_files.py
+# the statistics of every split (CS ratio, duration, tokens per second..., see `cs_data/statistics.py`)
+stage --name statistics --cpus 25% --inputs output/fisher output/lid ../cs_data --outputs output/statistics.json \
+  -- python -m cs_data.statistics --search output/fisher output/lid --output output/statistics.json
+# optional: precompute the log-mel features of every split's clips into `output/features` (see `cs_data/features.py`)
+if [ -n "${CS_DATA_FEATURES}" ]; then
+  stage --name features --cpus all --inputs output/fisher output/lid ../cs_data --outputs output/features \
+    -- python -m cs_data.features --search output/fisher output/lid
+fi
@@ -5,149 +5,118 @@
 
 # This file creates the LID labels for training/dev as well as splitting the training CS set into dev/train
 import os
+import sys
 import random
-import shutil
-import yaml
+import argparse
 import string
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # for `cs_data`
+from cs_data.archive import add_archive_arguments, archive_options, build_sharded_archive
+from cs_data.manifest import load_split, write_split
+from cs_data.materialize import CLIP_MODES, materialize_clip
+from cs_data.profiling import stage
+from cs_data.sampling import IndexView, sample_indices, split_indices
+
 random.seed(1)
 
+PUNCTUATION = str.maketrans("", "", string.punctuation)
+ENGLISH, SPANISH = 0, 1
+
+
+def count_tokens(lines: list) -> np.ndarray:
+    """The number of " "-separated tokens in each line once punctuation is removed (an empty line has one)"""
+    # lines hold no "\n", so all of them are cleaned in one `translate` over the joined text
+    cleaned = "\n".join(lines).translate(PUNCTUATION).split("\n") if lines else []
+    return np.fromiter((line.strip().count(" ") + 1 for line in cleaned), dtype=np.int64, count=len(lines))
 
-def create_and_save_labels_for_cs_train_data(
-    transcript, transcript_train, cs_words, output_path, desc, name
-) -> list:
-    """Only used for fisher_train_cs to save train and dev set labels"""
-    labels1 = []
-    labels2 = []
-    cs_words1, cs_words2 = cs_words
-    for idx, instance in enumerate(transcript):
-        transcript = instance.translate(str.maketrans("", "", string.punctuation))
-        cs_words = cs_words1[idx].translate(str.maketrans("", "", string.punctuation))
-
-        cs_count = len(cs_words.strip().split(" "))
-        all_count = len(transcript.strip().split(" "))
-        if cs_count / all_count > 0.5:
-            labels1.append(0)  # english
-        elif cs_count / all_count < 0.5:
-            labels1.append(1)  # spanish
-        else:
-            labels1.append(int(random.random() > 0.5))
-
-    for idx, instance in enumerate(transcript_train):
-        transcript = instance.translate(str.maketrans("", "", string.punctuation))
-        cs_words = cs_words2[idx].translate(str.maketrans("", "", string.punctuation))
-
-        cs_count = len(cs_words.strip().split(" "))
-        all_count = len(transcript.strip().split(" "))
-        if cs_count / all_count > 0.5:
-            labels2.append(0)  # english
-        elif cs_count / all_count < 0.5:
-            labels2.append(1)  # spanish
-        else:
-            labels2.append(int(random.random() > 0.5))
-
-    print(
-        f"Averages: labels1={np.array(labels1).mean()} labels2={np.array(labels2).mean()}"
-    )
 
-    if not os.path.isdir(os.path.join(output_path, desc + "_dev")):
-        os.makedirs(os.path.join(output_path, desc + "_dev"))
-    if not os.path.isdir(os.path.join(output_path, desc + "_train")):
-        os.makedirs(os.path.join(output_path, desc + "_train"))
+def make_lid_labels(transcript: list, cs_words: list, threshold: float = 0.5) -> np.ndarray:
+    """
+    Labels each utterance English (0) if more than `threshold` of its tokens are code-switched, else Spanish (1).
+        Ties are broken with the seeded `random`, in the order of the utterances.
+    """
+    assert len(transcript) == len(cs_words), f"CS words: {len(cs_words)} len_data={len(transcript)}"
+    with stage("make_lid_labels", items=len(transcript)):
+        cs_ratio = count_tokens(cs_words) / count_tokens(transcript)
+        labels = np.where(cs_ratio > threshold, ENGLISH, SPANISH).astype(np.uint8)
+        ties = np.flatnonzero(cs_ratio == threshold)
+        labels[ties] = [int(random.random() > 0.5) for _ in range(len(ties))]
+    return labels
 
-    with open(os.path.join(output_path, desc + "_dev", "lid_labels.txt"), "w") as fout:
-        for label in labels1:
-            fout.write(str(label))
-            fout.write("\n")
 
-    with open(
-        os.path.join(output_path, desc + "_train", "lid_labels.txt"), "w"
-    ) as fout:
-        for label in labels2:
-            fout.write(str(label))
-            fout.write("\n")
+def save_labels(labels: np.ndarray, path: str, array_path: str):
+    """Writes the labels one per line, and as a binary array"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fout:
+        fout.write("".join(f"{label}\n" for label in labels.tolist()))
+    np.save(array_path, labels)
 
-    return labels1, labels2
+
+def create_and_save_labels_for_cs_train_data(
+    transcript, transcript_train, cs_words, output_path, desc, threshold: float = 0.5
+) -> list:
+    """Only used for fisher_train_cs to save train and dev set labels"""
+    all_labels = []
+    for suffix, split_transcript, split_cs_words in zip(["_dev", "_train"], [transcript, transcript_train], cs_words):
+        labels = make_lid_labels(split_transcript, split_cs_words, threshold)
+        save_labels(
+            labels,
+            os.path.join(output_path, desc + suffix, "lid_labels.txt"),
+            os.path.join(output_path, desc + suffix, "lid_labels.npy"),
+        )
+        all_labels.append(labels)
+
+    print(f"Averages: labels1={all_labels[0].mean()} labels2={all_labels[1].mean()}")
+    return all_labels
 
 
 def write_out_data(
-    yaml_data, transcript, translation, base_path, output_path, desc, name
+    yaml_data, transcript, translation, base_path, output_path, desc, name, export_yaml: bool = True, clip_mode: str = "auto",
+    archive_kwargs: dict = None,
 ):
     """A helper function for writing out all the data"""
     if not os.path.isdir(os.path.join(output_path, desc, "clips")):
         os.makedirs(os.path.join(output_path, desc, "clips"))
 
-    with open(os.path.join(output_path, desc, f"{name}.yaml"), "w") as fout:
-        fout.write(yaml.dump(yaml_data))
-    with open(os.path.join(output_path, desc, f"{name}.transcript"), "w") as fout:
-        for line in transcript:
-            assert "\n" not in line, line
-            fout.write(line)
-            fout.write("\n")
-    with open(os.path.join(output_path, desc, f"{name}.translation"), "w") as fout:
-        for line in translation:
-            assert "\n" not in line, line
-            fout.write(line)
-            fout.write("\n")
-
-    for instance in yaml_data:
-        audio_path = instance["wav"]
-        shutil.copy(
-            os.path.join(base_path, audio_path),
-            os.path.join(output_path, desc, "clips", audio_path.split("/")[-1]),
-        )
+    write_split(os.path.join(output_path, desc), name, yaml_data, transcript, translation, export_yaml=export_yaml)
 
-    # make it a zip file
-    shutil.make_archive(
-        os.path.join(output_path, desc, "clips"),
-        "zip",
-        os.path.join(output_path, desc, "clips"),
-    )
+    with stage("materialize_clips", items=len(yaml_data)):
+        for instance in yaml_data:
+            audio_path = instance["wav"]
+            materialize_clip(
+                os.path.join(base_path, audio_path),
+                os.path.join(output_path, desc, "clips", audio_path.split("/")[-1]),
+                clip_mode,
+            )
+
+    # archive the clips into uncompressed shards
+    build_sharded_archive(os.path.join(output_path, desc, "clips"), **(archive_kwargs or {}))
 
 
 def sample_yaml_data(
     yaml_data, transcript, translation, num_idxs_to_sample, return_both: bool = False, should_write_out: bool = False
 ):
-    """A helper function for sampling from the data"""
-    split_idx = np.array(
-        random.sample(list(range(len(yaml_data))), k=num_idxs_to_sample)
-    )
+    """A helper function for sampling from the data, returns lazy views of the sampled (and other) items"""
+    split_idx = sample_indices(len(yaml_data), num_idxs_to_sample)
     if should_write_out:
         with open("train_vs_dev_cs.txt", "w") as fout:
-            for line in split_idx.tolist():
-                fout.write(str(line))
-                fout.write("\n")
-    bool_split = np.isin(np.arange(len(transcript)), split_idx)
-    transcript1 = np.array(transcript)[bool_split].tolist()
-    translation1 = np.array(translation)[bool_split].tolist()
-    yaml_data1 = np.array(yaml_data)[bool_split].tolist()
-    if return_both:
-        cs_words = []
-        with open("cs_corpus/fisher_train_cs_words_cs_only.es", "r") as fin:
-            for line in fin:
-                cs_words.append(line.strip())
-        assert len(cs_words) == len(yaml_data)
-        cs_words1 = np.array(cs_words)[bool_split].tolist()
-        cs_words2 = np.array(cs_words)[~bool_split].tolist()
-
-        transcript2 = np.array(transcript)[~bool_split].tolist()
-        translation2 = np.array(translation)[~bool_split].tolist()
-        yaml_data2 = np.array(yaml_data)[~bool_split].tolist()
-        return (
-            yaml_data1,
-            transcript1,
-            translation1,
-            yaml_data2,
-            transcript2,
-            translation2,
-            (cs_words1, cs_words2),
-        )
-    else:
-        return yaml_data1, transcript1, translation1
+            fout.write("".join(f"{line}\n" for line in split_idx.tolist()))
+    sampled, rest = split_indices(len(yaml_data), split_idx)
+    if not return_both:
+        return tuple(IndexView(data, sampled) for data in [yaml_data, transcript, translation])
+
+    with open("cs_corpus/fisher_train_cs_words_cs_only.es", "r") as fin:
+        cs_words = [line.strip() for line in fin]
+    assert len(cs_words) == len(yaml_data)
+    return (
+        *[IndexView(data, sampled) for data in [yaml_data, transcript, translation]],
+        *[IndexView(data, rest) for data in [yaml_data, transcript, translation]],
+        (IndexView(cs_words, sampled), IndexView(cs_words, rest)),
+    )
 
 
-def create_and_save_cs_labels_only(yaml_data, transcript, translation):
+def create_and_save_cs_labels_only(yaml_data, transcript, translation, threshold: float = 0.5):
     """A function that only creates the LID labels and saves them (only used for Fisher Eval CS)"""
     assert len(yaml_data) == len(transcript) == len(translation)
 
@@ -157,35 +126,14 @@ def create_and_save_cs_labels_only(yaml_data, transcript, translation):
             for line in fin:
                 cs_words_list.append(line.strip())
 
-    assert len(cs_words_list) == len(
-        yaml_data
-    ), f"CS words: {len(cs_words_list)} len_data={len(yaml_data)}"
-
-    labels = []
-    for idx, instance in enumerate(transcript):
-        transcript_str = instance.translate(str.maketrans("", "", string.punctuation))
-        cs_words = cs_words_list[idx].translate(
-            str.maketrans("", "", string.punctuation)
-        )
-
-        cs_count = len(cs_words.strip().split(" "))
-        all_count = len(transcript_str.strip().split(" "))
-        if cs_count / all_count > 0.5:
-            labels.append(0)  # english
-        elif cs_count / all_count < 0.5:
-            labels.append(1)  # spanish
-        else:
-            labels.append(int(random.random() > 0.5))
-
-    assert len(labels) == len(yaml_data)
-
-    with open(os.path.join("output/fisher/eval/cs/fisher.labels"), "w") as fout:
-        for label in labels:
-            fout.write(str(label))
-            fout.write("\n")
+    labels = make_lid_labels(transcript, cs_words_list, threshold)
+    save_labels(labels, "output/fisher/eval/cs/fisher.labels", "output/fisher/eval/cs/fisher.labels.npy")
 
 
-def gather_lid_data():
+def gather_lid_data(
+    export_yaml: bool = True, clip_mode: str = "auto", archive_kwargs: dict = None, threshold: float = 0.5,
+    labels_only: bool = False,
+):
     output_path = "output/lid"
     num_idxs_to_sample = None
     if not os.path.isdir(output_path):
@@ -199,38 +147,38 @@ def gather_lid_data():
         ("miami_train_mono", "miami", "../miami/output/miami/mono_train"),
     ]
     for (desc, name, base_path) in data_paths:
-        print(f"Working on {desc}")
-        transcript = []
-        translation = []
-        with open(f"{base_path}/{name}.yaml", "r") as fin:
-            yaml_data = yaml.safe_load(fin)
-        with open(f"{base_path}/{name}.transcript", "r") as fin:
-            for line in fin:
-                transcript.append(line.strip())
-        with open(f"{base_path}/{name}.translation", "r") as fin:
-            for line in fin:
-                translation.append(line.strip())
-        assert len(transcript) == len(yaml_data) == len(translation)
-
-        if desc == "fisher_eval_cs":
-            create_and_save_cs_labels_only(yaml_data, transcript, translation)
-        elif desc == "fisher_train_cs":
-            # need to split this into train and dev, then save
-            yaml_data, transcript, translation, yaml_data_train, transcript_train, translation_train, cs_words = sample_yaml_data(yaml_data, transcript, translation, 
-                                                                                                                            int(0.1 * len(yaml_data)), return_both=True,
-                                                                                                                            should_write_out=True)
-            print(f"Length of the data {base_path}/{name + '_dev'} is {len(yaml_data)}")
-            create_and_save_labels_for_cs_train_data(transcript, transcript_train, cs_words, output_path, desc, name)
-            write_out_data(yaml_data, transcript, translation, base_path, output_path, desc + "_dev", name)
-
-            print(f"Length of the data {base_path}/{name + '_train'} is {len(yaml_data_train)}")
-            write_out_data(yaml_data_train, transcript_train, translation_train, base_path, output_path, desc + "_train", name)
-            num_idxs_to_sample = len(yaml_data_train) # make fisher cs the base
-        else: # is monolingual
-            yaml_data, transcript, translation = sample_yaml_data(yaml_data, transcript, translation, min(len(yaml_data), num_idxs_to_sample))
-            print(f"Length of the data {base_path}/{name} is {len(yaml_data)}")
-            write_out_data(yaml_data, transcript, translation, base_path, output_path, desc, name)
+        with stage(desc):
+            print(f"Working on {desc}")
+            yaml_data, transcript, translation = load_split(base_path, name)
+
+            if desc == "fisher_eval_cs":
+                create_and_save_cs_labels_only(yaml_data, transcript, translation, threshold)
+            elif desc == "fisher_train_cs":
+                # need to split this into train and dev, then save
+                yaml_data, transcript, translation, yaml_data_train, transcript_train, translation_train, cs_words = sample_yaml_data(yaml_data, transcript, translation, 
+                                                                                                                                int(0.1 * len(yaml_data)), return_both=True,
+                                                                                                                                should_write_out=True)
+                print(f"Length of the data {base_path}/{name + '_dev'} is {len(yaml_data)}")
+                create_and_save_labels_for_cs_train_data(transcript, transcript_train, cs_words, output_path, desc, threshold)
+                if labels_only:
+                    break  # the rest only writes out data
+                write_out_data(yaml_data, transcript, translation, base_path, output_path, desc + "_dev", name, export_yaml, clip_mode, archive_kwargs)
+
+                print(f"Length of the data {base_path}/{name + '_train'} is {len(yaml_data_train)}")
+                write_out_data(yaml_data_train, transcript_train, translation_train, base_path, output_path, desc + "_train", name, export_yaml, clip_mode, archive_kwargs)
+                num_idxs_to_sample = len(yaml_data_train) # make fisher cs the base
+            else: # is monolingual
+                yaml_data, transcript, translation = sample_yaml_data(yaml_data, transcript, translation, min(len(yaml_data), num_idxs_to_sample))
+                print(f"Length of the data {base_path}/{name} is {len(yaml_data)}")
+                write_out_data(yaml_data, transcript, translation, base_path, output_path, desc, name, export_yaml, clip_mode, archive_kwargs)
 
 
 if __name__ == "__main__":
-    gather_lid_data()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-yaml", action="store_true", help="only write the manifests, without the YAML exports")
+    parser.add_argument("--clip-mode", choices=CLIP_MODES, default="auto", help="how clips are put into the splits, auto links them")
+    parser.add_argument("--lid-threshold", type=float, default=0.5, help="fraction of CS tokens above which an utterance is labeled English")
+    parser.add_argument("--labels-only", action="store_true", help="only (re)write the LID labels, not the split data")
+    add_archive_arguments(parser)
+    args = parser.parse_args()
+    gather_lid_data(not args.no_yaml, args.clip_mode, archive_options(args), args.lid_threshold, args.labels_only)
@@ -0,0 +1,181 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# An index of the segments of every Fisher conversation (the LDC2010T04 `.tdf` transcripts), parsed once and
+# saved as `tdf_index.npz`: the segment lines of all conversations in one table of integer columns (file,
+# channel, start, end and speaker, with the times as exact decimal ticks), found by (conversation, line number)
+# the way the mapping files number them. Lines are numbered as `prepare-sets.sh` used to feed them to
+# `extract-utterance-audios.py`: every line of the file except the header and the `;;MM` metadata, from 1.
+#   python tdf_index.py ${LDC2010T04}/data/transcripts tdf_index.npz
+import os
+import sys
+import argparse
+from typing import List, Tuple
+
+import numpy as np
+
+TDF_INDEX_PATH = "tdf_index.npz"
+SKIPPED_LINES = [b";;MM", b"file;unicode"]
+NUM_FIELDS = 5  # file, channel, start, end, speaker
+
+
+def parse_time(text: str) -> Tuple[int, int]:
+    """(ticks, decimals) of a plain decimal such as `12.34`, kept exact"""
+    whole, _, frac = text.partition(".")
+    return int(whole + frac), len(frac)
+
+
+def segment_fields(line: bytes) -> list:
+    """The first fields of a segment line, split as `cut -f 1-5 | tr '\\t' '+'` and `.strip().split('+')` did"""
+    text = "+".join(line.decode("utf-8", errors="surrogateescape").split("\t")[:NUM_FIELDS])
+    return text.strip().split("+")
+
+
+class TdfIndex:
+    """The segments of all conversations, looked up by (conversation, 1-based line number)"""
+
+    def __init__(self, arrays: dict):
+        self.conversations = arrays["conversations"]
+        self.row_starts = arrays["row_starts"]
+        self.files = arrays["files"]
+        self.speakers = arrays["speakers"]
+        self.file_idx = arrays["file_idx"]
+        self.channel = arrays["channel"]  # -1 for lines that aren't segments
+        self.start_ticks = arrays["start_ticks"]
+        self.end_ticks = arrays["end_ticks"]
+        self.decimals = arrays["decimals"]  # of the start and end as written, to give back their text
+        self.speaker_idx = arrays["speaker_idx"]
+        self.time_scale = int(arrays["time_scale"])
+        self.positions = {name: pos for pos, name in enumerate(self.conversations.tolist())}
+
+    @classmethod
+    def load(cls, path: str = TDF_INDEX_PATH) -> "TdfIndex":
+        with np.load(path) as arrays:
+            return cls({key: arrays[key] for key in arrays.files})
+
+    def __len__(self) -> int:
+        return len(self.conversations)
+
+    def __contains__(self, conversation: str) -> bool:
+        return conversation in self.positions
+
+    def rows(self, conversation: str, line_nums: List[int]) -> np.ndarray:
+        pos = self.positions.get(conversation)
+        if pos is None:
+            raise KeyError(f"No transcript for conversation {conversation}")
+        start, end = self.row_starts[pos], self.row_starts[pos + 1]
+        rows = start + np.asarray(line_nums, dtype=np.int64) - 1
+        for line_num, row in zip(line_nums, rows.tolist()):
+            if not start <= row < end or self.channel[row] < 0:
+                raise ValueError(f"Line {line_num} of {conversation} is not a segment")
+        return rows
+
+    def seconds(self, ticks: np.ndarray) -> np.ndarray:
+        # a correctly rounded division, so the same floats as parsing the text
+        return np.asarray(ticks, dtype=np.int64) / self.time_scale
+
+    def time_text(self, ticks: int, decimals: int) -> str:
+        """A time as written in the transcript (e.g. `12.30`)"""
+        ticks, decimals = int(ticks), int(decimals)
+        value = abs(ticks) // (self.time_scale // 10 ** decimals)
+        sign = "-" if ticks < 0 else ""
+        if not decimals:
+            return f"{sign}{value}"
+        return f"{sign}{value // 10 ** decimals}.{value % 10 ** decimals:0{decimals}d}"
+
+    def segment_text(self, row: int) -> str:
+        """The segment's fields joined by `+`, as `extract-utterance-audios.py` used to get them"""
+        return "+".join([
+            str(self.files[self.file_idx[row]]),
+            str(self.channel[row]),
+            self.time_text(self.start_ticks[row], self.decimals[row, 0]),
+            self.time_text(self.end_ticks[row], self.decimals[row, 1]),
+            str(self.speakers[self.speaker_idx[row]]),
+        ])
+
+    def segments(self, rows: np.ndarray) -> list:
+        """(file, channel, start, end, speaker) of the `rows` of some lines, as parsed from the transcript"""
+        starts, ends = self.seconds(self.start_ticks[rows]).tolist(), self.seconds(self.end_ticks[rows]).tolist()
+        return [
+            (str(self.files[self.file_idx[row]]), int(self.channel[row]), start, end, str(self.speakers[self.speaker_idx[row]]))
+            for row, start, end in zip(rows.tolist(), starts, ends)
+        ]
+
+
+def build_tdf_index(tdf_dir: str) -> TdfIndex:
+    """Parses every `{conversation}.tdf` in `tdf_dir`"""
+    conversations = sorted(file_name[: -len(".tdf")] for file_name in os.listdir(tdf_dir) if file_name.endswith(".tdf"))
+    files, speakers = {}, {}
+    row_starts = [0]
+    columns = {"file": [], "channel": [], "start": [], "end": [], "speaker": []}
+    for conversation in conversations:
+        with open(os.path.join(tdf_dir, f"{conversation}.tdf"), "rb") as fin:
+            lines = fin.read().split(b"\n")
+        if lines and not lines[-1]:
+            lines.pop()  # the file's final newline
+        for line in lines:
+            if any(skipped in line for skipped in SKIPPED_LINES):
+                continue
+            fields = segment_fields(line)
+            try:
+                channel = int(fields[1])
+                start, end = parse_time(fields[2]), parse_time(fields[3])
+                file_name, speaker = fields[0], fields[4]
+            except (IndexError, ValueError):
+                channel, start, end, file_name, speaker = -1, (0, 0), (0, 0), "", ""
+            columns["file"].append(files.setdefault(file_name, len(files)))
+            columns["channel"].append(channel)
+            columns["start"].append(start)
+            columns["end"].append(end)
+            columns["speaker"].append(speakers.setdefault(speaker, len(speakers)))
+        row_starts.append(len(columns["file"]))
+
+    decimals = max([item[1] for item in columns["start"] + columns["end"]], default=0)
+    ticks = {
+        key: np.array([value * 10 ** (decimals - num_decimals) for value, num_decimals in columns[key]], dtype=np.int64)
+        for key in ["start", "end"]
+    }
+    return TdfIndex({
+        "conversations": np.array(conversations, dtype=str),
+        "row_starts": np.array(row_starts, dtype=np.int64),
+        "files": np.array(list(files), dtype=str),
+        "speakers": np.array(list(speakers), dtype=str),
+        "file_idx": np.array(columns["file"], dtype=np.int32),
+        "channel": np.array(columns["channel"], dtype=np.int8),
+        "start_ticks": ticks["start"],
+        "end_ticks": ticks["end"],
+        "decimals": np.array([[start[1], end[1]] for start, end in zip(columns["start"], columns["end"])], dtype=np.int8).reshape(-1, 2),
+        "speaker_idx": np.array(columns["speaker"], dtype=np.int32),
+        "time_scale": np.array(10 ** decimals, dtype=np.int64),
+    })
+
+
+def save_tdf_index(index: TdfIndex, path: str = TDF_INDEX_PATH):
+    arrays = {
+        "conversations": index.conversations,
+        "row_starts": index.row_starts,
+        "files": index.files,
+        "speakers": index.speakers,
+        "file_idx": index.file_idx,
+        "channel": index.channel,
+        "start_ticks": index.start_ticks,
+        "end_ticks": index.end_ticks,
+        "decimals": index.decimals,
+        "speaker_idx": index.speaker_idx,
+        "time_scale": np.array(index.time_scale, dtype=np.int64),
+    }
+    with open(path + ".tmp", "wb") as fout:
+        np.savez(fout, **arrays)
+    os.replace(path + ".tmp", path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tdf_dir", help="the LDC2010T04 transcripts directory")
+    parser.add_argument("output", nargs="?", default=TDF_INDEX_PATH)
+    args = parser.parse_args()
+    index = build_tdf_index(args.tdf_dir)
+    save_tdf_index(index, args.output)
+    print(f"Indexed {len(index.channel)} lines of {len(index)} conversations into {args.output}", file=sys.stderr)
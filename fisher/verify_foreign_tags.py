@@ -0,0 +1,49 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Golden check for `foreign_tags.py`: parses every tagged line with BeautifulSoup, as the extraction did
+# before (kept below as the reference), and fails if any foreign span or CS ratio differs
+import sys
+import glob
+from tqdm import tqdm
+from bs4 import BeautifulSoup
+from foreign_tags import extract_foreign_spans, fix_small_errors
+
+
+##### reference implementation #####
+def reference_spans(line: str):
+    soup = BeautifulSoup(fix_small_errors(line), features="html.parser")
+    inside_tags = soup.find_all("foreign")  # finds all foreign tags, in case of multiples
+    inside_texts = [item.get_text() for item in inside_tags]
+    langs = [item["lang"] for item in inside_tags]
+    to_keep = [idx for (idx, item) in enumerate(inside_texts) if item.strip() not in ["", "(())"]]
+    total_cs_text = [item for item in " ".join(inside_texts).strip().split(" ") if item != ""]
+    line_tokens = [item for item in soup.get_text().split(" ") if item != ""]
+    return [(langs[idx], inside_texts[idx].strip()) for idx in to_keep], len(total_cs_text) / len(line_tokens)
+
+
+def verify_foreign_tags(pattern: str = "fisher-callhome-corpus-tags/corpus/ldc/fisher_*.es") -> int:
+    num_checked = 0
+    num_failed = 0
+    for file_path in sorted(glob.glob(pattern)):
+        with open(file_path, "r") as fin:
+            for line_idx, line in enumerate(tqdm(fin, desc=file_path, leave=True)):
+                line = line.strip()
+                if "<foreign" not in line:
+                    continue
+                num_checked += 1
+                expected = reference_spans(line)
+                spans, cs_ratio = extract_foreign_spans(line, line_idx)
+                got = ([(span.lang, span.text) for span in spans], cs_ratio)
+                if expected != got:
+                    num_failed += 1
+                    print(f"{file_path}:{line_idx} {line!r}: expected {expected}, got {got}")
+
+    print(f"Checked {num_checked} lines, {num_failed} differ")
+    return num_failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if verify_foreign_tags() else 0)
@@ -0,0 +1,318 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# streaming reader of the CHAT transcripts (`.cha`) of the Miami corpus: one pass over a file gives each utterance
+# with its raw main tier, dependent tiers (e.g. the `%eng` translation), time marks, the `@s:` language marks and
+# `[...]` markup of the main tier, and its words. It follows the parsing rules of pylangacq 0.15 (which this
+# replaced), so the words, tiers, time marks and languages are the same, without building its tokens or parsing
+# the %mor/%gra tiers and dates: the cleaning of the words skips the steps whose markup an utterance lacks, and
+# cleans each distinct token once
+#
+#   reader = ChatReader("data/miami/beta/maria1.cha")
+#   main_lang = reader.languages[0]
+#   for utterance in reader:
+#       ...
+import re
+import functools
+import collections
+from typing import Iterator, List, Optional, Tuple
+
+ENCODING = "utf-8"
+LINE_INDICATORS = ("@", "*", "%")
+HEADER = re.compile(r"\A@([^@:]+)(:\s+(\S[\S\s]+))?\Z")
+TIME_MARKS = re.compile(r"\x15-?(\d+)_(\d+)-?\x15")
+MARKUP = re.compile(r"\[.*?\]")
+CLITIC = "CLITIC"  # pylangacq's placeholder, which it leaves out of the words
+
+ChatUtterance = collections.namedtuple(
+    "ChatUtterance",
+    [
+        "idx",  # of the utterance in the file, counting every one
+        "participant",
+        "main",  # the main tier as written, with its whitespace collapsed
+        "tiers",  # {participant or %tier: text}, as pylangacq's `Utterance.tiers`
+        "time_marks",  # (start, end) in milliseconds, or None
+        "words",  # as pylangacq's `words(by_utterances=True)`
+        "language_marks",  # (word, mark) of each `word@mark` of the main tier, e.g. ("so", "s:eng&spa")
+        "markups",  # the `[...]` spans of the main tier, e.g. "[- spa]" or "[//]"
+    ],
+)
+
+
+##### the main tier cleaning of pylangacq (`_clean_utterance`), step by step #####
+# each step only runs when the utterance has the text all of its matches start with
+DROPS = [
+    ("[= ", re.compile(r"\[= [^\[]+?\]")),
+    ("[x ", re.compile(r"\[x \d+?\]")),
+    ("[+ ", re.compile(r"\[\+ [^\[]+?\]")),
+    ("[* ", re.compile(r"\[\* [^\[]+?\]")),
+    ("[=? ", re.compile(r"\[=\? [^\[]+?\]")),
+    ("[=! ", re.compile(r"\[=! [^\[]+?\]")),
+    ("[% ", re.compile(r"\[% [^\[]+?\]")),
+    ("[- ", re.compile(r"\[- [^\[]+?\]")),
+    ("[^ ", re.compile(r"\[\^ [^\[]+?\]")),
+    ("\x15", re.compile("\x15[^\x15]+?\x15")),  # the time marks
+    ("[<", re.compile(r"\[<\d?\]")),
+    ("[>", re.compile(r"\[>\d?\]")),
+    ("(", re.compile(r"\((\d+?:)?\d+?\.?\d*?\)")),  # pauses
+    ("[%act: ", re.compile(r"\[%act: [^\[]+?\]")),
+]
+REPLACEMENTS = [
+    ("[?]", " "),
+    ("[!]", " "),
+    ("[!!]", " "),
+    ("[^c]", " "),
+    ("‹", " "),
+    ("›", " "),
+    ("⌈", ""),
+    ("⌉", ""),
+    ("⌊", ""),
+    ("⌋", ""),
+    ("[*] [/", " [/"),
+    ("] [*]", "] "),
+    ("[*]", " "),
+    ("[//] [//]", "[//]"),
+    ("[/] [//]", "[//]"),
+    ("[/?] [/]", "[//]"),
+    ("[//] [/]", "[/]"),
+    ("<", " < "),
+    ("+ <", "+<"),
+    (">", " > "),
+    ("[", " ["),
+    ("]", "] "),
+    ("“", " “ "),
+    ("”", " ” "),
+    (",", " , "),
+    ("+ ,", "+,"),
+]
+QUESTION_PAD = re.compile(r"[^\[\./!]\?")
+SHORT_PAUSE_PAD = re.compile(r"\(\.\)")
+FINAL_PERIOD_PAD = re.compile(r"([a-z])\.\Z")
+# kept (`:: x`) or replaced by (`: x`) their correction, repeated until none is left
+CORRECTIONS = [
+    (" [:: ", re.compile(r"(<[^>]+?>) \[:: ([^\]]+?)\]"), r"\1"),
+    (" [:: ", re.compile(r"(\S+?) \[:: ([^\]]+?)\]"), r"\1"),
+    (" [: ", re.compile(r"(<[^>]+?>) \[: ([^\]]+?)\]"), r"<\2>"),
+    (" [: ", re.compile(r"(\S+?) \[: ([^\]]+?)\]"), r"<\2>"),
+]
+RETRACING_MARKS = ["> [///]", "> [//]", "> [/]", "> [/?]", "> [/-]"]
+RETRACED_WORDS = [
+    (" [///]", re.compile(r"\S+? \[///\]")),
+    (" [//]", re.compile(r"\S+? \[//\]")),
+    (" [/]", re.compile(r"\S+? \[/\]")),
+    (" [/?]", re.compile(r"\S+? \[/\?\]")),
+    (" [/-]", re.compile(r"\S+? \[/-\]")),
+]
+ESCAPE_PREFIXES = ("[?", "[/", "[<", "[>", "[:", "[!", "[*", '+"', "+,", "<&", "&")
+ESCAPE_SUFFIXES = ("↫xxx",)
+ESCAPE_WORDS = {
+    "0", "++", "+<", "+^", "(.)", "(..)", "(...)", ":", ";", "<", ">",
+    "xxx", "yyy", "www", "xxx:", "xxx;", "xxx→", "xxx↑", "yyy:", "→",
+}
+KEEP_PREFIXES = ('+"/', "+,/", '+".')
+WORD_REMOVALS = str.maketrans("", "", "():;+")
+
+
+def collapse_spaces(text: str) -> str:
+    return " ".join(text.split())
+
+
+def find_opening(text: str, opening: str, closing: str) -> int:
+    """The index of the `opening` bracket matching the last, unclosed one of `text`"""
+    depth = 1
+    for idx in range(len(text) - 1, -1, -1):
+        if text[idx] == closing:
+            depth += 1
+        elif text[idx] == opening:
+            depth -= 1
+        if depth == 0:
+            return idx
+    raise ValueError(f"no matching paren: {text}, {opening}, {closing}, left")
+
+
+def drop_retraced_group(text: str, mark: str) -> str:
+    """Drops the first `<...> [//]` (or other retracing `mark`) group"""
+    check = text.find(mark)
+    if check != -1:
+        opening = find_opening(text[:check], "<", ">")
+        text = collapse_spaces(f"{text[:opening]} {text[check + len(mark):]}")
+    return text
+
+
+def clean_main_tier(text: str) -> str:
+    """A main tier without the markup pylangacq drops, its words still to be filtered by `clean_token`"""
+    for start, regex in DROPS:
+        if start in text:
+            text = regex.sub("", text)
+
+    for replaced, replacement in REPLACEMENTS:
+        if replaced in text:
+            text = text.replace(replaced, replacement)
+    text = collapse_spaces(text)
+    if "?" in text:
+        text = QUESTION_PAD.sub(" ? ", text)
+    if "(.)" in text:
+        text = SHORT_PAUSE_PAD.sub(" (.) ", text)
+    if text.endswith("."):
+        text = FINAL_PERIOD_PAD.sub(r"\1 .", text)
+    text = collapse_spaces(text)
+
+    for start, regex, replacement in CORRECTIONS:
+        if start in text:
+            while regex.search(text):
+                text = regex.sub(replacement, text)
+            text = collapse_spaces(text)
+
+    if "> [/" in text:
+        previous = text
+        while True:
+            for mark in RETRACING_MARKS:
+                text = drop_retraced_group(text, mark)
+            text = collapse_spaces(text)
+            if text == previous:
+                break
+            previous = text
+    for start, regex in RETRACED_WORDS:
+        if start in text:
+            text = collapse_spaces(regex.sub("", text))
+
+    if "“" in text or "”" in text:
+        text = collapse_spaces(text.replace("“", "").replace("”", ""))
+    return text
+
+
+def clean_word(word: str) -> str:
+    """A word without its `@` mark, parentheses and other symbols, as pylangacq's words"""
+    word = word.translate(WORD_REMOVALS)
+    if "@" in word:
+        word = word[: word.index("@")]
+    if word.startswith("&"):
+        word = word[1:]
+    return word
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def clean_token(token: str) -> Optional[str]:
+    """The word of a token of the cleaned main tier, None for the ones left out (markup, pauses, `xxx`...)"""
+    word = token
+    if word[0] == "<":
+        word = word[1:]
+    if word[-1:] == ">":
+        word = word[:-1]
+    if word[-1:] == "]":
+        word = word[:-1]
+    if not word or not (
+        word.startswith(KEEP_PREFIXES)
+        or not (word in ESCAPE_WORDS or word.startswith(ESCAPE_PREFIXES) or word.endswith(ESCAPE_SUFFIXES))
+    ):
+        return None
+    word = clean_word(word)
+    return None if word == CLITIC else word
+
+
+def main_tier_words(main: str) -> List[str]:
+    return [word for word in map(clean_token, clean_main_tier(main).split()) if word is not None]
+
+
+##### reading the file #####
+def iter_lines(text: str) -> Iterator[str]:
+    """The lines of a CHAT file, with the continuation lines joined to the line they continue"""
+    previous = None
+    for line in text.strip().splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("%xpho:") or line.startswith("%xmod:"):
+            line = line.replace("%x", "%", 1)
+        if line[0] not in LINE_INDICATORS:
+            if previous is None:
+                raise ValueError(f"Continuation line {line!r} without a line to continue")
+            previous = f"{previous} {line}"
+            continue
+        if previous is not None:
+            yield previous
+        previous = line
+    if previous is not None:
+        yield previous
+
+
+def parse_header_line(line: str) -> Optional[Tuple[str, object]]:
+    """(name, value) of a header line, the `@Languages` as a list ordered by dominance and the others as written"""
+    match = HEADER.search(line)
+    if not match or line.startswith("@Begin") or line.startswith("@End"):
+        return None
+    name, value = match.group(1), match.group(3) or ""
+    if name == "Languages":
+        return name, [language.strip() for language in value.strip().split(",") if language.strip()]
+    return name, value
+
+
+def time_marks(main: str) -> Optional[Tuple[int, int]]:
+    match = TIME_MARKS.search(main)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def make_utterance(idx: int, participant: str, tiers: dict) -> ChatUtterance:
+    main = tiers[participant]
+    words = main.split(" ")
+    return ChatUtterance(
+        idx,
+        participant,
+        main,
+        tiers,
+        time_marks(main),
+        main_tier_words(main),
+        [tuple(word.split("@")[:2]) for word in words if "@" in word],
+        MARKUP.findall(main) if "[" in main else [],
+    )
+
+
+class ChatReader:
+    """
+    A CHAT file, its utterances parsed as they are iterated. The header lines before the first utterance are
+        read right away into `header` (later ones, as pylangacq keeps them, while iterating).
+    """
+
+    def __init__(self, path: str, encoding: str = ENCODING):
+        self.path = path
+        with open(path, "r", encoding=encoding) as fin:
+            self.lines = list(iter_lines(fin.read()))
+        self.header = {}
+        for line in self.lines:
+            if line.startswith("*"):
+                break
+            self.add_header_line(line)
+
+    @property
+    def languages(self) -> List[str]:
+        return self.header.get("Languages", [])
+
+    def add_header_line(self, line: str):
+        header = parse_header_line(line)
+        if header is not None:
+            self.header[header[0]] = header[1]
+
+    def __iter__(self) -> Iterator[ChatUtterance]:
+        idx = -1
+        participant, tiers = None, None
+        for line in self.lines:
+            if line[0] == "@":
+                self.add_header_line(line)
+                continue
+            fields = line.split()
+            if line[0] == "*":
+                if tiers is not None:
+                    yield make_utterance(idx, participant, tiers)
+                idx += 1
+                participant = fields[0].lstrip("*").rstrip(":")
+                tiers = {participant: " ".join(fields[1:])}
+            elif tiers is not None and tiers[participant]:  # pylangacq drops the tiers of an empty utterance
+                tiers[fields[0].rstrip(":")] = " ".join(fields[1:])
+        if tiers is not None:
+            yield make_utterance(idx, participant, tiers)
+
+
+def read_chat(path: str, encoding: str = ENCODING) -> ChatReader:
+    return ChatReader(path, encoding)
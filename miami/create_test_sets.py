@@ -5,151 +5,87 @@
 
 # this file takes all of the Miami data and turns it into splits
 import os
-import yaml
-import json
-from tqdm import tqdm
-import shutil
+import sys
+import argparse
 import numpy as np
 import random
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # for `cs_data`
+from cs_data.archive import add_archive_arguments, archive_options, build_sharded_archive
+from cs_data.manifest import load_split, write_split
+from cs_data.materialize import CLIP_MODES, materialize_clip
+from cs_data.profiling import stage
+from cs_data.sampling import sample_indices, split_indices
+
 random.seed(1)
 
 DATASET_NAMES = ["cs", "mono"]
 
-def map_cs(x: str) -> str:
-    if x == "n/a":
-        return x
-    elif "cs" in x:
-        return "cs"
-    else:
-        return "mono"
-
-def map_split(x: str) -> str:
-    if x == "n/a":
-        return x
-    elif "train" in x:
-        return "train"
-    else:
-        return "test"
-
-def split_data():
+def assign_splits(yaml_data: list, transcript: list, translation: list):
+    """Splits the utterances into cs/mono/mono_train by their index, returns the indexes and the mapping table"""
+    clip_names = [instance["wav"].split("/")[1].split("_") for instance in yaml_data]
+    durations = np.array([instance["duration"] for instance in yaml_data], dtype=float)
+    code_switched = np.array([bool(instance["code_switched"]) for instance in yaml_data], dtype=bool)
+    transcript = np.array(transcript, dtype=object)
+    translation = np.array(translation, dtype=object)
+
+    # same would be not helpful, and remove instances that are too short
+    usable = (translation != "") & (translation != "\n") & (transcript != translation)
+    kept = usable & (durations >= 0.3)
+    is_cs = kept & code_switched
+    is_mono = kept & ~code_switched
+
+    # split the mono data, sampling over the mono positions exactly as before so seed 1 gives the same split
+    mono_idxs = np.flatnonzero(is_mono)
+    train_pos, test_pos = split_indices(len(mono_idxs), sample_indices(len(mono_idxs), len(mono_idxs) // 2))
+    is_mono_train = np.zeros(len(yaml_data), dtype=bool)
+    is_mono_train[mono_idxs[train_pos]] = True
+
+    # make a mapping file for others to use
+    mapping_val = pd.DataFrame({
+        "global_idx": np.arange(len(yaml_data)),
+        "split": np.where(kept, np.where(is_mono_train, "train", "test"), "n/a"),
+        "file": [name[0] for name in clip_names],
+        "file_line_num": [name[-1].split(".")[0].replace("p", "") for name in clip_names],
+        "offset": [instance["offset"] for instance in yaml_data],
+        "duration": durations,
+        "cs_type": np.where(kept, np.where(is_cs, "cs", "mono"), "n/a"),
+    })
+    return np.flatnonzero(is_cs), mono_idxs[test_pos], mono_idxs[train_pos], mapping_val
+
+
+def split_data(export_yaml: bool = True, clip_mode: str = "auto", archive_kwargs: dict = None):
     print("Loading the data...")
     base_path = "output/miami/all"
     base_output_path = "output/miami"
-    transcript = []
-    translation = []
-    with open(f"{base_path}/miami.yaml", "r") as fin:
-        yaml_data = yaml.safe_load(fin)
-    with open(f"{base_path}/miami.transcript", "r") as fin:
-        for line in fin:
-            transcript.append(line.strip())
-    with open(f"{base_path}/miami.translation", "r") as fin:
-        for idx, line in enumerate(fin):
-            translation.append(line.strip())
-    assert len(transcript) == len(yaml_data) == len(translation), [len(transcript), len(yaml_data), len(translation)]
+    yaml_data, transcript, translation = load_split(base_path, "miami")
     print(f"Length of the original data is {len(transcript)}")
 
-    mono = [[], [], []]
-    cs = [[], [], []]
     print("Separating the data...")
-    data_type = []
-    mono_count = 0
-    mono_map = {}
-    offsets = []
-    durations = []
-    files = []
-    local_file_lines = []
-    for idx in tqdm(range(len(yaml_data)), leave=True):
-        # get values for making a mapping file
-        local_line_num = yaml_data[idx]["wav"].split("/")[1].split("_")[-1].split(".")[0].replace("p", "")
-        files.append(yaml_data[idx]["wav"].split("/")[1].split("_")[0])
-        offsets.append(yaml_data[idx]["offset"])
-        durations.append(yaml_data[idx]["duration"])
-        local_file_lines.append(local_line_num)
-
-        if (
-            translation[idx] not in ["", "\n"] and transcript[idx] != translation[idx]
-        ):  # same would be not helpful
-
-            yaml_instance = yaml_data[idx]
-            if yaml_instance["duration"] < 0.3:  # remove instances that are too short
-                data_type.append("n/a")
-                continue
-
-            yaml_instance["offset"] = 0  # we're making each their own file
-
-            if yaml_data[idx]["code_switched"]:
-                cs[0].append(yaml_instance)
-                cs[1].append(transcript[idx])
-                cs[2].append(translation[idx])
-                data_type.append("cs")
-            else:
-                mono[0].append(yaml_instance)
-                mono[1].append(transcript[idx])
-                mono[2].append(translation[idx])
-                data_type.append("mono")
-                mono_map[mono_count] = idx
-                mono_count += 1
-        else:
-            data_type.append("n/a")
-
-    # split the mono data
-    mono[0] = np.array(mono[0])
-    mono[1] = np.array(mono[1])
-    mono[2] = np.array(mono[2])
-    split_mono_idx = np.array(
-        random.sample(list(range(len(mono[0]))), len(mono[0]) // 2)
-    )
-    global_map_from_mono = sorted([mono_map[cur_idx] for cur_idx in split_mono_idx])
-    bool_split = np.isin(np.arange(len(mono[0])), split_mono_idx)
-    mono_train = [
-        mono[0][bool_split].tolist(),
-        mono[1][bool_split].tolist(),
-        mono[2][bool_split].tolist(),
-    ]
-    mono = [
-        mono[0][~bool_split].tolist(),
-        mono[1][~bool_split].tolist(),
-        mono[2][~bool_split].tolist(),
-    ]
-
-    # make a mapping file for others to use
-    data_type = [dtype if idx not in global_map_from_mono else "mono_train" \
-                    for idx, dtype in enumerate(data_type)]
-    mapping_val = pd.DataFrame({"global_idx": list(range(len(data_type))), "split": data_type,
-                                "file": files, "file_line_num": local_file_lines, 
-                                "offset": offsets, "duration": durations})
-
-    mapping_val["cs_type"] = mapping_val.split.apply(lambda x: map_cs(x))
-    mapping_val["split"] = mapping_val.split.apply(lambda x: map_split(x))                        
+    with stage("assign_splits", items=len(transcript)):
+        cs_idxs, mono_idxs, mono_train_idxs, mapping_val = assign_splits(yaml_data, transcript, translation)
     mapping_val.to_csv("miami_mapping.csv", index=None)
 
+    cs, mono, mono_train = [
+        [[yaml_data[idx] for idx in idxs], [transcript[idx] for idx in idxs], [translation[idx] for idx in idxs]]
+        for idxs in [cs_idxs, mono_idxs, mono_train_idxs]
+    ]
+    for instance in cs[0] + mono[0] + mono_train[0]:
+        instance["offset"] = 0  # we're making each their own file
+
     print("Writing the data out...")
     for (name, datasets) in zip(DATASET_NAMES + ["mono_train"], [cs, mono, mono_train]):
         print(f"Length of the data {name} is {len(datasets[0])}")
-        if not os.path.isdir(os.path.join(base_output_path, name)):
-            os.makedirs(os.path.join(base_output_path, name))
-        with open(os.path.join(base_output_path, name, f"miami.jsonl"), "w") as fout:
-            for segment in datasets[0]:
-                fout.write(json.dumps(segment))
-                fout.write("\n")
-        with open(os.path.join(base_output_path, name, f"miami.yaml"), "w") as fout:
-            fout.write(yaml.dump(datasets[0], allow_unicode=True))
-        with open(
-            os.path.join(base_output_path, name, f"miami.transcript"), "w"
-        ) as fout:
-            for line in datasets[1]:
-                assert "\n" not in line, line
-                fout.write(line)
-                fout.write("\n")
-        with open(
-            os.path.join(base_output_path, name, f"miami.translation"), "w"
-        ) as fout:
-            for line in datasets[2]:
-                assert "\n" not in line, line
-                fout.write(line)
-                fout.write("\n")
+        write_split(
+            os.path.join(base_output_path, name),
+            "miami",
+            *datasets,
+            export_yaml=export_yaml,
+            export_jsonl=export_yaml,
+            allow_unicode=True,
+            sort_jsonl_keys=True,  # as when the instances were loaded back from the YAML file
+        )
 
     print("Moving clip data...")
     mono_clips = [item["wav"] for item in mono[0]]
@@ -161,21 +97,24 @@ def split_data():
     for (name, file_paths) in zip(
         DATASET_NAMES + ["mono_train"], [cs_clips, mono_clips, mono_train_clips]
     ):
-        for file_path in file_paths:
-            if not os.path.isdir(os.path.join(base_output_path, name, "clips")):
-                os.makedirs(os.path.join(base_output_path, name, "clips"))
-            shutil.copy(
-                os.path.join(base_path, file_path),
-                os.path.join(base_output_path, name, file_path),
-            )
-
-        # make it a zip file
-        shutil.make_archive(
-            os.path.join(base_output_path, name, "clips"),
-            "zip",
-            os.path.join(base_output_path, name, "clips"),
-        )
+        with stage(f"materialize_{name}", items=len(file_paths)):
+            for file_path in file_paths:
+                if not os.path.isdir(os.path.join(base_output_path, name, "clips")):
+                    os.makedirs(os.path.join(base_output_path, name, "clips"))
+                materialize_clip(
+                    os.path.join(base_path, file_path),
+                    os.path.join(base_output_path, name, file_path),
+                    clip_mode,
+                )
+
+        # archive the clips into uncompressed shards
+        build_sharded_archive(os.path.join(base_output_path, name, "clips"), **(archive_kwargs or {}))
 
 
 if __name__ == "__main__":
-    split_data()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-yaml", action="store_true", help="only write the manifests, without the YAML/JSONL exports")
+    parser.add_argument("--clip-mode", choices=CLIP_MODES, default="auto", help="how clips are put into the splits, auto links them")
+    add_archive_arguments(parser)
+    args = parser.parse_args()
+    split_data(not args.no_yaml, args.clip_mode, archive_options(args))
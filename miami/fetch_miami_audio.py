@@ -0,0 +1,265 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Downloads the Miami recordings and converts them to 16K mono WAV. A few downloads run at once, each resumed
+# with an HTTP range request where a previous attempt stopped (into `{name}.mp3.part`, renamed only once it has
+# all of its bytes), and each recording is converted as soon as its download is done, while the others download.
+# The size and SHA-256 of every download are recorded in `downloads.json`, so a later run re-fetches a file
+# that changed or was cut short instead of keeping it (as with `--checksums`, for files of known digests).
+#   python fetch_miami_audio.py --downloads 4 --jobs 8
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+import http.client
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # for `cs_data`
+from cs_data.jobs import default_jobs
+from cs_data.profiling import stage
+
+BASE_URL = "http://bangortalk.bangor.ac.uk"
+AUDIO_DIR = "data/miami/audio"
+RECORDS_FILE = "downloads.json"
+CHUNK_SIZE = 1 << 16
+RECORDINGS = [
+    "herring1", "herring2", "herring3", "herring5", "herring6", "herring7", "herring8", "herring9", "herring10",
+    "herring11", "herring12", "herring13", "herring14", "herring15", "herring16", "herring17",
+    "maria1", "maria2", "maria3", "maria4", "maria7", "maria10", "maria16", "maria18", "maria19", "maria20",
+    "maria21", "maria24", "maria27", "maria30", "maria31", "maria40",
+    "sastre1", "sastre2", "sastre3", "sastre4", "sastre5", "sastre6", "sastre7", "sastre8", "sastre9",
+    "sastre10", "sastre11", "sastre12", "sastre13",
+    "zeledon1", "zeledon2", "zeledon3", "zeledon4", "zeledon5", "zeledon6", "zeledon7", "zeledon8",
+    "zeledon9", "zeledon11", "zeledon13", "zeledon14",
+]
+
+
+class FetchError(Exception):
+    pass
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fin:
+        for chunk in iter(lambda: fin.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_checksums(path: str) -> dict:
+    """`sha256sum` output (`{digest}  {name}.mp3`) as {name: digest}"""
+    checksums = {}
+    with open(path, "r") as fin:
+        for line in fin:
+            if line.strip():
+                digest, file_name = line.split(maxsplit=1)
+                checksums[os.path.splitext(os.path.basename(file_name.strip().lstrip("*")))[0]] = digest.lower()
+    return checksums
+
+
+def load_records(audio_dir: str) -> dict:
+    path = os.path.join(audio_dir, RECORDS_FILE)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r") as fin:
+        return json.load(fin)
+
+
+def save_records(audio_dir: str, records: dict):
+    path = os.path.join(audio_dir, RECORDS_FILE)
+    with open(path + ".tmp", "w") as fout:
+        json.dump(records, fout, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def total_size(response) -> Optional[int]:
+    """The size of the whole file, from `Content-Range: bytes a-b/total` or else the `Content-Length`"""
+    content_range = response.headers.get("Content-Range")
+    if content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1].strip()
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length")
+    return int(length) if length is not None and length.isdigit() else None
+
+
+def remote_size(url: str, timeout: float) -> Optional[int]:
+    """The size of the file on the server, None if it can't be asked"""
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method="HEAD"), timeout=timeout) as response:
+            return total_size(response)
+    except (urllib.error.URLError, http.client.HTTPException, OSError):
+        return None
+
+
+def download(url: str, path: str, timeout: float = 60, retries: int = 5, backoff: float = 1.0) -> int:
+    """Downloads `url` to `path` through `{path}.part`, resuming what is already there, returns the size"""
+    part_path = path + ".part"
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as response:
+                resumed = offset and response.status == 206
+                total = total_size(response)
+                with open(part_path, "ab" if resumed else "wb") as fout:  # a server ignoring the range sends it all
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                        fout.write(chunk)
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and offset:  # nothing left after the offset: the part is whole, or not of this file
+                total = total_size(e)
+                if total != offset:
+                    os.remove(part_path)
+                    error = FetchError(f"{url}: the partial download is not of the current file, restarting")
+                    continue
+            elif e.code < 500 and e.code not in (408, 429):
+                raise FetchError(f"{url}: HTTP {e.code} {e.reason}") from e
+            else:
+                error = e
+                continue
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+            error = e  # e.g. the connection dropped, the next attempt resumes from what was written
+            continue
+
+        size = os.path.getsize(part_path)
+        if total is not None and size != total:
+            error = FetchError(f"{url}: got {size} of {total} bytes")
+            continue
+        os.replace(part_path, path)
+        return size
+    raise FetchError(f"{url}: failed after {retries + 1} attempts, last error: {error}")
+
+
+def ensure_mp3(
+    url: str, path: str, record: Optional[dict], expected: Optional[str], timeout: float, retries: int
+) -> Tuple[bool, dict]:
+    """
+    Makes sure `path` holds the whole recording, returns whether it was (re-)downloaded and its size and digest.
+        A file already there is kept if it matches its record (or `expected` digest); without either, e.g. from
+        the old download script, if it is as large as on the server.
+    """
+    if os.path.isfile(path):
+        size = os.path.getsize(path)
+        if record and record["size"] == size and expected in (None, record["sha256"]):
+            return False, record
+        if expected is not None:
+            digest = file_sha256(path)
+            if digest == expected:
+                return False, {"size": size, "sha256": digest}
+        elif record is None and remote_size(url, timeout) in (None, size):  # kept when offline
+            return False, {"size": size, "sha256": file_sha256(path)}
+        print(f"{os.path.basename(path)} is incomplete or changed, fetching it again", flush=True)
+        os.remove(path)
+
+    for _ in range(2):  # a mismatched digest may be a corrupted transfer, try once more from scratch
+        size = download(url, path, timeout, retries)
+        digest = file_sha256(path)
+        if expected in (None, digest):
+            return True, {"size": size, "sha256": digest}
+        os.remove(path)
+    raise FetchError(f"{url}: SHA-256 {digest} instead of {expected}")
+
+
+def transcode(mp3_path: str, wav_path: str, ffmpeg: str = "ffmpeg"):
+    """Converts to 16 bit, mono, 16K WAV, written next to `wav_path` and renamed once complete"""
+    tmp_path = wav_path[: -len(".wav")] + ".tmp.wav"
+    command = [ffmpeg, "-nostdin", "-loglevel", "error", "-y", "-i", mp3_path]
+    subprocess.run(command + ["-acodec", "pcm_s16le", "-ac", "1", "-ar", "16000", tmp_path], check=True)
+    os.replace(tmp_path, wav_path)
+
+
+def fetch_recordings(
+    names: list = RECORDINGS,
+    audio_dir: str = AUDIO_DIR,
+    base_url: str = BASE_URL,
+    downloads: int = 4,
+    jobs: int = None,
+    checksums: dict = None,
+    ffmpeg: str = "ffmpeg",
+    timeout: float = 60,
+    retries: int = 5,
+) -> list:
+    """Downloads and converts the recordings, returns the names of the ones that failed"""
+    os.makedirs(audio_dir, exist_ok=True)
+    records = load_records(audio_dir)
+    checksums = checksums or {}
+    failed = []
+    fetch_pool, transcode_pool = ThreadPoolExecutor(max(1, downloads)), ThreadPoolExecutor(max(1, jobs or default_jobs()))
+    with stage("fetch_audio", items=len(names)), fetch_pool, transcode_pool:
+        fetches = {
+            fetch_pool.submit(
+                ensure_mp3,
+                f"{base_url.rstrip('/')}/{name}.mp3",
+                os.path.join(audio_dir, f"{name}.mp3"),
+                records.get(name),
+                checksums.get(name),
+                timeout,
+                retries,
+            ): name
+            for name in names
+        }
+        transcodes = {}
+        for future in as_completed(fetches):
+            name = fetches[future]
+            try:
+                fetched, record = future.result()
+            except FetchError as e:
+                print(f"Could not download {name}: {e}", flush=True)
+                failed.append(name)
+                continue
+            if records.get(name) != record:  # untouched when nothing changed, so the next stages stay up to date
+                records[name] = record
+                save_records(audio_dir, records)
+            mp3_path, wav_path = os.path.join(audio_dir, f"{name}.mp3"), os.path.join(audio_dir, f"{name}.wav")
+            if fetched:
+                print(f"Downloaded {name}", flush=True)
+            if fetched or not os.path.isfile(wav_path):  # a new download replaces the WAV of the old one
+                transcodes[transcode_pool.submit(transcode, mp3_path, wav_path, ffmpeg)] = name
+
+        for future in as_completed(transcodes):
+            name = transcodes[future]
+            try:
+                future.result()
+                print(f"Converted {name} to wav", flush=True)
+            except (subprocess.CalledProcessError, OSError) as e:
+                print(f"Could not convert {name}: {e}", flush=True)
+                failed.append(name)
+    return sorted(failed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recordings", nargs="*", default=RECORDINGS, help="the recordings to fetch, all of them by default")
+    parser.add_argument("--audio-dir", default=AUDIO_DIR)
+    parser.add_argument("--base-url", default=BASE_URL, help="where the `{recording}.mp3` files are served")
+    parser.add_argument("--downloads", type=int, default=4, help="number of downloads at once")
+    parser.add_argument("--jobs", type=int, default=default_jobs(), help="number of conversions to WAV at once")
+    parser.add_argument("--checksums", default=None, help="`sha256sum` output of the expected mp3 files")
+    parser.add_argument("--ffmpeg", default="ffmpeg")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds without data before a download is retried")
+    parser.add_argument("--retries", type=int, default=5, help="retries of a download, each resuming the last")
+    args = parser.parse_args()
+
+    failed = fetch_recordings(
+        args.recordings,
+        args.audio_dir,
+        args.base_url,
+        args.downloads,
+        args.jobs,
+        read_checksums(args.checksums) if args.checksums else None,
+        args.ffmpeg,
+        args.timeout,
+        args.retries,
+    )
+    if failed:
+        sys.exit(f"Failed: {', '.join(failed)}, rerun to resume")
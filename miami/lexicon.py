@@ -0,0 +1,56 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# A lexicon of common Spanish/English words, used to tag the words that are not annotated in the CHAT files
+from typing import Iterable
+
+DEFAULT_SPANISH_PATHS = ("common_words/spa.txt",)
+DEFAULT_ENGLISH_PATHS = ("common_words/eng.txt",)
+
+
+def read_word_list(path: str) -> list:
+    words = []
+    with open(path, "r") as fin:
+        for line in fin:
+            words.append(line.strip())
+    return words
+
+
+class WordLexicon:
+    """
+    Frozen sets of common words per language. Words in both lists (like internet, etc.) are only
+        kept as English. It is cheap to pickle, so it can be handed to worker processes once.
+    """
+
+    def __init__(self, spanish_words: Iterable[str], english_words: Iterable[str]):
+        self.all_spanish_words = frozenset(spanish_words)
+        self.english_words = frozenset(english_words)
+        self.spanish_words = self.all_spanish_words - self.english_words
+
+    @classmethod
+    def from_files(
+        cls,
+        spanish_paths: Iterable[str] = DEFAULT_SPANISH_PATHS,
+        english_paths: Iterable[str] = DEFAULT_ENGLISH_PATHS,
+    ) -> "WordLexicon":
+        spanish_words = [word for path in spanish_paths for word in read_word_list(path)]
+        english_words = [word for path in english_paths for word in read_word_list(path)]
+        return cls(spanish_words, english_words)
+
+    def extend(
+        self, spanish_words: Iterable[str] = (), english_words: Iterable[str] = ()
+    ) -> "WordLexicon":
+        """Returns a new lexicon with extra words, e.g. from bigger frequency lists"""
+        return WordLexicon(
+            self.all_spanish_words.union(spanish_words),
+            self.english_words.union(english_words),
+        )
+
+    def tag(self, word: str, default_lang: str) -> str:
+        if word in self.spanish_words:
+            return "spa"
+        elif word in self.english_words:
+            return "eng"
+        return default_lang
@@ -4,20 +4,25 @@
 #
 
 # This file processes the Miami dataset into CS and monolingual test sets
-import re
 import os
+import sys
 import glob
-import pylangacq
-import librosa
-import yaml
-import json
+import struct
+import argparse
+import functools
+from multiprocessing import Pool
+import numpy as np
 import soundfile as sf
-import string
 from tqdm import tqdm
-import random
-from nltk.tokenize.treebank import TreebankWordDetokenizer
+from lexicon import WordLexicon, DEFAULT_SPANISH_PATHS, DEFAULT_ENGLISH_PATHS
+from text_normalizer import NORMALIZER, remove_punct
+from chat_reader import ChatReader, ChatUtterance
 
-DETOKENIZER = TreebankWordDetokenizer()
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # for `cs_data`
+from cs_data.manifest import write_split
+from cs_data.profiling import stage
+from cs_data.jobs import default_jobs
+from cs_data.statistics import STATISTICS_FILE, CorpusStatistics, recording_name, utterance_values
 
 ONE_SECOND = 16000
 
@@ -45,11 +50,22 @@ MAP_FOR_WORD_PREDS = {
 }
 
 
-##### simple string cleaning functions #####
-def remove_punct(s: str) -> str:
-    return s.translate(str.maketrans("", "", string.punctuation))
+# loaded once per process, see `get_lexicon`
+LEXICON = None
+
+
+def set_lexicon(lexicon: WordLexicon):
+    global LEXICON
+    LEXICON = lexicon
 
 
+def get_lexicon() -> WordLexicon:
+    if LEXICON is None:
+        set_lexicon(WordLexicon.from_files())
+    return LEXICON
+
+
+##### simple string cleaning functions #####
 def verify_text(text: str):
     illegal_chars = ["[", "]", "(", ")", "/", "+", "&"]
     for char in illegal_chars:
@@ -57,146 +73,14 @@ def verify_text(text: str):
             raise Exception("had illegal char", char, text)
 
 
-def remove_leading_spaces_punct(sent: list) -> str:
-    new_sent = DETOKENIZER.detokenize(sent)
-    # doesn't get second sentence
-    if " ." in new_sent:
-        new_sent = new_sent.replace(" .", ".")
-    if " ?" in new_sent:
-        new_sent = new_sent.replace(" ?", "?")
-    if " ," in new_sent:
-        new_sent = new_sent.replace(" ,", ",")
-    return new_sent
-
-
-def clean_underscores(sent: str) -> str:
-    if "o_k" in sent:  # don't want to remove for o_k
-        sent = sent.replace("o_k", "ok")
-
-    new_sent = sent.replace("_", " ")
-    return new_sent
-
-
-def clean_up_common_markup_errors(sent: str) -> str:
-    all_chars_to_replace = [
-        "(.)",
-        "(..)",
-        "+//",
-        "<",
-        ">",
-        "+/.",
-        "+/?",
-        "/",
-        "...",
-        "..",
-        "++",
-        "+/",
-        "xxx",
-        "+",
-        '+"',
-        "+,",
-        "[",
-        "]",
-        "“",
-    ]
-    for char_phrase in all_chars_to_replace:
-        sent = sent.replace(char_phrase, "")
-
-    if '".' in sent:
-        sent.replace('".', ".")
-    if ":." in sent:
-        sent.replace(":.", ".")
-
-    if "@s:eng&spa" in sent:
-        sent = sent.replace("@s:eng&spa", "")
-
-    if re.search('".*"', sent) is None:
-        sent = sent.replace('"', "")
-    return sent
-
-
-def clean_translation(text: str) -> str:
-    text = clean_word_text(text)
-    text = [word for word in re.sub(r"\([^)]*\)", "", text).split(" ") if word != ""]
-    text = remove_leading_spaces_punct(text)
-    return text
-
-
-def clean_word_text(transcript):
-    transcript = clean_up_common_markup_errors(transcript)
-    detokenized_transcript = remove_leading_spaces_punct(transcript.split(" "))
-    clean_sent = clean_underscores(detokenized_transcript)
-
-    if len(transcript) and transcript[0] == ",":
-        transcript = transcript[1:]
-
-    return clean_sent
-
-
-def make_transcript_manually(raw_utt: str) -> str:
-    """
-    Some of the utterances have disfluencies, which the pylangacq software excludes from the transcript
-        Thus, we have to manually take the raw utterance transcription in CHAT form to keep them
-    """
-    filter_raw_utt = raw_utt.replace("<", "").replace(">", "")
-    only_words = filter_raw_utt.split(" ")[:-1]  # last one is timing
-    new_words = []
-    for word in only_words:
-        # words to replace
-        if "@" in word:
-            word = word[: word.find("@")]  # annotation for code-switching
-
-        if not len(word):
-            continue
-
-        if word[0] == "[" or word[-1] == "]":
-            continue  # don't need the markup
-
-        if word[0] == "&":
-            continue  # don't need partial starts
-
-        word = clean_up_common_markup_errors(word)
-        if len(word) == 0:
-            continue
-
-        if "+//." in word:
-            word = word.replace("+//.", ".")
-        if '".' in word:
-            word = word.replace('".', ".")
-
-        if "(" in word or ")" in word:
-            # NOTE: this is whether we remove parantheticals
-            word = re.sub(r"\([^)]*\)", "", word)
-
-        new_words.append(word)
-
-    detokenized_sent = remove_leading_spaces_punct(new_words)
-    clean_sent = clean_underscores(detokenized_sent)
-    return clean_sent
-
-
-def gather_cs_statistics_and_words(utterance, raw_utt: str, transcript: str, file_lang: list, cur_lang: str):
+def gather_cs_statistics_and_words(utterance: ChatUtterance, raw_utt: str, transcript: str, file_lang: list, cur_lang: str, lexicon: WordLexicon = None):
     # for tagging each word, use a list of most common words
-    common_spanish_words = []
-    with open("common_words/spa.txt", "r") as fin:
-        for line in fin:
-            common_spanish_words.append(line.strip())
-
-    common_english_words = []
-    with open("common_words/eng.txt", "r") as fin:
-        for line in fin:
-            common_english_words.append(line.strip())
-
-    # words like internet, etc.
-    common_spanish_words = list(
-        set(common_spanish_words)
-        - set(common_english_words).intersection(set(common_spanish_words))
-    )
+    if lexicon is None:
+        lexicon = get_lexicon()
 
-    def get_lang_id(input_word): # parse the CHAT language id
-        word = input_word.split("@")[1]
+    def get_lang_id(mark): # parse the CHAT language id
         word = (
-            word.replace(">", "")
+            mark.replace(">", "")
             .replace("[/]", "")
             .replace('"', "")
             .replace("”", "")
@@ -206,14 +90,8 @@ def gather_cs_statistics_and_words(utterance, raw_utt: str, transcript: str, fil
         )
         return LANG_MAP[word]
 
-    eng = (
-        utterance.tiers["%eng"] if "%eng" in utterance.tiers else None
-    )  # English translation
-    word_to_lang_map = [
-        (word.split("@")[0], get_lang_id(word))
-        for word in raw_utt.split(" ")
-        if "@" in word
-    ]
+    eng = utterance.tiers.get("%eng")  # English translation
+    word_to_lang_map = [(word, get_lang_id(mark)) for word, mark in utterance.language_marks]
     is_cs = any(
         ["unknown" not in lang for (_, lang) in word_to_lang_map]
     )  # any not unknown is code-switched
@@ -237,7 +115,7 @@ def gather_cs_statistics_and_words(utterance, raw_utt: str, transcript: str, fil
     # lets try to get word level tags for CS data. We have to do this manually parsing the sentence
     clean_transcript = remove_punct(transcript)
     cs_words = [
-        remove_punct(clean_word_text(word))
+        remove_punct(NORMALIZER.clean_transcript(word))
         for (word, lang) in word_to_lang_map
         if "unknown" not in lang
     ]
@@ -259,45 +137,189 @@ def gather_cs_statistics_and_words(utterance, raw_utt: str, transcript: str, fil
     if "[- eng]" in raw_utt or "[-eng]" in raw_utt:
         main_lang, embedded_lang = "eng", "spa"
 
+    cs_word_to_lang = {}
+    for cs_word, lang in zip(cs_words, cs_words_lang):
+        cs_word_to_lang.setdefault(cs_word, lang)  # the first annotation wins
+
     for word in clean_transcript.split(" "):
-        if word in cs_words: # first see if they were annotated
-            index = cs_words.index(word)
-            annote_lang = MAP_FOR_WORD_PREDS[cs_words_lang[index]]
+        if word in cs_word_to_lang: # first see if they were annotated
+            annote_lang = MAP_FOR_WORD_PREDS[cs_word_to_lang[word]]
             tagged_words += f"{word}={embedded_lang} "
         else: # try to rely on the backup common words if they're not annotated
-            if word in common_spanish_words:
-                tagged_words += f"{word}=spa "
-            elif word in common_english_words:
-                tagged_words += f"{word}=eng "
-            else:
-                tagged_words += f"{word}={main_lang} "
+            tagged_words += f"{word}={lexicon.tag(word, main_lang)} "
 
     tagged_words = tagged_words.strip()
     return tagged_words, eng, cs_percent, is_cs, is_cs_any
         
 
 
-def write_out(final_path, all_segments, all_transcripts, all_translations):
-    with open(os.path.join(final_path, f"miami.yaml"), "w") as fout:
-        fout.write(yaml.dump(all_segments, allow_unicode=True))
-
-    with open(os.path.join(final_path, f"miami.transcript"), "w") as fout:
-        for line in all_transcripts:
-            fout.write(line)
-            fout.write("\n")
+def write_out(final_path, all_segments, all_transcripts, all_translations, export_yaml: bool = True):
+    write_split(
+        final_path,
+        "miami",
+        all_segments,
+        all_transcripts,
+        all_translations,
+        export_yaml=export_yaml,
+        export_jsonl=export_yaml,
+        allow_unicode=True,
+    )
 
-    with open(os.path.join(final_path, f"miami.translation"), "w") as fout:
-        for line in all_translations:
-            fout.write(line)
-            fout.write("\n")
 
-    with open(os.path.join(final_path, f"miami.jsonl"), "w") as fout:
-        for segment in all_segments:
-            fout.write(json.dumps(segment))
-            fout.write("\n")
+def read_wav_memmap(wav_path: str) -> np.memmap:
+    """Memory-maps the PCM samples of a 16khz/16bit/mono wav file, without decoding or resampling it"""
+    info = sf.info(wav_path)
+    assert info.samplerate == ONE_SECOND and info.channels == 1, f"{wav_path} is not 16khz mono"
+    assert info.subtype == "PCM_16", f"{wav_path} is not 16bit PCM"
+    with open(wav_path, "rb") as fin:
+        riff, _, wave = struct.unpack("<4sI4s", fin.read(12))
+        assert riff == b"RIFF" and wave == b"WAVE", f"{wav_path} is not a wav file"
+        while True:
+            chunk_id, chunk_size = struct.unpack("<4sI", fin.read(8))
+            if chunk_id == b"data":
+                data_offset = fin.tell()
+                break
+            fin.seek(chunk_size + (chunk_size & 1), 1)  # chunks are word aligned
+    return np.memmap(wav_path, dtype="<i2", mode="r", offset=data_offset, shape=(info.frames,))
+
+
+def segment_statistics(segments: list, transcripts: list, split: str = "all") -> CorpusStatistics:
+    """The statistics of a file's segments, per speaker and recording"""
+    statistics = CorpusStatistics()
+    for segment, transcript in zip(segments, transcripts):
+        values = utterance_values({**segment, "transcript": transcript})
+        statistics.add(split, values, segment["code_switched"], segment["speaker_id"], recording_name(segment))
+    return statistics
+
+
+def process_chat_file(chat_file_path: str, final_path: str):
+    """Processes one CHAT file and its recording, returns the segments, transcripts, translations and statistics"""
+    all_segments = []
+    all_transcripts = []
+    raw_translations = []
+
+    clip_name = chat_file_path.split("/")[-1].replace(".cha", "")
+    # parses the utterances as pylangacq did, one at a time
+    cur_reader = ChatReader(chat_file_path)
+    file_lang = cur_reader.languages
+
+    # get wav data, already at 16khz/16bit/mono
+    wav_path = chat_file_path.replace("beta", "audio").replace("cha", "wav")
+    wav_data = read_wav_memmap(wav_path)
+
+    for utterance in cur_reader:
+        idx = utterance.idx
+        word_utterance = utterance.words
+        transcript = " ".join(word_utterance)
+        if not len(transcript):
+            continue
+        transcript = NORMALIZER.clean_transcript(transcript)
+        raw_utt = utterance.main
+
+        # the main language can be overriden if marked that way
+        if "[- eng]" in raw_utt or "[-eng]" in raw_utt:
+            cur_lang = "eng"
+        elif "[- spa]" in raw_utt or "[-spa]" in raw_utt:
+            cur_lang = "spa"
+        else:
+            cur_lang = file_lang[0]
+
+        ## Check if we really want to keep cleaning this utterance ##
+        if "www" in raw_utt:
+            continue  # means untranscribed text, skip
+        if word_utterance == ["."]:
+            continue  # we don't want empty lines
+
+        if "[" in raw_utt:  # some markup to deal with
+            # see https://talkbank.org/manuals/CHAT.pdf for details
+            for mark in utterance.markups:
+                if mark in [
+                    "[!]",
+                    "[?]",
+                    "[!!]",
+                    "[*]",
+                    "[/-]",
+                    "[//]",
+                    '["]',
+                ] or mark in ["[- spa]", "[-spa]", "[-eng]", "[- eng]"]:
+                    """
+                    Markup definitions that we can skip/remove for ST purposes:
+                        [!] means stressing
+                        [!!] means constrastive stressing
+                        [?] means uncertainty in transcription, but best guess
+                        [=! ...] is some kind of para-linguistic communication, laugh, yell, etc.
+                        [# ...] indicates duration of previous <> tag
+                        [*] means the word is incorrect semantically/grammatically, typically followed by the [* correct_word]
+                        [/-] is for false starts but still spoken
+                        [//] for abandended and retracing speech
+
+                    """
+                    continue
+                elif "[=!" in mark or "[= !" in mark or "[*" in mark:  # see above
+                    continue
+                elif mark in ["[/]", "[//]", "[///]"]:
+                    # indicates trailing or correction while speaking, the words leave them out (as pylangacq did), do it manually
+                    if raw_utt is None:
+                        continue
+                    transcript = NORMALIZER.transcript_from_raw(raw_utt)
+                    break
+                else:
+                    raise Exception(f"Encountered new mark {mark}")
+
+        time_marks = utterance.time_marks
+        if time_marks is None:
+            continue  # don't know why there are no time marks, but skip.
+            # Happens appx 3 times outside of maria18.cha where there are ~20 instances
+
+        # get the audio clip and validate it
+        start_time, end_time = time_marks
+        start_time_s, end_time_s = start_time / 1000, end_time / 1000
+        duration_s = end_time_s - start_time_s
+        # same float samples as a (non-resampling) librosa.load would give
+        wav_clip = wav_data[
+            int(start_time_s * ONE_SECOND) : int(end_time_s * ONE_SECOND)
+        ].astype(np.float32) / 32768
+        if int(end_time_s * ONE_SECOND) < wav_data.shape[0]:
+            # sometimes audio may go beyond the file length, which we allow
+            error_str = f"Wav Clip:{wav_clip.shape[0]} vs duration:{duration_s * ONE_SECOND}"
+            assert (duration_s * ONE_SECOND - wav_clip.shape[0]) < 1, error_str
+
+        cur_clip_name = clip_name + "_p" + str(idx)
+        clip_path = os.path.join("clips", cur_clip_name + ".wav")
+        sf.write(os.path.join(final_path, clip_path), wav_clip, ONE_SECOND)
+
+        # for LID and statistics, gather the lang id for each word
+        tagged_words, eng, cs_percent, is_cs, is_cs_any = gather_cs_statistics_and_words(utterance, raw_utt, transcript, file_lang, cur_lang)
+        speakers = utterance.participant # just in case it's needed someday for speaker ID
+
+        all_segments.append(
+            {
+                "wav": clip_path,
+                "offset": start_time_s,
+                "duration": duration_s,
+                "cs_percent": cs_percent,
+                "speaker_id": speakers,
+                "code_switched": is_cs,
+                "main_lang": cur_lang,
+                "code_switched_any": is_cs_any,
+                "tagged_words": tagged_words,
+            }
+        )
+        assert transcript is not None
+        verify_text(transcript)
+        all_transcripts.append(transcript)
+        raw_translations.append(eng)
+        assert len(all_transcripts) == len(all_segments) == len(raw_translations)
+
+    # clean all of the file's translations at once
+    all_translations = NORMALIZER.clean_translations(raw_translations)
+    for translation in all_translations:
+        verify_text(translation)
+    assert len(all_transcripts) == len(all_segments) == len(all_translations)
+    return all_segments, all_transcripts, all_translations, segment_statistics(all_segments, all_transcripts)
 
 
-def prepare_miami_data():
+def prepare_miami_data(jobs: int = 1, lexicon: WordLexicon = None, export_yaml: bool = True):
     all_segments = []
     all_transcripts = []
     all_translations = []
@@ -307,132 +329,41 @@ def prepare_miami_data():
         os.makedirs(os.path.join(final_path, "clips"))
 
     chat_file_location = "data/miami/beta"  # beta has the most up to date
-    for chat_file_path in tqdm(
-        glob.glob(os.path.join(chat_file_location, "*.cha")), leave=True
-    ):
-        clip_name = chat_file_path.split("/")[-1].replace(".cha", "")
-        cur_reader = pylangacq.read_chat(chat_file_path)
-        all_words = cur_reader.words(by_utterances=True)
-        assert len(cur_reader._files) == 1
-        file_lang = cur_reader._files[0].header["Languages"]
-
-        # get wav data
-        wav_path = chat_file_path.replace("beta", "audio").replace("cha", "wav")
-        wav_data, sampling_rate = librosa.load(
-            wav_path, sr=ONE_SECOND
-        )  # already at 16khz/16bit/mono
-        assert sampling_rate == ONE_SECOND
-
-        for idx, utterance in enumerate(cur_reader.utterances()):
-            word_utterance = all_words[idx]
-            transcript = " ".join(word_utterance)
-            if not len(transcript):
-                continue
-            transcript = clean_word_text(transcript)
-            raw_utt = utterance.tiers[utterance.participant]
-
-            # the main language can be overriden if marked that way
-            if "[- eng]" in raw_utt or "[-eng]" in raw_utt:
-                cur_lang = "eng"
-            elif "[- spa]" in raw_utt or "[-spa]" in raw_utt:
-                cur_lang = "spa"
-            else:
-                cur_lang = file_lang[0]
-
-            ## Check if we really want to keep cleaning this utterance ##
-            if "www" in raw_utt:
-                continue  # means untranscribed text, skip
-            if word_utterance == ["."]:
-                continue  # we don't want empty lines
-
-            if "[" in raw_utt:  # some markup to deal with
-                # see https://talkbank.org/manuals/CHAT.pdf for details
-                markings = re.findall("\[.*?\]", raw_utt)
-                for mark in markings:
-                    if mark in [
-                        "[!]",
-                        "[?]",
-                        "[!!]",
-                        "[*]",
-                        "[/-]",
-                        "[//]",
-                        '["]',
-                    ] or mark in ["[- spa]", "[-spa]", "[-eng]", "[- eng]"]:
-                        """
-                        Markup definitions that we can skip/remove for ST purposes:
-                            [!] means stressing
-                            [!!] means constrastive stressing
-                            [?] means uncertainty in transcription, but best guess
-                            [=! ...] is some kind of para-linguistic communication, laugh, yell, etc.
-                            [# ...] indicates duration of previous <> tag
-                            [*] means the word is incorrect semantically/grammatically, typically followed by the [* correct_word]
-                            [/-] is for false starts but still spoken
-                            [//] for abandended and retracing speech
-
-                        """
-                        continue
-                    elif "[=!" in mark or "[= !" in mark or "[*" in mark:  # see above
-                        continue
-                    elif mark in ["[/]", "[//]", "[///]"]:
-                        # indicates trailing or correction while speaking, pylangacq gets rid of them, do it manually
-                        if raw_utt is None:
-                            continue
-                        transcript = make_transcript_manually(raw_utt)
-                        break
-                    else:
-                        raise Exception(f"Encountered new mark {mark}")
-
-            time_marks = utterance.time_marks
-            if time_marks is None:
-                continue  # don't know why there are no time marks, but skip.
-                # Happens appx 3 times outside of maria18.cha where there are ~20 instances
-
-            # get the audio clip and validate it
-            start_time, end_time = time_marks
-            start_time_s, end_time_s = start_time / 1000, end_time / 1000
-            duration_s = end_time_s - start_time_s
-            wav_clip = wav_data[
-                int(start_time_s * ONE_SECOND) : int(end_time_s * ONE_SECOND)
-            ]
-            if int(end_time_s * ONE_SECOND) < wav_data.shape[0]:
-                # sometimes audio may go beyond the file length, which we allow
-                error_str = f"Wav Clip:{wav_clip.shape[0]} vs duration:{duration_s * ONE_SECOND}"
-                assert (duration_s * ONE_SECOND - wav_clip.shape[0]) < 1, error_str
-
-            cur_clip_name = clip_name + "_p" + str(idx)
-            clip_path = os.path.join("clips", cur_clip_name + ".wav")
-            sf.write(os.path.join(final_path, clip_path), wav_clip, ONE_SECOND)
-
-            # for LID and statistics, gather the lang id for each word
-            tagged_words, eng, cs_percent, is_cs, is_cs_any = gather_cs_statistics_and_words(utterance, raw_utt, transcript, file_lang, cur_lang)
-            speakers = utterance.participant # just in case it's needed someday for speaker ID
-
-            all_segments.append(
-                {
-                    "wav": clip_path,
-                    "offset": start_time_s,
-                    "duration": duration_s,
-                    "cs_percent": cs_percent,
-                    "speaker_id": speakers,
-                    "code_switched": is_cs,
-                    "main_lang": cur_lang,
-                    "code_switched_any": is_cs_any,
-                    "tagged_words": tagged_words,
-                }
-            )
-            translation = clean_translation(eng) if eng is not None else ""
-            assert transcript is not None
-            
-            # validate the sentences
-            verify_text(transcript)
-            verify_text(translation)
-            all_transcripts.append(transcript)
-            all_translations.append(translation)
-            assert len(all_transcripts) == len(all_segments) == len(all_translations)
-        assert len(all_transcripts) == len(all_segments) == len(all_translations)
+    chat_file_paths = glob.glob(os.path.join(chat_file_location, "*.cha"))
+    if lexicon is None:
+        lexicon = get_lexicon()
+    set_lexicon(lexicon)
+
+    process_file = functools.partial(process_chat_file, final_path=final_path)
+    with stage("process_chat_files", items=len(chat_file_paths)):
+        if jobs > 1:
+            # one CHAT/wav pair per worker, results come back in the original file order
+            with Pool(jobs, initializer=set_lexicon, initargs=(lexicon,)) as pool:
+                results = list(tqdm(pool.imap(process_file, chat_file_paths), total=len(chat_file_paths), leave=True))
+        else:
+            results = [process_file(path) for path in tqdm(chat_file_paths, leave=True)]
+
+    statistics = CorpusStatistics()
+    for segments, transcripts, translations, file_statistics in results:
+        all_segments.extend(segments)
+        all_transcripts.extend(transcripts)
+        all_translations.extend(translations)
+        statistics.merge(file_statistics)
     assert len(all_transcripts) == len(all_segments) == len(all_translations)
-    write_out(final_path, all_segments, all_transcripts, all_translations)
+    write_out(final_path, all_segments, all_transcripts, all_translations, export_yaml)
+    statistics.save(os.path.join(final_path, STATISTICS_FILE))
+    statistics.print_summary()
 
 
 if __name__ == "__main__":
-    prepare_miami_data()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=default_jobs(), help="number of CHAT files processed in parallel, 1 to run serially")
+    parser.add_argument("--spanish-words", nargs="*", default=[], help="extra Spanish word lists, one word per line")
+    parser.add_argument("--english-words", nargs="*", default=[], help="extra English word lists, one word per line")
+    parser.add_argument("--no-yaml", action="store_true", help="only write the manifest, without the YAML/JSONL exports")
+    args = parser.parse_args()
+    lexicon = WordLexicon.from_files(
+        list(DEFAULT_SPANISH_PATHS) + args.spanish_words,
+        list(DEFAULT_ENGLISH_PATHS) + args.english_words,
+    )
+    prepare_miami_data(args.jobs, lexicon, not args.no_yaml)
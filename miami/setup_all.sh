@@ -4,10 +4,25 @@
 #
 
 # this script should set everything up
-mkdir output
-mkdir output/miami
-mkdir data
+# every stage is skipped when its inputs are unchanged since its last run (see `cs_data/stage_cache.py`)
+# and run as a dependency graph with the Fisher stages from `create_datasets.sh` (see `cs_data/scheduler.py`)
+export PYTHONPATH="$(cd .. && pwd)${PYTHONPATH:+:$PYTHONPATH}"
+stage() { python -m cs_data.stage_cache run "$@"; }
+mkdir -p output/miami
+mkdir -p data
 
-bash download_miami_data.sh
-python process_miami_data.py
-python create_test_sets.py
+# always run, it skips the files it already has
+stage --name miami_download --force --cpus 25% --io 1 --outputs data/miami/beta data/miami/audio -- bash download_miami_data.sh
+stage --name miami_all --cpus 50% --inputs data/miami/beta data/miami/audio common_words lexicon.py text_normalizer.py ../cs_data \
+  --outputs output/miami/all -- python process_miami_data.py
+stage --name miami_splits --inputs output/miami/all ../cs_data --param seed=1 \
+  --outputs output/miami/cs output/miami/mono output/miami/mono_train miami_mapping.csv \
+  -- python create_test_sets.py
+# the statistics of every split (CS ratio, switches, duration..., see `cs_data/statistics.py`)
+stage --name statistics --inputs output/miami ../cs_data --outputs output/statistics.json \
+  -- python -m cs_data.statistics --search output/miami --output output/statistics.json
+# optional: precompute the log-mel features of every split's clips into `output/features` (see `cs_data/features.py`)
+if [ -n "${CS_DATA_FEATURES}" ]; then
+  stage --name features --cpus all --inputs output/miami ../cs_data --outputs output/features \
+    -- python -m cs_data.features --search output/miami
+fi
@@ -0,0 +1,135 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Cleans the CHAT markup out of transcripts and translations
+import re
+import string
+import functools
+from typing import List, Optional
+from nltk.tokenize.treebank import TreebankWordDetokenizer
+
+DETOKENIZER = TreebankWordDetokenizer()
+
+# removed in this order, so markup uncovered by one removal can be caught by a later one
+MARKUP_TO_REMOVE = [
+    "(.)",
+    "(..)",
+    "+//",
+    "<",
+    ">",
+    "+/.",
+    "+/?",
+    "/",
+    "...",
+    "..",
+    "++",
+    "+/",
+    "xxx",
+    "+",
+    '+"',
+    "+,",
+    "[",
+    "]",
+    "“",
+]
+
+# Every piece of markup above is made of these characters, and none of the other characters are ever
+# removed, so each maximal run of them can be cleaned on its own. Single characters that no markup
+# removes on their own (like a full stop or the x in a word) are left to the regex to skip.
+MARKUP_RUN = re.compile(r"[().+/<>?\[\]“x]{2,}|[+/<>\[\]“]")
+LANGUAGE_MARKUP = re.compile(re.escape("@s:eng&spa"))
+QUOTED = re.compile('".*"')
+PARENTHETICAL = re.compile(r"\([^)]*\)")
+WHITESPACE = re.compile(r"\s")
+SPACE_BEFORE_PUNCT = re.compile(r" ([.?,])")
+UNDERSCORES = re.compile("o_k|_")  # don't want to remove for o_k
+PUNCT_TABLE = str.maketrans("", "", string.punctuation)
+
+
+@functools.lru_cache(maxsize=None)
+def clean_markup_run(run: str) -> str:
+    for char_phrase in MARKUP_TO_REMOVE:
+        run = run.replace(char_phrase, "")
+    return run
+
+
+def remove_punct(s: str) -> str:
+    return s.translate(PUNCT_TABLE)
+
+
+class ChatTextNormalizer:
+    """
+    Cleans CHAT markup with one regex pass per string. Produces the same output as the
+        replace chains it replaced, see `verify_text_normalizer.py`.
+    """
+
+    def clean_markup(self, sent: str) -> str:
+        sent = MARKUP_RUN.sub(lambda match: clean_markup_run(match.group()), sent)
+        sent = LANGUAGE_MARKUP.sub("", sent)
+        if QUOTED.search(sent) is None:
+            sent = sent.replace('"', "")
+        return sent
+
+    def detokenize(self, sent: str) -> str:
+        """Detokenizes a space separated sentence and removes the spaces before punctuation"""
+        if WHITESPACE.search(sent) is None:
+            # a single token, the only Treebank rules that apply are the quote conversions
+            return sent.replace("''", '"').replace("``", '"')
+        return SPACE_BEFORE_PUNCT.sub(r"\1", DETOKENIZER.detokenize([sent]))
+
+    def clean_underscores(self, sent: str) -> str:
+        return UNDERSCORES.sub(lambda match: "ok" if match.group() == "o_k" else " ", sent)
+
+    def clean_transcript(self, transcript: str) -> str:
+        return self.clean_underscores(self.detokenize(self.clean_markup(transcript)))
+
+    def clean_translation(self, text: str) -> str:
+        text = self.clean_transcript(text)
+        text = " ".join(word for word in PARENTHETICAL.sub("", text).split(" ") if word != "")
+        return self.detokenize(text)
+
+    def transcript_from_raw(self, raw_utt: str) -> str:
+        """
+        Some of the utterances have disfluencies, which the pylangacq software excludes from the transcript
+            Thus, we have to manually take the raw utterance transcription in CHAT form to keep them
+        """
+        only_words = raw_utt.replace("<", "").replace(">", "").split(" ")[:-1]  # last one is timing
+        new_words = []
+        for word in only_words:
+            if "@" in word:
+                word = word[: word.find("@")]  # annotation for code-switching
+
+            if not len(word):
+                continue
+            if word[0] == "[" or word[-1] == "]":
+                continue  # don't need the markup
+            if word[0] == "&":
+                continue  # don't need partial starts
+
+            word = self.clean_markup(word)
+            if len(word) == 0:
+                continue
+
+            word = word.replace('".', ".")
+            if "(" in word or ")" in word:
+                # NOTE: this is whether we remove parantheticals
+                word = PARENTHETICAL.sub("", word)
+            new_words.append(word)
+
+        return self.clean_underscores(self.detokenize(" ".join(new_words)))
+
+    ##### batch versions, for cleaning whole files/corpora at once #####
+    def clean_transcripts(self, transcripts: List[str]) -> List[str]:
+        return [self.clean_transcript(transcript) for transcript in transcripts]
+
+    def clean_translations(self, texts: List[Optional[str]]) -> List[str]:
+        """Missing translations (None) become empty strings"""
+        return [self.clean_translation(text) if text is not None else "" for text in texts]
+
+    def transcripts_from_raw(self, raw_utts: List[str]) -> List[str]:
+        return [self.transcript_from_raw(raw_utt) for raw_utt in raw_utts]
+
+
+NORMALIZER = ChatTextNormalizer()
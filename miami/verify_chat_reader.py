@@ -0,0 +1,56 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Golden check for `chat_reader.py`: reads every Miami CHAT file with pylangacq 0.15, as the processing did before
+# (the reference), and with the reader, and fails if any utterance's participant, tiers, time marks or words or a
+# file's languages differ. Also prints the time each took.
+import os
+import sys
+import glob
+import time
+import pylangacq
+from tqdm import tqdm
+from chat_reader import ChatReader
+
+
+def verify_chat_reader(chat_file_location: str = "data/miami/beta") -> int:
+    num_checked = 0
+    num_failed = 0
+    reference_time = reader_time = 0.0
+    for chat_file_path in tqdm(sorted(glob.glob(os.path.join(chat_file_location, "*.cha"))), leave=True):
+        start = time.perf_counter()
+        reference = pylangacq.Reader.from_files([chat_file_path], parallel=False)
+        all_words = reference.words(by_utterances=True)
+        utterances = reference.utterances()
+        languages = reference._files[0].header.get("Languages")
+        reference_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        reader = ChatReader(chat_file_path)
+        records = list(reader)
+        reader_time += time.perf_counter() - start
+
+        if reader.languages != (languages or []):
+            num_failed += 1
+            print(f"{chat_file_path}: languages {reader.languages} instead of {languages}")
+        if len(records) != len(utterances):
+            num_failed += 1
+            print(f"{chat_file_path}: {len(records)} utterances instead of {len(utterances)}")
+            continue
+        for idx, (record, utterance, words) in enumerate(zip(records, utterances, all_words)):
+            num_checked += 1
+            expected = (utterance.participant, utterance.tiers, utterance.time_marks, words)
+            got = (record.participant, record.tiers, record.time_marks, record.words)
+            if expected != got:
+                num_failed += 1
+                print(f"{chat_file_path}:{idx} {record.main!r}: expected {expected!r}, got {got!r}")
+
+    print(f"Checked {num_checked} utterances, {num_failed} differ")
+    print(f"pylangacq took {reference_time:.2f}s, the reader {reader_time:.2f}s")
+    return num_failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if verify_chat_reader() else 0)
@@ -0,0 +1,125 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Check of `fetch_miami_audio.py` against a local stand-in of the recordings server, offline: the server
+# supports range requests and cuts the first transfer of every file short, so each download has to resume, and
+# a stand-in converter copies the mp3 to the WAV. Fails if a file is not fetched whole, if the downloads did not
+# resume, if a truncated file from an older run is kept, or if a rerun fetches anything again.
+import os
+import sys
+import random
+import hashlib
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fetch_miami_audio import fetch_recordings
+
+NUM_RECORDINGS = 6
+FAKE_FFMPEG = "import shutil, sys\nshutil.copyfile(sys.argv[sys.argv.index('-i') + 1], sys.argv[-1])\n"
+
+
+class RecordingsHandler(BaseHTTPRequestHandler):
+    """Serves `server.files` with range requests, cutting the first GET of each file at half of its bytes"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_file(body=False)
+
+    def do_GET(self):
+        self.send_file(body=True)
+
+    def send_file(self, body: bool):
+        name = self.path.strip("/")
+        server = self.server
+        if name not in server.files:
+            self.send_error(404)
+            return
+        data = server.files[name]
+        start = 0
+        if self.headers.get("Range"):
+            start = int(self.headers["Range"].split("=")[1].split("-")[0])
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data) - start))
+        self.end_headers()
+        if not body:
+            return
+        with server.lock:
+            server.requests.append((name, start))
+            cut = name not in server.cut
+            server.cut.add(name)
+        # the first transfer stops halfway, with the connection closed
+        self.wfile.write(data[start : len(data) // 2] if cut else data[start:])
+        self.close_connection = True
+
+
+def verify_fetch() -> int:
+    rng = random.Random(0)
+    names = [f"recording{idx}" for idx in range(NUM_RECORDINGS)]
+    files = {f"{name}.mp3": rng.randbytes(rng.randint(50_000, 400_000)) for name in names}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RecordingsHandler)
+    server.files, server.requests, server.cut, server.lock = files, [], set(), threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        audio_dir = os.path.join(tmp_dir, "audio")
+        ffmpeg = os.path.join(tmp_dir, "ffmpeg")
+        with open(ffmpeg, "w") as fout:
+            fout.write(f"#!{sys.executable}\n{FAKE_FFMPEG}")
+        os.chmod(ffmpeg, 0o755)
+        os.makedirs(audio_dir)
+        with open(os.path.join(audio_dir, f"{names[0]}.mp3"), "wb") as fout:
+            fout.write(files[f"{names[0]}.mp3"][:1000])  # an interrupted download of the old script
+        checksums = {name: hashlib.sha256(files[f"{name}.mp3"]).hexdigest() for name in names[:2]}
+
+        kwargs = {"audio_dir": audio_dir, "base_url": base_url, "downloads": 3, "jobs": 2, "ffmpeg": ffmpeg, "retries": 3}
+        failed = fetch_recordings(names, checksums=checksums, **kwargs)
+        if failed:
+            failures.append(f"failed to fetch {failed}")
+        for name in names:
+            for suffix in [".mp3", ".wav"]:
+                path = os.path.join(audio_dir, name + suffix)
+                if not os.path.isfile(path) or open(path, "rb").read() != files[f"{name}.mp3"]:
+                    failures.append(f"{name}{suffix} differs from the served file")
+        resumed = {name for name, start in server.requests if start > 0}
+        if len(resumed) != NUM_RECORDINGS:
+            failures.append(f"only {len(resumed)} of {NUM_RECORDINGS} downloads resumed")
+        leftovers = [name for name in os.listdir(audio_dir) if name.endswith((".part", ".tmp.wav"))]
+        if leftovers:
+            failures.append(f"left partial files {leftovers}")
+
+        num_requests = len(server.requests)
+        if fetch_recordings(names, **kwargs) or len(server.requests) != num_requests:
+            failures.append("the rerun fetched files again")
+
+        with open(os.path.join(audio_dir, f"{names[1]}.mp3"), "r+b") as fout:
+            fout.truncate(10)  # corrupted after the fact, must be fetched again
+        if fetch_recordings(names, **kwargs) or open(os.path.join(audio_dir, f"{names[1]}.mp3"), "rb").read() != files[f"{names[1]}.mp3"]:
+            failures.append(f"the truncated {names[1]}.mp3 was not fetched again")
+        if fetch_recordings(names[:1], checksums={names[0]: "0" * 64}, **{**kwargs, "retries": 0}) != names[:1]:
+            failures.append("a checksum mismatch was not reported")
+    server.shutdown()
+
+    for failure in failures:
+        print(failure)
+    print(f"Fetched {NUM_RECORDINGS} recordings with {len(server.requests)} requests, {len(failures)} checks failed")
+    return len(failures)
+
+
+if __name__ == "__main__":
+    sys.exit(1 if verify_fetch() else 0)
@@ -0,0 +1,162 @@
+#
+# For licensing see accompanying LICENSE file.
+# Copyright (C) 2022 Apple Inc. All Rights Reserved.
+#
+
+# Golden check for `text_normalizer.py`: runs the original replace-chain cleaning functions (kept below as the
+# reference) and the normalizer over every Miami utterance, and fails if any output differs
+import re
+import os
+import sys
+import glob
+import pylangacq
+from tqdm import tqdm
+from nltk.tokenize.treebank import TreebankWordDetokenizer
+from text_normalizer import NORMALIZER
+
+DETOKENIZER = TreebankWordDetokenizer()
+
+
+##### reference implementations #####
+def remove_leading_spaces_punct(sent: list) -> str:
+    new_sent = DETOKENIZER.detokenize(sent)
+    # doesn't get second sentence
+    if " ." in new_sent:
+        new_sent = new_sent.replace(" .", ".")
+    if " ?" in new_sent:
+        new_sent = new_sent.replace(" ?", "?")
+    if " ," in new_sent:
+        new_sent = new_sent.replace(" ,", ",")
+    return new_sent
+
+
+def clean_underscores(sent: str) -> str:
+    if "o_k" in sent:  # don't want to remove for o_k
+        sent = sent.replace("o_k", "ok")
+
+    new_sent = sent.replace("_", " ")
+    return new_sent
+
+
+def clean_up_common_markup_errors(sent: str) -> str:
+    all_chars_to_replace = [
+        "(.)",
+        "(..)",
+        "+//",
+        "<",
+        ">",
+        "+/.",
+        "+/?",
+        "/",
+        "...",
+        "..",
+        "++",
+        "+/",
+        "xxx",
+        "+",
+        '+"',
+        "+,",
+        "[",
+        "]",
+        "“",
+    ]
+    for char_phrase in all_chars_to_replace:
+        sent = sent.replace(char_phrase, "")
+
+    if '".' in sent:
+        sent.replace('".', ".")
+    if ":." in sent:
+        sent.replace(":.", ".")
+
+    if "@s:eng&spa" in sent:
+        sent = sent.replace("@s:eng&spa", "")
+
+    if re.search('".*"', sent) is None:
+        sent = sent.replace('"', "")
+    return sent
+
+
+def clean_translation(text: str) -> str:
+    text = clean_word_text(text)
+    text = [word for word in re.sub(r"\([^)]*\)", "", text).split(" ") if word != ""]
+    text = remove_leading_spaces_punct(text)
+    return text
+
+
+def clean_word_text(transcript):
+    transcript = clean_up_common_markup_errors(transcript)
+    detokenized_transcript = remove_leading_spaces_punct(transcript.split(" "))
+    clean_sent = clean_underscores(detokenized_transcript)
+    return clean_sent
+
+
+def make_transcript_manually(raw_utt: str) -> str:
+    filter_raw_utt = raw_utt.replace("<", "").replace(">", "")
+    only_words = filter_raw_utt.split(" ")[:-1]  # last one is timing
+    new_words = []
+    for word in only_words:
+        # words to replace
+        if "@" in word:
+            word = word[: word.find("@")]  # annotation for code-switching
+
+        if not len(word):
+            continue
+
+        if word[0] == "[" or word[-1] == "]":
+            continue  # don't need the markup
+
+        if word[0] == "&":
+            continue  # don't need partial starts
+
+        word = clean_up_common_markup_errors(word)
+        if len(word) == 0:
+            continue
+
+        if "+//." in word:
+            word = word.replace("+//.", ".")
+        if '".' in word:
+            word = word.replace('".', ".")
+
+        if "(" in word or ")" in word:
+            # NOTE: this is whether we remove parantheticals
+            word = re.sub(r"\([^)]*\)", "", word)
+
+        new_words.append(word)
+
+    detokenized_sent = remove_leading_spaces_punct(new_words)
+    clean_sent = clean_underscores(detokenized_sent)
+    return clean_sent
+
+
+def verify_normalizer(chat_file_location: str = "data/miami/beta") -> int:
+    checks = [
+        ("transcript", clean_word_text, NORMALIZER.clean_transcript),
+        ("raw transcript", make_transcript_manually, NORMALIZER.transcript_from_raw),
+        ("translation", clean_translation, NORMALIZER.clean_translation),
+    ]
+    num_checked = 0
+    num_failed = 0
+    for chat_file_path in tqdm(sorted(glob.glob(os.path.join(chat_file_location, "*.cha"))), leave=True):
+        reader = pylangacq.Reader.from_files([chat_file_path], parallel=False)
+        all_words = reader.words(by_utterances=True)
+        for idx, utterance in enumerate(reader.utterances()):
+            raw_utt = utterance.tiers[utterance.participant]
+            inputs = {
+                "transcript": [" ".join(all_words[idx])] + raw_utt.split(" "),  # the words are cleaned on their own too
+                "raw transcript": [raw_utt],
+                "translation": [utterance.tiers["%eng"]] if "%eng" in utterance.tiers else [],
+            }
+            for name, reference, normalizer in checks:
+                for text in inputs[name]:
+                    num_checked += 1
+                    expected, got = reference(text), normalizer(text)
+                    if expected != got:
+                        num_failed += 1
+                        print(f"{chat_file_path}:{idx} {name} {text!r}: expected {expected!r}, got {got!r}")
+
+    print(f"Checked {num_checked} strings, {num_failed} differ")
+    return num_failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if verify_normalizer() else 0)